@@ -12,5 +12,10 @@ setup(
         'Operating System :: OS Independent',
     ],
     packages=find_packages(),
-    install_requires=['cobra>=0.5.0', 'cloudpickle>=0.2.2'],
+    install_requires=['cobra>=0.5.0', 'cloudpickle>=0.2.2', 'numpy',
+                      'futures; python_version < "3"'],
+    extras_require={'benchmarks': ['pytest', 'pytest-benchmark']},
+    entry_points={
+        'console_scripts': ['theseus=theseus.cli:main'],
+    },
 )
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+
+"""Run the benchmarks in theseus/benchmarks/bench_*.py with pytest-benchmark.
+
+Each run is saved in .benchmarks at the top of the repository, named by the
+commit, so runs can be compared across commits.
+
+    python -m theseus.benchmarks                        # run and save
+    python -m theseus.benchmarks --compare              # compare with the last run
+    python -m theseus.benchmarks --compare --fail 10    # fail if a mean is 10% slower
+    python -m theseus.benchmarks -k load_model          # other arguments go to pytest
+
+Saved runs can also be listed and compared with pytest-benchmark compare
+--storage .benchmarks.
+
+"""
+
+from argparse import ArgumentParser
+from os.path import join, abspath, dirname
+import sys
+
+directory = dirname(abspath(__file__))
+storage = join(dirname(dirname(directory)), '.benchmarks')
+
+def pytest_args(compare=False, fail=None, save=True, extra=()):
+    """Get the pytest arguments for a benchmark run"""
+    args = [directory, '-o', 'python_files=bench_*.py',
+            '--benchmark-storage=file://' + storage,
+            '--benchmark-sort=fullname']
+    if save:
+        args.append('--benchmark-autosave')
+    if compare:
+        args.append('--benchmark-compare')
+        if fail is not None:
+            args.append('--benchmark-compare-fail=mean:%g%%' % fail)
+    return args + list(extra)
+
+def main(args=None):
+    parser = ArgumentParser(prog='python -m theseus.benchmarks',
+                            description='Run the theseus benchmarks')
+    parser.add_argument('--compare', action='store_true',
+                        help='Compare with the last saved run')
+    parser.add_argument('--fail', type=float, default=None, metavar='PERCENT',
+                        help='With --compare, fail if a mean is PERCENT slower')
+    parser.add_argument('--no-save', action='store_true', help='Do not save this run')
+    options, extra = parser.parse_known_args(args)
+
+    import pytest
+    return pytest.main(pytest_args(options.compare, options.fail, not options.no_save, extra))
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+
+"""Compare convert_ids with the previous implementation, which walked the
+model four times and removed boundary metabolites one at a time.
+
+Usage: python -m theseus.benchmarks.bench_convert_ids [iJO1366 RECON1 ...]
+
+"""
+
+from theseus.models import (check_for_model, load_raw_model, convert_ids,
+                            fix_legacy_id, id_for_new_id_style)
+
+from sys import argv
+import timeit
+
+def legacy_convert_ids(model, new_id_style):
+    """convert_ids as of theseus 0.2"""
+    for metabolite in model.metabolites:
+        metabolite.id = fix_legacy_id(metabolite.id, use_hyphens=False)
+    model.metabolites._generate_index()
+    for reaction in model.reactions:
+        reaction.id = fix_legacy_id(reaction.id, use_hyphens=False)
+    model.reactions._generate_index()
+    for metabolite_id in [str(x) for x in model.metabolites]:
+        metabolite = model.metabolites.get_by_id(metabolite_id)
+        if not metabolite.id.endswith("_b"):
+            continue
+        for reaction in list(metabolite._reaction):
+            if reaction.id.startswith("EX_"):
+                metabolite.remove_from_model()
+                break
+    model.metabolites._generate_index()
+    for reaction in model.reactions:
+        reaction.id = id_for_new_id_style(reaction.id, new_id_style=new_id_style)
+    model.reactions._generate_index()
+    for metabolite in model.metabolites:
+        metabolite.id = id_for_new_id_style(metabolite.id, is_metabolite=True, new_id_style=new_id_style)
+    model.metabolites._generate_index()
+    return model
+
+def ids(model):
+    return ([x.id for x in model.reactions], [x.id for x in model.metabolites],
+            {r.id: sorted(m.id for m in r._metabolites) for r in model.reactions})
+
+def bench(name, new_id_style, number=5):
+    raw = load_raw_model(name)
+    # both implementations must give the same ids
+    if ids(convert_ids(raw.copy(), new_id_style)) != ids(legacy_convert_ids(raw.copy(), new_id_style)):
+        raise Exception('convert_ids gives different ids for %s (%s)' % (name, new_id_style))
+
+    # time the conversion only, not the copy
+    copies = [raw.copy() for _ in range(number)]
+    new = timeit.timeit(lambda: convert_ids(copies.pop(), new_id_style), number=number) / number
+    copies = [raw.copy() for _ in range(number)]
+    old = timeit.timeit(lambda: legacy_convert_ids(copies.pop(), new_id_style), number=number) / number
+    return old, new
+
+def main(names):
+    print('%-12s %-9s %10s %10s %8s' % ('model', 'id style', 'old (ms)', 'new (ms)', 'speedup'))
+    for name in names:
+        found = check_for_model(name)
+        if found is None:
+            print('%-12s not found, skipping' % name)
+            continue
+        for new_id_style in 'cobrapy', 'simpheny':
+            old, new = bench(found, new_id_style)
+            print('%-12s %-9s %10.1f %10.1f %7.1fx' % (found, new_id_style, old * 1000,
+                                                       new * 1000, old / new))
+
+if __name__ == '__main__':
+    main(argv[1:] or ['iJO1366', 'RECON1'])
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+
+"""Benchmarks for convert_ids and the id functions it is built on.
+extra_info['ids'] is the number of ids per round, for throughput.
+
+Run with python -m theseus.benchmarks.
+
+"""
+
+from theseus.models import load_raw_model, convert_ids
+from theseus.ids import id_for_new_id_style, fix_legacy_id
+
+import pytest
+
+id_styles = ['cobrapy', 'simpheny']
+
+@pytest.fixture(scope='module')
+def raw():
+    return load_raw_model('iJO1366')
+
+@pytest.fixture(scope='module')
+def ids(raw):
+    return [x.id for x in raw.reactions], [x.id for x in raw.metabolites]
+
+@pytest.mark.parametrize('id_style', id_styles)
+def test_convert_ids(benchmark, raw, id_style):
+    # time the conversion only, not the copy
+    benchmark.pedantic(convert_ids, setup=lambda: ((raw.copy(), id_style), {}), rounds=5)
+
+def test_fix_legacy_id(benchmark, ids):
+    reaction_ids, metabolite_ids = ids
+    all_ids = reaction_ids + metabolite_ids
+    benchmark.extra_info['ids'] = len(all_ids)
+    benchmark(lambda: [fix_legacy_id(x, use_hyphens=False) for x in all_ids])
+
+@pytest.mark.parametrize('id_style', id_styles)
+def test_id_for_new_id_style(benchmark, ids, id_style):
+    reaction_ids, metabolite_ids = ids
+    benchmark.extra_info['ids'] = len(reaction_ids) + len(metabolite_ids)
+    def run():
+        for x in reaction_ids:
+            id_for_new_id_style(x, new_id_style=id_style)
+        for x in metabolite_ids:
+            id_for_new_id_style(x, is_metabolite=True, new_id_style=id_style)
+    benchmark(run)
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+
+"""Benchmarks for load_model, cold (processed from the source files) and warm
+(checked out from model_cache), for each bundled model and id style.
+
+Run with python -m theseus.benchmarks.
+
+"""
+
+from theseus.models import get_model_list, load_model, load_model_me, me_path, model_cache
+
+import os
+import pytest
+
+id_styles = ['cobrapy', 'simpheny']
+
+@pytest.mark.parametrize('id_style', id_styles)
+@pytest.mark.parametrize('name', get_model_list())
+def test_load_model_cold(benchmark, name, id_style):
+    benchmark.pedantic(load_model, args=(name, id_style), kwargs={'use_cache': False},
+                       rounds=3, warmup_rounds=1)
+
+@pytest.mark.parametrize('id_style', id_styles)
+@pytest.mark.parametrize('name', get_model_list())
+def test_load_model_warm(benchmark, name, id_style):
+    load_model(name, id_style)
+    benchmark(load_model, name, id_style)
+
+@pytest.mark.parametrize('name', get_model_list())
+def test_load_model_disk(benchmark, name):
+    # from the on-disk tier of model_cache
+    load_model(name)
+    benchmark.pedantic(load_model, args=(name,), setup=lambda: model_cache.clear(memory_only=True),
+                       rounds=5)
+
+@pytest.mark.skipif(not os.path.exists(me_path), reason='ME model not found')
+def test_load_model_me_warm(benchmark):
+    load_model_me(expressions=False)
+    benchmark.pedantic(load_model_me, kwargs={'expressions': False}, rounds=3)
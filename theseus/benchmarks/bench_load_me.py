@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+
+"""Time load_model('ME'): unpickling prototype_67.pickle (cold), checking out
+from the on-disk tier of model_cache (disk) and from the in-process tier
+(warm).
+
+Usage: python -m theseus.benchmarks.bench_load_me [number]
+
+"""
+
+from theseus.models import load_model_me, me_path, model_cache
+
+from sys import argv
+import os
+import timeit
+
+def bench(unmodified_me, number=3):
+    def cold():
+        return load_model_me(unmodified_me, expressions=False, use_cache=False)
+
+    def disk():
+        model_cache.clear(memory_only=True)
+        return load_model_me(unmodified_me, expressions=False)
+
+    def warm():
+        return load_model_me(unmodified_me, expressions=False)
+
+    cold_time = timeit.timeit(cold, number=number) / number
+    # fill the cache
+    load_model_me(unmodified_me, expressions=False)
+    disk_time = timeit.timeit(disk, number=number) / number
+    load_model_me(unmodified_me, expressions=False)
+    warm_time = timeit.timeit(warm, number=number) / number
+    return cold_time, disk_time, warm_time
+
+def main(number=3):
+    if not os.path.exists(me_path):
+        print('%s not found' % me_path)
+        return
+    print('%-11s %10s %10s %10s' % ('variant', 'cold (s)', 'disk (s)', 'warm (s)'))
+    for unmodified_me in True, False:
+        cold, disk, warm = bench(unmodified_me, number)
+        print('%-11s %10.2f %10.2f %10.2f' % ('unmodified' if unmodified_me else 'no glucose',
+                                              cold, disk, warm))
+
+if __name__ == '__main__':
+    main(int(argv[1]) if len(argv) > 1 else 3)
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+
+"""Benchmarks for the latency and throughput of the model server, with the
+server on a background thread and clients on a thread pool.
+
+Run with python -m theseus.benchmarks.
+
+"""
+
+from theseus.server import application, ModelLoader
+from theseus.cache import BodyCache
+
+from concurrent.futures import ThreadPoolExecutor
+from six.moves.urllib.request import urlopen
+from tornado.httpserver import HTTPServer
+from tornado.ioloop import IOLoop
+from tornado.testing import bind_unused_port
+import pytest
+import threading
+
+@pytest.fixture(scope='module')
+def base_url():
+    application.settings['loader'] = ModelLoader(ThreadPoolExecutor(4), max_queue=64)
+    application.settings['body_cache'] = BodyCache()
+    sock, port = bind_unused_port()
+    started = threading.Event()
+    loops = []
+    def run():
+        try:
+            import asyncio
+            asyncio.set_event_loop(asyncio.new_event_loop())
+        except ImportError:
+            pass
+        server = HTTPServer(application)
+        server.add_sockets([sock])
+        loops.append(IOLoop.current())
+        started.set()
+        loops[0].start()
+    thread = threading.Thread(target=run)
+    thread.daemon = True
+    thread.start()
+    started.wait()
+    yield 'http://127.0.0.1:%d' % port
+    loops[0].add_callback(loops[0].stop)
+    thread.join()
+    application.settings['loader'] = None
+    application.settings['body_cache'] = None
+
+def get(url):
+    response = urlopen(url)
+    try:
+        return response.read()
+    finally:
+        response.close()
+
+@pytest.mark.parametrize('path', ['/models', '/models/e_coli_core',
+                                  '/models/iJO1366?format=json'])
+def test_latency(benchmark, base_url, path):
+    # the first request loads and encodes the model
+    get(base_url + path)
+    benchmark(get, base_url + path)
+
+@pytest.mark.parametrize('clients', [1, 8, 32])
+def test_throughput(benchmark, base_url, clients):
+    requests = 64
+    url = base_url + '/models/e_coli_core'
+    get(url)
+    benchmark.extra_info['requests'] = requests
+    with ThreadPoolExecutor(clients) as executor:
+        benchmark.pedantic(lambda: list(executor.map(get, [url] * requests)), rounds=5)
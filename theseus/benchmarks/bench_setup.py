@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+
+"""Benchmarks for setup_model sweeps, add_pathway and model clones.
+
+Run with python -m theseus.benchmarks.
+
+"""
+
+from theseus.clone import clone_model
+from theseus.models import load_model, setup_model, add_pathway
+
+import pytest
+
+pathway = [{'1poh_c': {'formula': 'C3H8O', 'name': '1-propanol'}},
+           {'2OBUTDC': {'2obut_c': -1, 'h_c': -1, 'ppal_c': 1, 'co2_c': 1},
+            '1PDH': {'ppal_c': -1, 'nadh_c': -1, 'h_c': -1, '1poh_c': 1, 'nad_c': 1},
+            'EX_1poh_e': {'1poh_c': -1}},
+           {'EX_1poh_e': '1-propanol production'},
+           {'EX_1poh_e': (0, 1000)}]
+
+@pytest.fixture(scope='module')
+def model():
+    return load_model('iJO1366')
+
+def test_setup_model_sweep(benchmark, model):
+    # every carbon exchange, aerobic and anaerobic, on one model
+    substrates = [r.id for r in model.reactions
+                  if r.id.startswith('EX_') and
+                  any(m.elements.get('C', 0) > 0 for m in r._metabolites)]
+    benchmark.extra_info['conditions'] = 2 * len(substrates)
+    def sweep():
+        for substrate in substrates:
+            for aerobic in True, False:
+                setup_model(model, substrate, aerobic=aerobic)
+    benchmark.pedantic(sweep, rounds=3)
+
+def test_add_pathway(benchmark, model):
+    benchmark.pedantic(add_pathway, setup=lambda: ((model.copy(),) + tuple(pathway), {}),
+                       rounds=5)
+
+def test_add_pathway_check_mass_balance(benchmark, model):
+    benchmark.pedantic(add_pathway, setup=lambda: ((model.copy(),) + tuple(pathway),
+                                                   {'check_mass_balance': True}),
+                       rounds=5)
+
+def test_copy(benchmark, model):
+    benchmark(model.copy)
+
+def test_clone(benchmark, model):
+    benchmark(clone_model, model)
+
+def test_clone_pathway_experiment(benchmark, model):
+    # clone, add the pathway, set up a condition, diff and reset
+    def experiment():
+        clone = add_pathway(clone_model(model), *pathway)
+        setup_model(clone, 'EX_glc_e', aerobic=False)
+        clone.diff()
+        clone.reset()
+    benchmark(experiment)
@@ -1,3 +1,4 @@
 # -*- coding: utf-8 -*-
 
 from theseus.bigg.download import download_model
+from theseus.bigg.mirror import Mirror, mirror_models
@@ -1,21 +1,31 @@
 # -*- coding: utf-8 -*-
 
-try:
-    # Python 3
-    from urllib.request import urlopen
-    from urllib.error import HTTPError
-    get_charset = lambda headers: headers.get_content_charset()
-except ImportError:
-    # Python 2
-    from urllib2 import urlopen, HTTPError
-    get_charset = lambda headers: headers.getparam('charset')
-
-import cobra
-
-def _add_url_prefix(host, path):
-    return '/'.join([host.rstrip('/'), path.lstrip('/')])
-
-def download_model(model_id, host='http://bigg.ucsd.edu/api/v2/'):
+"""Download models from BiGG Models, through a local cache.
+
+Downloads are kept in data/model_pickles/bigg, in a directory for each host,
+as <model_id>.json with the ETag, Last-Modified and SHA-1 of the body (see
+theseus.bigg.mirror).
+
+"""
+
+from theseus.bigg.mirror import Mirror, file_sha1, _read_meta
+from theseus.catalog import data_path
+
+from os.path import join, exists, getmtime
+import hashlib
+import shutil
+import tempfile
+import time
+import warnings
+
+cache_directory = join(data_path, 'model_pickles', 'bigg')
+
+def host_directory(host):
+    """Get the cache directory for a BiGG Models host"""
+    return join(cache_directory, hashlib.sha1(host.encode('utf-8')).hexdigest()[:16])
+
+def download_model(model_id, host='http://bigg.ucsd.edu/api/v2/', use_cache=True,
+                   max_age=24 * 60 * 60, install=False, id_styles=('cobrapy',)):
     """Download a COBRA model from the BiGG Models database.
 
     TODO warn that the unicode downloaded from bigg_models will not play nice
@@ -28,12 +38,46 @@ def download_model(model_id, host='http://bigg.ucsd.edu/api/v2/'):
 
     host: The BiGG Models API host.
 
+    use_cache: If True, keep the download in the local cache. A cached copy
+    is used without asking the host if it was checked in the last max_age
+    seconds, and otherwise it is only downloaded again if it changed. If the
+    host cannot be reached, a cached copy is used.
+
+    max_age: Seconds that a cached copy is fresh. None to always check.
+
+    install: If True, also add the model to data/models and store the
+    processed model for each of id_styles (see theseus.models.install_model),
+    so load_model(model_id) is instant.
+
     """
-    url = _add_url_prefix(host, '/models/%s/download' % model_id)
+    directory = host_directory(host) if use_cache else tempfile.mkdtemp()
+    path = join(directory, model_id + '.json')
     try:
-        response = urlopen(url)
-    except HTTPError:
-        raise Exception('Could not download model %s from BiGG' % model_id)
-    json_str = response.read().decode(get_charset(response.headers) or 'utf-8')
-    model = cobra.io.json.from_json(json_str)
-    return model
+        fresh = (use_cache and max_age is not None and exists(path + '.meta') and
+                 time.time() - getmtime(path + '.meta') < max_age)
+        if not fresh:
+            mirror = Mirror(host=host, directory=directory)
+            try:
+                result = mirror.fetch(model_id)
+            finally:
+                mirror.close()
+            if result.status == 'failed':
+                if not exists(path):
+                    raise Exception('Could not download model %s from BiGG: %s' %
+                                    (model_id, result.error))
+                warnings.warn('Could not check for a new version of %s, using the cached '
+                              'copy: %s' % (model_id, result.error))
+
+        from cobra.io import load_json_model
+        model = load_json_model(path)
+
+        if install:
+            from theseus.models import install_model
+            installed = join(data_path, 'models', model_id + '.json')
+            sha1 = _read_meta(path + '.meta').get('sha1') or file_sha1(path)
+            if not exists(installed) or file_sha1(installed) != sha1:
+                install_model(model_id, model, path, id_styles)
+        return model
+    finally:
+        if not use_cache:
+            shutil.rmtree(directory)
@@ -0,0 +1,270 @@
+# -*- coding: utf-8 -*-
+
+"""Mirror models from BiGG Models into data/models.
+
+Models are fetched by a pool of threads. Each thread keeps its HTTP
+connections open between models. Bodies are streamed to <model_id>.json.part
+and renamed to <model_id>.json when they are complete. The ETag and
+Last-Modified headers and the SHA-1 of each file are kept next to it, in
+<model_id>.json.meta, so a later mirror only downloads models that changed,
+and an interrupted download resumes where it stopped.
+
+"""
+
+from theseus.catalog import data_path
+
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from os.path import join, exists, getsize
+from six.moves import http_client
+from six.moves.urllib.parse import urlsplit, urljoin
+import hashlib
+import json
+import os
+import re
+import socket
+import tempfile
+import threading
+import time
+
+MirrorResult = namedtuple('MirrorResult', ['model_id', 'status', 'path', 'size', 'error'])
+
+class _Retry(Exception):
+    pass
+
+# errors worth another try
+retry_errors = (_Retry, socket.error, http_client.HTTPException)
+
+def _add_url_prefix(host, path):
+    return '/'.join([host.rstrip('/'), path.lstrip('/')])
+
+def file_sha1(path, chunk_size=1024 * 1024):
+    """Get the SHA-1 hex digest of a file, read in chunks"""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _read_meta(path):
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+
+def _write_meta(path, meta):
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(meta, f)
+    os.rename(tmp, path)
+
+content_range_reg = re.compile(r'bytes\s+(\d+)-')
+
+def _range_start(content_range):
+    """Get the first byte of a Content-Range header, or None"""
+    m = content_range_reg.match(content_range or '')
+    return int(m.group(1)) if m else None
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+class Mirror(object):
+    """Download models from BiGG Models.
+
+    host: The BiGG Models API host.
+
+    directory: Where to save the models, as <model_id>.json.
+
+    workers: Number of concurrent downloads.
+
+    retries: Number of retries for connection errors, incomplete bodies, and
+    429 and 5xx responses. Retry n waits backoff * 2**n seconds.
+
+    """
+
+    def __init__(self, host='http://bigg.ucsd.edu/api/v2/', directory=join(data_path, 'models'),
+                 workers=8, retries=3, backoff=0.5, timeout=60, chunk_size=64 * 1024):
+        self.host = host
+        self.directory = directory
+        self.workers = workers
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.chunk_size = chunk_size
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = []
+
+    def _connection(self, scheme, netloc):
+        """Get the connection to netloc for this thread"""
+        connections = self._local.__dict__.setdefault('connections', {})
+        key = (scheme, netloc)
+        if key not in connections:
+            cls = http_client.HTTPSConnection if scheme == 'https' else http_client.HTTPConnection
+            connections[key] = cls(netloc, timeout=self.timeout)
+            with self._lock:
+                self._connections.append(connections[key])
+        return connections[key]
+
+    def _drop_connections(self):
+        """Close the connections of this thread, e.g. after an error"""
+        for connection in self._local.__dict__.pop('connections', {}).values():
+            connection.close()
+
+    def close(self):
+        with self._lock:
+            for connection in self._connections:
+                connection.close()
+            self._connections = []
+
+    def _request(self, url, headers, redirects=5):
+        """GET url on a reused connection, following redirects. Returns the
+        response, with the body unread."""
+        for _ in range(redirects + 1):
+            parts = urlsplit(url)
+            path = parts.path + ('?' + parts.query if parts.query else '')
+            connection = self._connection(parts.scheme, parts.netloc)
+            connection.request('GET', path, headers=headers)
+            response = connection.getresponse()
+            if response.status in (301, 302, 303, 307, 308):
+                response.read()
+                url = urljoin(url, response.getheader('Location'))
+                continue
+            return response
+        raise Exception('Too many redirects for %s' % url)
+
+    def list_models(self):
+        """Get the ids of the models in BiGG Models"""
+        response = self._request(_add_url_prefix(self.host, '/models'), {})
+        body = response.read()
+        if response.status != 200:
+            raise Exception('Could not list the models in BiGG (%d)' % response.status)
+        return [x['bigg_id'] for x in json.loads(body.decode('utf-8'))['results']]
+
+    def _fetch_once(self, model_id):
+        path = join(self.directory, model_id + '.json')
+        part = path + '.part'
+        url = _add_url_prefix(self.host, '/models/%s/download' % model_id)
+
+        headers = {}
+        offset = None
+        part_meta = _read_meta(part + '.meta')
+        validator = part_meta.get('etag') or part_meta.get('last_modified')
+        if exists(part) and validator:
+            # resume, if the model did not change
+            offset = getsize(part)
+            headers['Range'] = 'bytes=%d-' % offset
+            headers['If-Range'] = validator
+        elif exists(path):
+            meta = _read_meta(path + '.meta')
+            if meta.get('etag'):
+                headers['If-None-Match'] = meta['etag']
+            if meta.get('last_modified'):
+                headers['If-Modified-Since'] = meta['last_modified']
+
+        response = self._request(url, headers)
+        if response.status == 304:
+            response.read()
+            # record the check, for callers that want fresh copies
+            if exists(path + '.meta'):
+                os.utime(path + '.meta', None)
+            return MirrorResult(model_id, 'not modified', path, getsize(path), None)
+        if response.status == 416:
+            # the partial file is no good
+            response.read()
+            _remove(part)
+            raise _Retry('Could not resume %s' % model_id)
+        if response.status == 429 or response.status >= 500:
+            response.read()
+            raise _Retry('BiGG returned %d for %s' % (response.status, model_id))
+        if response.status not in (200, 206):
+            response.read()
+            raise Exception('Could not download model %s from BiGG (%d)' % (model_id,
+                                                                           response.status))
+
+        if (response.status == 206 and
+            (offset is None or _range_start(response.getheader('Content-Range')) != offset)):
+            # not the bytes we asked for, so start again from zero
+            response.read()
+            _remove(part)
+            _remove(part + '.meta')
+            raise _Retry('Bad Content-Range for %s' % model_id)
+
+        meta = {'etag': response.getheader('ETag'),
+                'last_modified': response.getheader('Last-Modified'),
+                'url': url}
+        if response.status == 200:
+            # the whole body, even if we asked for a range
+            mode = 'wb'
+            _write_meta(part + '.meta', meta)
+        else:
+            mode = 'ab'
+        length = response.getheader('Content-Length')
+        written = 0
+        with open(part, mode) as f:
+            while True:
+                chunk = response.read(self.chunk_size)
+                if not chunk:
+                    break
+                f.write(chunk)
+                written += len(chunk)
+        if length is not None and written != int(length):
+            raise _Retry('Incomplete body for %s' % model_id)
+
+        meta['sha1'] = file_sha1(part)
+        os.rename(part, path)
+        _write_meta(path + '.meta', meta)
+        _remove(part + '.meta')
+        return MirrorResult(model_id, 'downloaded', path, getsize(path), None)
+
+    def fetch(self, model_id):
+        """Download one model, with retries. Returns a MirrorResult with the
+        status 'downloaded', 'not modified' or 'failed'."""
+        if not exists(self.directory):
+            os.makedirs(self.directory)
+        attempt = 0
+        while True:
+            try:
+                return self._fetch_once(model_id)
+            except retry_errors as err:
+                self._drop_connections()
+                if attempt >= self.retries:
+                    return MirrorResult(model_id, 'failed', None, None, str(err))
+                time.sleep(self.backoff * 2 ** attempt)
+                attempt += 1
+            except Exception as err:
+                return MirrorResult(model_id, 'failed', None, None, str(err))
+
+    def mirror(self, model_ids=None, progress=None):
+        """Download many models concurrently.
+
+        model_ids: The models to download. Defaults to every model in BiGG.
+
+        progress: A function called with each MirrorResult as it finishes.
+
+        Returns a dictionary of model id to MirrorResult.
+
+        """
+        if model_ids is None:
+            model_ids = self.list_models()
+        results = {}
+        try:
+            with ThreadPoolExecutor(self.workers) as executor:
+                futures = [executor.submit(self.fetch, x) for x in model_ids]
+                for future in as_completed(futures):
+                    result = future.result()
+                    results[result.model_id] = result
+                    if progress is not None:
+                        progress(result)
+        finally:
+            self.close()
+        return results
+
+def mirror_models(model_ids=None, **kwargs):
+    """Download models from BiGG Models into data/models. Keyword arguments
+    are passed to Mirror. Returns a dictionary of model id to MirrorResult."""
+    return Mirror(**kwargs).mirror(model_ids)
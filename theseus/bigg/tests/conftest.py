@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+
+from six.moves.BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from six.moves.socketserver import ThreadingMixIn
+import json
+import pytest
+import threading
+
+class StandIn(ThreadingMixIn, HTTPServer):
+    """A stand-in for BiGG Models. Set fail to a number of 503s to return
+    first, truncate to a number of bytes to send before dropping the first
+    download, and range_shift to a number of bytes to shift the first partial
+    response by."""
+    daemon_threads = True
+
+    def __init__(self):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), Handler)
+        self.models = {'iAB': b'{"id": "iAB"}' * 1000, 'iCD': b'{"id": "iCD"}' * 10}
+        self.etags = {'iAB': '"v1"', 'iCD': '"v1"'}
+        self.fail = 0
+        self.truncate = None
+        self.range_shift = 0
+        self.requests = []
+        self.connections = set()
+        self.lock = threading.Lock()
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def send_body(self, status, body, headers={}):
+        self.send_response(status)
+        for k, v in headers.items():
+            self.send_header(k, v)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests.append((self.path, dict(self.headers)))
+            server.connections.add(self.client_address)
+            fail = server.fail > 0
+            server.fail -= 1
+        if fail:
+            return self.send_body(503, b'busy')
+        if self.path == '/api/v2/models':
+            results = [{'bigg_id': x} for x in sorted(server.models)]
+            return self.send_body(200, json.dumps({'results': results}).encode('utf-8'))
+        model_id = self.path.split('/')[-2]
+        if model_id not in server.models:
+            return self.send_body(404, b'not found')
+        body, etag = server.models[model_id], server.etags[model_id]
+        headers = {'ETag': etag}
+        if self.headers.get('If-None-Match') == etag:
+            return self.send_body(304, b'', headers)
+        status = 200
+        byte_range = self.headers.get('Range')
+        if byte_range and self.headers.get('If-Range') == etag:
+            start = int(byte_range.split('=')[1].rstrip('-'))
+            start, server.range_shift = start + server.range_shift, 0
+            headers['Content-Range'] = 'bytes %d-%d/%d' % (start, len(body) - 1, len(body))
+            body, status = body[start:], 206
+        if server.truncate is not None:
+            truncate, server.truncate = server.truncate, None
+            self.send_response(status)
+            for k, v in headers.items():
+                self.send_header(k, v)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body[:truncate])
+            self.close_connection = True
+            return
+        self.send_body(status, body, headers)
+
+@pytest.fixture
+def server():
+    server = StandIn()
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+@pytest.fixture
+def host(server):
+    return 'http://127.0.0.1:%d/api/v2/' % server.server_address[1]
+
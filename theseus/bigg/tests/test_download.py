@@ -7,3 +7,54 @@ def test_download_model():
     model = download_model('iJO1366')
     assert model.id == 'iJO1366'
     assert model.optimize().f > 0.1
+
+def test_download_model_cache(server, host, tmpdir, monkeypatch):
+    import cobra.io.json
+    from theseus.models import load_model
+    import theseus.bigg.download
+    monkeypatch.setattr(theseus.bigg.download, 'cache_directory', str(tmpdir))
+    server.models['e_coli_core'] = cobra.io.json.to_json(load_model('E coli core')).encode('utf-8')
+    server.etags['e_coli_core'] = '"v1"'
+
+    model = download_model('e_coli_core', host=host)
+    assert len(model.reactions) == 95
+    n = len(server.requests)
+    # fresh, so no requests
+    model = download_model('e_coli_core', host=host)
+    assert len(server.requests) == n
+    # stale, so check with the host
+    model = download_model('e_coli_core', host=host, max_age=None)
+    assert len(server.requests) == n + 1
+    assert server.requests[-1][1]['If-None-Match'] == '"v1"'
+    assert len(model.reactions) == 95
+
+    # without the cache
+    model = download_model('e_coli_core', host=host, use_cache=False)
+    assert len(model.reactions) == 95
+    assert server.requests[-1][1].get('If-None-Match') is None
+
+def test_download_model_install(server, host, tmpdir, monkeypatch):
+    import cobra.io.json
+    from theseus.cache import ModelCache
+    from theseus.catalog import ModelCatalog
+    import theseus.bigg.download
+    import theseus.models
+    server.models['e_coli_core'] = cobra.io.json.to_json(
+        theseus.models.load_model('E coli core')).encode('utf-8')
+    server.etags['e_coli_core'] = '"v1"'
+    data = tmpdir.mkdir('data')
+    data.mkdir('models')
+    data.mkdir('model_pickles')
+    monkeypatch.setattr(theseus.bigg.download, 'cache_directory', str(tmpdir.mkdir('bigg')))
+    monkeypatch.setattr(theseus.bigg.download, 'data_path', str(data))
+    monkeypatch.setattr(theseus.models, 'data_path', str(data))
+    monkeypatch.setattr(theseus.models, 'catalog',
+                        ModelCatalog(str(data.join('models')), str(data.join('model_pickles'))))
+    monkeypatch.setattr(theseus.models, 'model_cache', ModelCache(directory=None))
+
+    download_model('e_coli_core', host=host, install=True)
+    assert data.join('models', 'e_coli_core.json').check()
+    hits = theseus.models.model_cache.memory.hits
+    model = theseus.models.load_model('e_coli_core')
+    assert theseus.models.model_cache.memory.hits == hits + 1
+    assert len(model.reactions) == 95
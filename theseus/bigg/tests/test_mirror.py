@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+
+from theseus.bigg.mirror import *
+
+import os
+
+def test_mirror(server, host, tmpdir):
+    directory = str(tmpdir)
+    results = mirror_models(host=host, directory=directory, workers=2)
+    assert sorted(results) == ['iAB', 'iCD']
+    assert all(r.status == 'downloaded' for r in results.values())
+    with open(os.path.join(directory, 'iAB.json'), 'rb') as f:
+        assert f.read() == server.models['iAB']
+    assert not [x for x in os.listdir(directory) if x.endswith('.part')]
+
+    # conditional requests
+    results = mirror_models(['iAB', 'iCD'], host=host, directory=directory)
+    assert all(r.status == 'not modified' for r in results.values())
+    server.models['iAB'], server.etags['iAB'] = b'{"id": "iAB", "v": 2}', '"v2"'
+    results = mirror_models(['iAB', 'iCD'], host=host, directory=directory)
+    assert results['iAB'].status == 'downloaded'
+    assert results['iCD'].status == 'not modified'
+
+    # missing models fail without retries
+    n = len(server.requests)
+    result = mirror_models(['iXX'], host=host, directory=directory)['iXX']
+    assert result.status == 'failed'
+    assert len(server.requests) == n + 1
+
+def test_mirror_connection_reuse(server, host, tmpdir):
+    server.models.update(('m%d' % i, b'{}') for i in range(20))
+    server.etags.update(('m%d' % i, '"v1"') for i in range(20))
+    mirror = Mirror(host=host, directory=str(tmpdir), workers=2)
+    results = mirror.mirror(['m%d' % i for i in range(20)])
+    assert all(r.status == 'downloaded' for r in results.values())
+    assert len(server.connections) <= 2
+
+def test_mirror_retry_and_resume(server, host, tmpdir):
+    directory = str(tmpdir)
+    server.fail = 2
+    server.truncate = 5000
+    mirror = Mirror(host=host, directory=directory, backoff=0.01)
+    result = mirror.fetch('iAB')
+    assert result.status == 'downloaded'
+    with open(os.path.join(directory, 'iAB.json'), 'rb') as f:
+        assert f.read() == server.models['iAB']
+    # the last request picked up after the dropped body
+    path, headers = server.requests[-1]
+    assert headers['Range'] == 'bytes=5000-'
+
+    server.fail = 10
+    result = Mirror(host=host, directory=directory, retries=1, backoff=0.01).fetch('iCD')
+    assert result.status == 'failed'
+
+def test_mirror_bad_range(server, host, tmpdir):
+    directory = str(tmpdir)
+    body = server.models['iAB']
+    tmpdir.join('iAB.json.part').write_binary(body[:5000])
+    tmpdir.join('iAB.json.part.meta').write('{"etag": "\\"v1\\""}')
+    # the server answers with the wrong bytes
+    server.range_shift = 10
+    result = Mirror(host=host, directory=directory, backoff=0.01).fetch('iAB')
+    assert result.status == 'downloaded'
+    with open(os.path.join(directory, 'iAB.json'), 'rb') as f:
+        assert f.read() == body
+    # started again from zero
+    path, headers = server.requests[-1]
+    assert 'Range' not in headers
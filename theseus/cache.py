@@ -0,0 +1,391 @@
+# -*- coding: utf-8 -*-
+
+"""Caches for processed models and encoded responses.
+
+ModelCache keeps fully processed models (after convert_ids,
+get_formulas_from_names and turn_off_carbon_sources) as pickled bytes. The
+bytes live in a size-bounded, in-process LRU and in a directory on disk, so the
+cache survives restarts. Every checkout unpickles the bytes, so callers always
+get their own copy and cannot corrupt the cached instance.
+
+BodyCache keeps encoded response bodies for theseus.server, and can spill
+them to memory-mapped files. SharedBodyCache keeps every body in a
+memory-mapped file, for several server processes.
+
+"""
+
+from collections import OrderedDict
+from contextlib import contextmanager
+from os.path import join, abspath, dirname, exists
+import hashlib
+import mmap
+import os
+import pickle
+import sys
+import tempfile
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+cache_path = join(abspath(dirname(__file__)), 'data', 'model_pickles', 'processed')
+body_path = join(abspath(dirname(__file__)), 'data', 'model_pickles', 'bodies')
+
+# bump this when the load_model pipeline changes, so old cache entries are
+# ignored
+CACHE_VERSION = 3
+
+class LRUCache(object):
+    """A thread-safe LRU cache of byte strings, bounded by their total size.
+
+    max_bytes: The memory budget. Values larger than the budget are not cached.
+
+    on_evict: A function called with (key, value) for each evicted value,
+    including values that are larger than the budget.
+
+    """
+
+    def __init__(self, max_bytes=512 * 1024 * 1024, on_evict=None):
+        self.max_bytes = max_bytes
+        self.on_evict = on_evict
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key):
+        """Return the value for key, or None."""
+        with self._lock:
+            try:
+                value = self._entries.pop(key)
+            except KeyError:
+                self.misses += 1
+                return None
+            # move to the most recently used end
+            self._entries[key] = value
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """Add value for key, evicting the least recently used entries."""
+        evicted = []
+        with self._lock:
+            self._remove(key)
+            if len(value) > self.max_bytes:
+                evicted.append((key, value))
+            else:
+                self._entries[key] = value
+                self.size += len(value)
+            while self.size > self.max_bytes:
+                old_key, old_value = self._entries.popitem(last=False)
+                self.size -= len(old_value)
+                self.evictions += 1
+                evicted.append((old_key, old_value))
+        # call back outside the lock
+        if self.on_evict is not None:
+            for old_key, old_value in evicted:
+                self.on_evict(old_key, old_value)
+
+    def pop(self, key):
+        """Remove key from the cache and return its value, or None."""
+        with self._lock:
+            return self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def _remove(self, key):
+        value = self._entries.pop(key, None)
+        if value is not None:
+            self.size -= len(value)
+        return value
+
+def key_filename(key, readable=2, extension='pickle'):
+    """Get a file name for a cache key: the first readable parts of the key and
+    a digest of the whole key.
+
+    """
+    digest = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()[:16]
+    return '%s.%s.%s' % ('.'.join(str(x) for x in key[:readable]), digest, extension)
+
+def write_atomic(directory, filename, data):
+    """Write data to a file in directory, replacing other files with the same
+    readable prefix (see key_filename). Other processes never see half a
+    file.
+
+    """
+    if not exists(directory):
+        os.makedirs(directory)
+    # remove the stale entries with the same prefix
+    prefix = filename.rsplit('.', 2)[0] + '.'
+    for old in os.listdir(directory):
+        if old.startswith(prefix):
+            os.remove(join(directory, old))
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    os.rename(tmp, join(directory, filename))
+
+_thread_locks = {}
+_thread_locks_lock = threading.Lock()
+
+@contextmanager
+def file_lock(path):
+    """Hold an exclusive lock on path, across processes and threads. Without
+    fcntl (e.g. on Windows), only threads are excluded."""
+    if fcntl is None:
+        with _thread_locks_lock:
+            lock = _thread_locks.setdefault(path, threading.Lock())
+        with lock:
+            yield
+        return
+    # flock locks belong to the open file, so threads exclude each other too
+    with open(path, 'a') as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+def _cobra_version():
+    try:
+        import cobra
+    except ImportError:
+        return None
+    return cobra.__version__
+
+class ModelCache(object):
+    """Two-tier cache of processed models.
+
+    Keys are tuples that start with the model name and the id style, followed
+    by anything that identifies the source files (see
+    theseus.models.model_cache_key). On disk, the pickle protocol and the
+    Python and cobra versions are added to the key, and entries that cannot be
+    unpickled are dropped.
+
+    max_bytes: Memory budget for the in-process tier.
+
+    directory: Directory for the on-disk tier. If None, only the in-process
+    tier is used.
+
+    """
+
+    def __init__(self, max_bytes=512 * 1024 * 1024, directory=cache_path,
+                 protocol=pickle.HIGHEST_PROTOCOL):
+        self.memory = LRUCache(max_bytes)
+        self.directory = directory
+        self.protocol = protocol
+
+    def get(self, key):
+        """Check out a copy of the model for key, or return None."""
+        data = self.memory.get(key)
+        if data is None and self.directory is not None:
+            data = self._read(key)
+            if data is not None:
+                self.memory.put(key, data)
+        if data is None:
+            return None
+        try:
+            return pickle.loads(data)
+        except Exception:
+            # e.g. an unsupported protocol, or classes that changed
+            self.memory.pop(key)
+            self._remove(key)
+            return None
+
+    def put(self, key, model):
+        """Store a processed model. The cache keeps its own copy, so the caller
+        can go on modifying model."""
+        data = pickle.dumps(model, self.protocol)
+        self.memory.put(key, data)
+        if self.directory is not None:
+            self._write(key, data)
+
+    def clear(self, memory_only=False):
+        """Empty the cache. The directory belongs to the cache, so every file
+        in it is removed, including the files that theseus.models keeps next to
+        the models (e.g. id maps)."""
+        self.memory.clear()
+        if memory_only or self.directory is None or not exists(self.directory):
+            return
+        for filename in os.listdir(self.directory):
+            path = join(self.directory, filename)
+            try:
+                if os.path.isfile(path):
+                    os.remove(path)
+            except OSError:
+                # removed by another process
+                pass
+
+    def _filename(self, key):
+        # pickles from another Python or cobra version may not load here
+        return key_filename(key + (self.protocol, tuple(sys.version_info[:2]),
+                                   _cobra_version()))
+
+    def _read(self, key):
+        try:
+            with open(join(self.directory, self._filename(key)), 'rb') as f:
+                return f.read()
+        except (IOError, OSError):
+            return None
+
+    def _write(self, key, data):
+        try:
+            # replaces the stale entries for the same model and id style
+            write_atomic(self.directory, self._filename(key), data)
+        except (IOError, OSError):
+            # the on-disk tier is best effort
+            pass
+
+    def _remove(self, key):
+        if self.directory is None:
+            return
+        try:
+            os.remove(join(self.directory, self._filename(key)))
+        except OSError:
+            pass
+
+class BodyCache(object):
+    """Size-bounded cache of encoded response bodies.
+
+    Keys are tuples (model, id_style, format, protocol, encoding, etag).
+    Values are bytes, or read-only mmaps for bodies that were spilled to disk.
+    Both can be sliced without copying the whole body.
+
+    max_bytes: Memory budget for bodies held in memory.
+
+    spill_directory: If not None, bodies evicted from memory are written to
+    this directory and served from memory-mapped files.
+
+    """
+
+    def __init__(self, max_bytes=1024 * 1024 * 1024, spill_directory=None):
+        self.memory = LRUCache(max_bytes, on_evict=self._spill if spill_directory else None)
+        self.spill_directory = spill_directory
+        self.disk_hits = 0
+        self.spills = 0
+        self._mapped = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Get the body for key, or None."""
+        data = self.memory.get(key)
+        if data is None and self.spill_directory is not None:
+            data = self._map(key)
+        return data
+
+    def put(self, key, data):
+        self.memory.put(key, data)
+
+    def stats(self):
+        return {'hits': self.memory.hits + self.disk_hits,
+                'misses': self.memory.misses - self.disk_hits,
+                'evictions': self.memory.evictions,
+                'spills': self.spills,
+                'disk_hits': self.disk_hits,
+                'entries': len(self.memory),
+                'bytes': self.memory.size}
+
+    def _filename(self, key):
+        return key_filename(key, readable=5, extension='body')
+
+    def _spill(self, key, data):
+        try:
+            write_atomic(self.spill_directory, self._filename(key), data)
+        except (IOError, OSError):
+            return
+        with self._lock:
+            self.spills += 1
+            # bodies for an older etag are gone now
+            self._mapped = {k: v for k, v in self._mapped.items() if k[:5] != key[:5]}
+
+    def _map(self, key):
+        with self._lock:
+            data = self._mapped.get(key)
+            if data is None:
+                try:
+                    with open(join(self.spill_directory, self._filename(key)), 'rb') as f:
+                        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                except (IOError, OSError, ValueError):
+                    return None
+                self._mapped[key] = data
+            self.disk_hits += 1
+            return data
+
+class SharedBodyCache(BodyCache):
+    """A BodyCache for several server processes.
+
+    Every body is written to directory and served from a memory-mapped file,
+    so the processes share one copy of each body in the page cache. build
+    makes sure that each body is built by only one process.
+
+    """
+
+    def __init__(self, directory=body_path):
+        BodyCache.__init__(self, max_bytes=0, spill_directory=directory)
+        self.hits = 0
+        self.misses = 0
+        self.builds = 0
+
+    def get(self, key):
+        data = self._map(key)
+        with self._lock:
+            if data is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return data
+
+    def put(self, key, data):
+        if not exists(self.spill_directory):
+            os.makedirs(self.spill_directory)
+        self._spill(key, data)
+
+    def build(self, key, build):
+        """Get the body for key. If no process has it, call build() for the
+        body and store it. Bodies with the same model and id style (key[:2])
+        are built one at a time, so a model is processed once."""
+        data = self._map(key)
+        if data is not None:
+            return data
+        if not exists(self.spill_directory):
+            os.makedirs(self.spill_directory)
+        with file_lock(join(self.spill_directory, key_filename(key[:2], extension='lock'))):
+            # another process may have built it while we waited
+            data = self._map(key)
+            if data is None:
+                self.put(key, build())
+                with self._lock:
+                    self.builds += 1
+                data = self._map(key)
+        if data is None:
+            raise Exception('Could not store the body for %s' % (key[:2],))
+        return data
+
+    def stats(self):
+        sizes = []
+        if exists(self.spill_directory):
+            for filename in os.listdir(self.spill_directory):
+                try:
+                    if filename.endswith('.body'):
+                        sizes.append(os.path.getsize(join(self.spill_directory, filename)))
+                except OSError:
+                    # replaced by another process
+                    pass
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'builds': self.builds,
+                'entries': len(sizes),
+                'bytes': sum(sizes)}
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+
+"""Catalog of the model files in data/models and data/model_pickles."""
+
+from collections import namedtuple
+from os.path import join, abspath, dirname, splitext
+import os
+import threading
+import time
+
+data_path = join(abspath(dirname(__file__)), 'data')
+
+# model formats, in the order that load_model prefers them
+formats = ['.theseus', '.pickle', '.mat', '.xml', '.json']
+
+ModelFile = namedtuple('ModelFile', ['path', 'size', 'mtime'])
+
+def min_name(name):
+    """Normalize a model name: case insensitive, and ignore periods, spaces
+    and underscores"""
+    return name.lower().replace('.','').replace(' ','').replace('_','')
+
+def _scan(directory):
+    """Get (file name, size, mtime) for each file in directory"""
+    try:
+        entries = os.scandir(directory)
+    except AttributeError:
+        # Python 2
+        entries = None
+    except OSError:
+        return []
+    if entries is None:
+        try:
+            names = os.listdir(directory)
+        except OSError:
+            return []
+        result = []
+        for name in names:
+            st = os.stat(join(directory, name))
+            result.append((name, st.st_size, st.st_mtime))
+        return result
+    result = [(x.name, x.stat().st_size, x.stat().st_mtime) for x in entries if x.is_file()]
+    entries.close()
+    return result
+
+class ModelCatalog(object):
+    """An index of model files, refreshed when the directories change.
+
+    Models are listed if they have a file in models_directory. Compact files
+    and pickles in pickle_directory are added as other formats for listed
+    models.
+
+    check_interval: Check the directory mtimes at most this often (in
+    seconds). Use 0 to check on every call.
+
+    """
+
+    def __init__(self, models_directory=join(data_path, 'models'),
+                 pickle_directory=join(data_path, 'model_pickles'),
+                 formats=formats, check_interval=1.0):
+        self.models_directory = models_directory
+        self.pickle_directory = pickle_directory
+        self.formats = list(formats)
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._mtimes = None
+        self._last_check = None
+        self._files = {}
+        self._names = {}
+
+    def _directory_mtimes(self):
+        mtimes = []
+        for directory in self.models_directory, self.pickle_directory:
+            try:
+                mtimes.append(os.stat(directory).st_mtime)
+            except OSError:
+                mtimes.append(None)
+        return mtimes
+
+    def refresh(self, force=False):
+        """Rescan the directories if they changed, or if force is True"""
+        now = time.time()
+        if (not force and self._last_check is not None and
+            now - self._last_check < self.check_interval):
+            return
+        with self._lock:
+            self._last_check = now
+            mtimes = self._directory_mtimes()
+            if not force and mtimes == self._mtimes:
+                return
+            files, names = {}, {}
+            for filename, size, mtime in sorted(_scan(self.models_directory)):
+                name, extension = splitext(filename)
+                if extension not in self.formats or extension == '.pickle':
+                    continue
+                files.setdefault(name, {})[extension] = ModelFile(
+                    join(self.models_directory, filename), size, mtime)
+                names.setdefault(min_name(name), name)
+            for filename, size, mtime in _scan(self.pickle_directory):
+                name, extension = splitext(filename)
+                if extension in self.formats and name in files:
+                    files[name][extension] = ModelFile(
+                        join(self.pickle_directory, filename), size, mtime)
+            self._files, self._names, self._mtimes = files, names, mtimes
+
+    def names(self):
+        """Get the names of the models"""
+        self.refresh()
+        return sorted(self._files)
+
+    def find(self, name):
+        """Get the name of a model, case insensitive, and ignoring periods,
+        spaces and underscores. Returns None if the model is not found."""
+        self.refresh()
+        return self._names.get(min_name(name))
+
+    def files(self, name):
+        """Get a dictionary of format (e.g. '.xml') to ModelFile for a model.
+        The files are stat'ed again, because a file that is changed in place
+        does not change the mtime of its directory."""
+        self.refresh()
+        files = {}
+        for extension, x in self._files.get(name, {}).items():
+            try:
+                st = os.stat(x.path)
+            except OSError:
+                # removed since the last scan
+                continue
+            files[extension] = ModelFile(x.path, st.st_size, st.st_mtime)
+        return files
+
+    def preferred_files(self, name):
+        """Get the ModelFiles for a model, in the order of self.formats. Files
+        in pickle_directory are derived from the sources in models_directory,
+        so they are left out if they are older than the newest source."""
+        files = self.files(name)
+        newest = max([x.mtime for x in files.values()
+                      if dirname(x.path) == self.models_directory] or [0])
+        return [files[x] for x in self.formats if x in files and
+                (dirname(files[x].path) == self.models_directory or files[x].mtime >= newest)]
+
+# the catalog of bundled models
+catalog = ModelCatalog()
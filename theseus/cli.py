@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+
+"""The theseus command line interface.
+
+    theseus export iJO1366 iAF1260 --format json --format sbml
+    theseus export --all --format compact --output-dir exported
+
+"""
+
+from __future__ import print_function
+
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import cpu_count
+from os.path import join, exists, getmtime, dirname, abspath
+import hashlib
+import json
+import os
+import sys
+import time
+
+# format: file extension
+export_formats = {'json': '.json', 'sbml': '.xml', 'mat': '.mat', 'compact': '.theseus'}
+
+# records of the exported files, kept with the other derived files
+export_path = join(abspath(dirname(__file__)), 'data', 'model_pickles', 'exports')
+
+def _write(model, format, path):
+    if format == 'json':
+        from cobra.io import save_json_model
+        save_json_model(model, path)
+    elif format == 'sbml':
+        from cobra.io import write_sbml_model
+        write_sbml_model(model, path)
+    elif format == 'mat':
+        from cobra.io import save_matlab_model
+        save_matlab_model(model, path)
+    elif format == 'compact':
+        from theseus.compact import save_compact
+        save_compact(model, path)
+    else:
+        raise Exception('Invalid format %s' % format)
+
+def source_mtime(name):
+    """Get the latest mtime of the source files of a model in data/models"""
+    from theseus.catalog import catalog
+    mtimes = [x.mtime for x in catalog.files(name).values()
+              if dirname(x.path) == catalog.models_directory]
+    return max(mtimes) if mtimes else None
+
+def _export_record(path):
+    digest = hashlib.sha1(abspath(path).encode('utf-8')).hexdigest()[:16]
+    return join(export_path, digest + '.json')
+
+def exported_id_style(path):
+    """Get the id style that an output was exported in, or None if it was not
+    exported by theseus or changed since"""
+    try:
+        with open(_export_record(path), 'r') as f:
+            record = json.load(f)
+        if record.get('mtime') != getmtime(path):
+            return None
+        return record.get('id_style')
+    except (IOError, OSError, ValueError):
+        return None
+
+def _record_export(path, id_style):
+    from theseus.cache import write_atomic
+    record = {'path': abspath(path), 'id_style': id_style.lower(), 'mtime': getmtime(path)}
+    try:
+        write_atomic(export_path, os.path.basename(_export_record(path)),
+                     json.dumps(record).encode('utf-8'))
+    except (IOError, OSError):
+        # then the output is exported again next time
+        pass
+
+def export_model(name, formats, id_style='cobrapy', output_dir='.', force=False):
+    """Load a model once and save it in each of formats, as <name>.<extension>
+    in output_dir. Outputs that are newer than the source files and were
+    exported in the same id style are skipped, unless force is True. The id
+    style of each output is recorded in export_path, not in output_dir.
+
+    Returns a dictionary with the model name, load time, and a list of
+    (format, path, status, seconds) for the outputs.
+
+    """
+    from theseus.models import check_for_model, load_model
+
+    result = {'name': name, 'load': 0.0, 'outputs': []}
+    found = check_for_model(name)
+    if found is None:
+        result['outputs'] = [(x, None, 'not found', 0.0) for x in formats]
+        return result
+    result['name'] = found
+    mtime = source_mtime(found)
+    todo = []
+    for format in formats:
+        path = join(output_dir, name + export_formats[format])
+        if (not force and mtime is not None and exists(path) and getmtime(path) > mtime and
+            exported_id_style(path) == id_style.lower()):
+            result['outputs'].append((format, path, 'up to date', 0.0))
+        else:
+            todo.append((format, path))
+    if not todo:
+        return result
+
+    start = time.time()
+    try:
+        model = load_model(found, id_style=id_style)
+    except Exception as err:
+        result['outputs'] += [(format, path, 'error: %s' % err, 0.0) for format, path in todo]
+        return result
+    result['load'] = time.time() - start
+    for format, path in todo:
+        start = time.time()
+        try:
+            _write(model, format, path)
+            _record_export(path, id_style)
+            status = 'exported'
+        except Exception as err:
+            status = 'error: %s' % err
+        result['outputs'].append((format, path, status, time.time() - start))
+    return result
+
+def export(names, formats, id_style='cobrapy', output_dir='.', force=False, workers=None,
+           stream=None):
+    """Export models in parallel processes, and print a timing summary to
+    stream (default stdout). Returns the results of export_model, in the order
+    of names."""
+    stream = sys.stdout if stream is None else stream
+    if not exists(output_dir):
+        os.makedirs(output_dir)
+    workers = min(workers or cpu_count(), len(names)) if names else 1
+    start = time.time()
+    if workers == 1:
+        results = [export_model(name, formats, id_style, output_dir, force) for name in names]
+    else:
+        results = [None] * len(names)
+        with ProcessPoolExecutor(workers) as executor:
+            futures = {executor.submit(export_model, name, formats, id_style, output_dir,
+                                       force): i
+                       for i, name in enumerate(names)}
+            for future in as_completed(futures):
+                results[futures[future]] = future.result()
+
+    print('%-16s %-8s %9s %9s  %s' % ('model', 'format', 'load (s)', 'save (s)', 'status'),
+          file=stream)
+    for result in results:
+        for i, (format, path, status, seconds) in enumerate(result['outputs']):
+            load = '%9.2f' % result['load'] if i == 0 and result['load'] else '%9s' % ''
+            print('%-16s %-8s %s %9.2f  %s' % (result['name'], format, load, seconds, status),
+                  file=stream)
+    print('%d models in %.2f s with %d workers' % (len(names), time.time() - start, workers),
+          file=stream)
+    return results
+
+def main(args=None):
+    parser = ArgumentParser(prog='theseus', description='Tools for the theseus models')
+    subparsers = parser.add_subparsers(dest='command')
+    export_parser = subparsers.add_parser('export', help='Export models to other formats')
+    export_parser.add_argument('names', nargs='*', help='Model names, e.g. iJO1366')
+    export_parser.add_argument('--all', action='store_true', help='Export every model')
+    export_parser.add_argument('--format', action='append', choices=sorted(export_formats),
+                               help='Output format. Repeat for more than one. Default json')
+    export_parser.add_argument('--id-style', default='cobrapy', help='cobrapy or simpheny')
+    export_parser.add_argument('--output-dir', default='.', help='Default: current directory')
+    export_parser.add_argument('--workers', type=int, default=None,
+                               help='Number of processes. Default: number of cores')
+    export_parser.add_argument('--force', action='store_true',
+                               help='Export even if the output is newer than the source')
+    options = parser.parse_args(args)
+
+    if options.command != 'export':
+        parser.print_help()
+        return 1
+    names = options.names
+    if options.all:
+        from theseus.models import get_model_list
+        names = get_model_list()
+    if not names:
+        export_parser.error('Give model names, or --all')
+    results = export(names, options.format or ['json'], options.id_style, options.output_dir,
+                     options.force, options.workers)
+    failed = any(status.startswith('error') or status == 'not found'
+                 for result in results for _, _, status, _ in result['outputs'])
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
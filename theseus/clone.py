@@ -0,0 +1,332 @@
+# -*- coding: utf-8 -*-
+
+"""Copy-on-write clones of cobra models, for running many pathway and
+condition experiments on one loaded model.
+
+    base = load_model('iJO1366')
+    clone = clone_model(base)
+    add_pathway(clone, *pathway)
+    setup_model(clone, 'EX_glc__D_e')
+    clone.diff()      # what changed
+    clone.reset()     # back to base
+
+A clone shares the reactions, metabolites and genes of its base model. A
+reaction is copied the first time it is taken from clone.reactions (by id,
+index or iteration), so changing its bounds or objective coefficient does not
+change the base. The copy is shallow: it has its own attributes, and refers to
+the metabolites and genes of the base. clone.reactions.query,
+clone.reactions.list_attr, clone.objective and diff read the shared reactions,
+and copy only the ones they return. clone.optimize builds the problem from the
+shared reactions, so it copies none.
+
+Metabolites and genes are not copied, so change them on the base model, or add
+new ones to the clone. The reactions and metabolites that are added to a clone
+belong to it, and the shared metabolites and genes are not linked to them (so
+metabolite.reactions lists the reactions of the base). Remove reactions and
+metabolites with clone.remove_reactions and clone.remove_metabolites, which
+only change the clone.
+
+The base model must not change while it has clones. A clone pickles as a
+plain cobra Model.
+
+"""
+
+from theseus.exchanges import discard_exchange_index
+
+from cobra import Model, Reaction
+from cobra.core.DictList import DictList
+from cobra.core.Object import Object
+from collections import namedtuple
+from copy import copy
+from six import iteritems, string_types
+
+CloneDiff = namedtuple('CloneDiff', ['added_reactions', 'removed_reactions',
+                                     'added_metabolites', 'removed_metabolites',
+                                     'changed_reactions'])
+
+def _share(dict_list, cls=DictList, *args):
+    """Make a DictList of cls with the objects of dict_list, without copying
+    them"""
+    shared = cls(*args)
+    list.extend(shared, list.__getitem__(dict_list, slice(None)))
+    shared._dict = dict_list._dict.copy()
+    return shared
+
+def _copy_reaction(reaction, model):
+    """Make a shallow copy of reaction for model. The metabolites and genes are
+    shared."""
+    new = reaction.__class__.__new__(reaction.__class__)
+    for attr, value in iteritems(reaction.__dict__):
+        new.__dict__[attr] = copy(value) if isinstance(value, (dict, list, set)) else value
+    new._model = model
+    return new
+
+class CloneReactionList(DictList):
+    """The reactions of a ModelClone. Reactions are copied for the clone when
+    they are taken from the list."""
+
+    def __init__(self, clone=None, reactions=()):
+        DictList.__init__(self)
+        self._clone = clone
+        if reactions:
+            list.extend(self, list.__getitem__(reactions, slice(None)))
+            self._dict = reactions._dict.copy()
+
+    def _own(self, i):
+        reaction = list.__getitem__(self, i)
+        if reaction._model is not self._clone:
+            reaction = _copy_reaction(reaction, self._clone)
+            list.__setitem__(self, i, reaction)
+        return reaction
+
+    def iter_shared(self):
+        """Iterate over the reactions without copying them. Reactions that
+        the clone has not copied belong to the base model, so do not change
+        them."""
+        return list.__iter__(self)
+
+    def is_copied(self, id):
+        """Check whether the clone has its own copy of a reaction"""
+        return list.__getitem__(self, self._dict[id])._model is self._clone
+
+    def _generate_index(self):
+        self._dict = {v.id: k for k, v in enumerate(self.iter_shared())}
+
+    def get_by_id(self, id):
+        return self._own(self._dict[id])
+
+    def __getattr__(self, attr):
+        if '_dict' not in self.__dict__ or '_clone' not in self.__dict__:
+            raise AttributeError(attr)
+        try:
+            return self.get_by_id(attr)
+        except KeyError:
+            raise AttributeError('DictList has no attribute or entry %s' % attr)
+
+    def __getitem__(self, i):
+        if isinstance(i, int):
+            return self._own(i)
+        elif isinstance(i, slice):
+            return DictList(self._own(j) for j in range(*i.indices(len(self))))
+        return DictList(self._own(j) for j in i)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self._own(i)
+
+    def __reversed__(self):
+        for i in reversed(range(len(self))):
+            yield self._own(i)
+
+    def __copy__(self):
+        return DictList(self)
+
+    def __reduce__(self):
+        return (DictList, (), self.__getstate__(), self.__iter__())
+
+    def extend(self, iterable):
+        objects = list(iterable)
+        ids = set()
+        for x in objects:
+            self._check(x.id)
+            if x.id in ids:
+                raise ValueError("id '%s' is non-unique. Is it present twice?" % x.id)
+            ids.add(x.id)
+        self._extend_nocheck(objects)
+
+    def _extend_nocheck(self, iterable):
+        objects = list(iterable)
+        for i, x in enumerate(objects, len(self)):
+            self._dict[x.id] = i
+        list.extend(self, objects)
+
+    def pop(self, *args):
+        if len(self) > 0:
+            self._own(args[0] if args else -1)
+        return DictList.pop(self, *args)
+
+    def list_attr(self, attribute):
+        return [getattr(x, attribute) for x in self.iter_shared()]
+
+    def query(self, search_function, attribute='id'):
+        """Like DictList.query, but only the matching reactions are copied"""
+        matches = _share(self).query(search_function, attribute)
+        return DictList(self.get_by_id(x.id) for x in matches)
+
+class ModelClone(Model):
+    """A copy-on-write clone of a cobra Model. See the module docstring."""
+
+    def __init__(self, base):
+        Object.__init__(self, base.id, name=base.name)
+        for attr, value in iteritems(base.__dict__):
+            if attr not in ('reactions', 'metabolites', 'genes'):
+                self.__dict__[attr] = copy(value) if isinstance(value, (dict, list, set)) else value
+        self.base = base
+        self.reactions = CloneReactionList(self, base.reactions)
+        self.metabolites = _share(base.metabolites)
+        self.genes = _share(base.genes)
+
+    def __reduce__(self):
+        return (Model, (), self.copy().__dict__)
+
+    def _shared_model(self):
+        """Make a plain cobra Model with the reactions of the clone, without
+        copying them. Do not change it."""
+        model = Model.__new__(Model)
+        model.__dict__.update(self.__dict__)
+        del model.__dict__['base']
+        model.reactions = _share(self.reactions)
+        return model
+
+    def copy(self):
+        """Make an independent cobra Model with the contents of the clone"""
+        return self._shared_model().copy()
+
+    def optimize(self, objective_sense='maximize', **kwargs):
+        """Like Model.optimize, but the problem is built from the shared
+        reactions, so none are copied"""
+        from cobra.solvers import optimize
+        solution = optimize(self._shared_model(), objective_sense=objective_sense, **kwargs)
+        self.solution = solution
+        return solution
+
+    def _link(self, dict_list, obj, reaction):
+        """Get the object in the clone with the id of obj, adding obj if there
+        is none, and link it to reaction if it belongs to the clone"""
+        if not dict_list.has_id(obj.id):
+            obj._model = self
+            obj._reaction = set()
+            dict_list.append(obj)
+        existing = dict_list.get_by_id(obj.id)
+        if existing._model is self:
+            existing._reaction.add(reaction)
+        return existing
+
+    def add_reactions(self, reaction_list):
+        """Like Model.add_reactions, but the shared metabolites and genes are
+        not linked to the new reactions"""
+        reaction_list = DictList(reaction_list)
+        in_model = [x.id for x in reaction_list if self.reactions.has_id(x.id)]
+        if len(in_model) > 0:
+            raise Exception('Reactions already in the model: ' + ', '.join(in_model))
+        for reaction in reaction_list:
+            reaction._model = self
+            reaction._metabolites = {self._link(self.metabolites, m, reaction): v
+                                     for m, v in iteritems(reaction._metabolites)}
+            reaction._genes = set(self._link(self.genes, g, reaction) for g in reaction._genes)
+        self.reactions += reaction_list
+
+    def remove_reactions(self, reactions, delete=True, remove_orphans=False):
+        """Remove reactions (or ids) from the clone. delete is ignored, and
+        remove_orphans is not supported."""
+        if remove_orphans:
+            raise Exception('remove_orphans is not supported for a ModelClone')
+        if isinstance(reactions, string_types) or hasattr(reactions, 'id'):
+            reactions = [reactions]
+        for reaction in reactions:
+            reaction_id = getattr(reaction, 'id', reaction)
+            if not self.reactions.has_id(reaction_id):
+                continue
+            reaction = self.reactions.pop(self.reactions._dict[reaction_id])
+            for x in list(reaction._metabolites) + list(reaction._genes):
+                if x._model is self:
+                    x._reaction.discard(reaction)
+            reaction._model = None
+
+    def remove_metabolites(self, metabolites):
+        """Remove metabolites (or ids) from the clone, and from the reactions of
+        the clone that use them"""
+        if isinstance(metabolites, string_types) or hasattr(metabolites, 'id'):
+            metabolites = [metabolites]
+        removed = set(self.metabolites.get_by_id(getattr(x, 'id', x)) for x in metabolites
+                      if getattr(x, 'id', x) in self.metabolites)
+        if not removed:
+            return
+        for i, reaction in enumerate(self.reactions.iter_shared()):
+            if not removed.isdisjoint(reaction._metabolites):
+                reaction = self.reactions[i]
+                for metabolite in removed.intersection(reaction._metabolites):
+                    del reaction._metabolites[metabolite]
+        for metabolite in removed:
+            if metabolite._model is self:
+                metabolite._model = None
+        list.__setitem__(self.metabolites, slice(None),
+                         [x for x in self.metabolites if x not in removed])
+        self.metabolites._generate_index()
+
+    @property
+    def objective(self):
+        reactions = self.reactions
+        return {reactions[i]: r.objective_coefficient
+                for i, r in enumerate(reactions.iter_shared())
+                if r.objective_coefficient != 0}
+
+    @objective.setter
+    def objective(self, objectives):
+        # like Model.objective, but only the reactions in the old and new
+        # objectives are copied
+        for reaction in self.objective:
+            reaction.objective_coefficient = 0.
+        if isinstance(objectives, string_types + (Reaction, int)):
+            objectives = [objectives]
+        for key in objectives:
+            reaction = (self.reactions[key] if isinstance(key, int)
+                        else self.reactions.get_by_id(str(key)))
+            reaction.objective_coefficient = objectives[key] if hasattr(objectives, 'items') else 1.
+
+    def diff(self):
+        """Compare the clone with its base.
+
+        Returns a CloneDiff with sorted lists of the ids of the added and removed
+        reactions and metabolites, and changed_reactions, a dictionary of
+        reaction id to {attribute: (base value, clone value)} for the copied
+        reactions that changed. Changed stoichiometry is given for the
+        attribute 'metabolites' as {metabolite id: coefficient}.
+
+        """
+        base_reactions, base_metabolites = self.base.reactions, self.base.metabolites
+        added_reactions, changed = [], {}
+        for reaction in self.reactions.iter_shared():
+            if not base_reactions.has_id(reaction.id):
+                added_reactions.append(reaction.id)
+                continue
+            if reaction._model is not self:
+                continue
+            old = list.__getitem__(base_reactions, base_reactions._dict[reaction.id])
+            changes = {}
+            for attr in set(reaction.__dict__) | set(old.__dict__):
+                if attr in ('_model', '_metabolites'):
+                    continue
+                old_value, value = old.__dict__.get(attr), reaction.__dict__.get(attr)
+                if old_value != value:
+                    changes[attr.lstrip('_')] = (old_value, value)
+            if reaction._metabolites != old._metabolites:
+                changes['metabolites'] = tuple({m.id: v for m, v in iteritems(x._metabolites)}
+                                               for x in (old, reaction))
+            if changes:
+                changed[reaction.id] = changes
+        return CloneDiff(
+            sorted(added_reactions),
+            sorted(x for x in base_reactions._dict if not self.reactions.has_id(x)),
+            sorted(x for x in self.metabolites._dict if not base_metabolites.has_id(x)),
+            sorted(x for x in base_metabolites._dict if not self.metabolites.has_id(x)),
+            changed)
+
+    def reset(self):
+        """Undo all changes, so the clone matches its base again"""
+        for x in self.reactions.iter_shared():
+            if x._model is self:
+                x._model = None
+        for dict_list in (self.metabolites, self.genes):
+            for x in dict_list:
+                if x._model is self:
+                    x._model = None
+        self.reactions = CloneReactionList(self, self.base.reactions)
+        self.metabolites = _share(self.base.metabolites)
+        self.genes = _share(self.base.genes)
+        discard_exchange_index(self)
+        return self
+
+def clone_model(model):
+    """Make a copy-on-write clone of model"""
+    return ModelClone(model)
@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+
+"""A compact, memory-mappable model format.
+
+A .theseus file has three parts:
+
+    magic (8 bytes) | header length (8 bytes, little endian) | JSON header
+    | arrays, each aligned to 64 bytes
+
+The arrays hold the bounds, the objective coefficients and the stoichiometry,
+as CSR arrays with one row per reaction (the transpose of S). The header
+lists the arrays and holds a string table with the ids, names and other
+attributes of the model, reactions, metabolites and genes.
+
+"""
+
+from os.path import splitext
+from six import iteritems
+import json
+import mmap
+import numpy as np
+import os
+import struct
+import tempfile
+
+MAGIC = b'THESEUS\x01'
+ALIGN = 64
+VERSION = 1
+
+_model_attributes = ['id', 'name', 'compartments', 'notes', 'annotation']
+_reaction_attributes = ['id', 'name', 'subsystem', 'gene_reaction_rule', 'variable_kind',
+                        'notes', 'annotation']
+_metabolite_attributes = ['id', 'name', 'formula', 'charge', 'compartment', '_bound',
+                          '_constraint_sense', 'notes', 'annotation']
+_gene_attributes = ['id', 'name', 'notes', 'annotation']
+
+def _align(n):
+    return (n + ALIGN - 1) // ALIGN * ALIGN
+
+def _fix_type(value):
+    """Convert numpy types and legacy Formulas for JSON"""
+    if isinstance(value, np.floating):
+        return float(value)
+    if isinstance(value, np.integer):
+        return int(value)
+    if isinstance(value, np.bool_):
+        return bool(value)
+    if value.__class__.__name__ == 'Formula':
+        return str(value)
+    return value
+
+def _columns(objects, attributes):
+    return {a: [_fix_type(getattr(x, a, None)) for x in objects] for a in attributes}
+
+def model_to_arrays(model):
+    """Get the bounds, objective and CSR stoichiometry of a model as arrays"""
+    metabolite_index = {m.id: i for i, m in enumerate(model.metabolites)}
+    indptr, indices, data = [0], [], []
+    for reaction in model.reactions:
+        for metabolite, coefficient in iteritems(reaction._metabolites):
+            indices.append(metabolite_index[metabolite.id])
+            data.append(float(coefficient))
+        indptr.append(len(indices))
+    return {'lower_bound': np.array([r.lower_bound for r in model.reactions], dtype='<f8'),
+            'upper_bound': np.array([r.upper_bound for r in model.reactions], dtype='<f8'),
+            'objective_coefficient': np.array([r.objective_coefficient for r in model.reactions],
+                                              dtype='<f8'),
+            'indptr': np.array(indptr, dtype='<i8'),
+            'indices': np.array(indices, dtype='<i4'),
+            'data': np.array(data, dtype='<f8')}
+
+def model_to_strings(model):
+    """Get the string table for a model"""
+    return {'model': {a: _fix_type(getattr(model, a, None)) for a in _model_attributes},
+            'reactions': _columns(model.reactions, _reaction_attributes),
+            'metabolites': _columns(model.metabolites, _metabolite_attributes),
+            'genes': _columns(model.genes, _gene_attributes)}
+
+def save_compact(model, path):
+    """Save a model in the compact format. The file is replaced atomically."""
+    arrays = model_to_arrays(model)
+    layout, offset = {}, 0
+    for name in sorted(arrays):
+        layout[name] = {'dtype': arrays[name].dtype.str,
+                        'shape': list(arrays[name].shape),
+                        'offset': offset}
+        offset = _align(offset + arrays[name].nbytes)
+    header = json.dumps({'version': VERSION, 'arrays': layout,
+                         'strings': model_to_strings(model)}).encode('utf-8')
+    data_start = _align(len(MAGIC) + 8 + len(header))
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(MAGIC)
+            f.write(struct.pack('<Q', len(header)))
+            f.write(header)
+            for name in sorted(arrays):
+                f.write(b'\0' * (data_start + layout[name]['offset'] - f.tell()))
+                f.write(arrays[name].tobytes())
+        os.rename(tmp, path)
+    except:
+        os.remove(tmp)
+        raise
+
+class CompactModel(object):
+    """A memory-mapped compact model file.
+
+    arrays: Dictionary of read-only NumPy arrays (lower_bound, upper_bound,
+    objective_coefficient, and indptr, indices and data for the
+    stoichiometry, one row per reaction).
+
+    strings: The string table, with 'model', 'reactions', 'metabolites' and
+    'genes'. The last three are dictionaries of attribute to list.
+
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[:len(MAGIC)] != MAGIC:
+            raise Exception('%s is not a compact model file' % path)
+        header_length = struct.unpack('<Q', self._mmap[len(MAGIC):len(MAGIC) + 8])[0]
+        start = len(MAGIC) + 8
+        header = json.loads(self._mmap[start:start + header_length].decode('utf-8'))
+        if header['version'] != VERSION:
+            raise Exception('Unsupported compact model version %s' % header['version'])
+        data_start = _align(start + header_length)
+        self.arrays = {}
+        for name, spec in iteritems(header['arrays']):
+            count = int(np.prod(spec['shape']))
+            if count == 0:
+                array = np.empty(spec['shape'], dtype=spec['dtype'])
+            else:
+                array = np.frombuffer(self._mmap, dtype=spec['dtype'], count=count,
+                                      offset=data_start + spec['offset'])
+            self.arrays[name] = array.reshape(spec['shape'])
+        self.strings = header['strings']
+
+    def to_model(self):
+        """Build a cobra.Model"""
+        import cobra
+        from cobra.core.Gene import Gene
+
+        strings, arrays = self.strings, self.arrays
+        model = cobra.Model(strings['model']['id'])
+        for attribute, value in iteritems(strings['model']):
+            if attribute != 'id' and value is not None:
+                setattr(model, attribute, value)
+
+        metabolites = []
+        columns = strings['metabolites']
+        for i in range(len(columns['id'])):
+            metabolite = cobra.Metabolite(columns['id'][i])
+            for attribute in _metabolite_attributes[1:]:
+                setattr(metabolite, attribute, columns[attribute][i])
+            metabolites.append(metabolite)
+        model.add_metabolites(metabolites)
+
+        columns = strings['genes']
+        for i in range(len(columns['id'])):
+            gene = Gene(columns['id'][i])
+            for attribute in _gene_attributes[1:]:
+                setattr(gene, attribute, columns[attribute][i])
+            model.genes.append(gene)
+
+        reactions = []
+        columns = strings['reactions']
+        indptr, indices, data = arrays['indptr'], arrays['indices'], arrays['data']
+        lower_bound, upper_bound = arrays['lower_bound'].tolist(), arrays['upper_bound'].tolist()
+        objective_coefficient = arrays['objective_coefficient'].tolist()
+        for i in range(len(columns['id'])):
+            reaction = cobra.Reaction(columns['id'][i])
+            for attribute in _reaction_attributes[1:]:
+                setattr(reaction, attribute, columns[attribute][i])
+            reaction.lower_bound = lower_bound[i]
+            reaction.upper_bound = upper_bound[i]
+            reaction.objective_coefficient = objective_coefficient[i]
+            start, stop = indptr[i], indptr[i + 1]
+            for j, coefficient in zip(indices[start:stop].tolist(), data[start:stop].tolist()):
+                metabolite = metabolites[j]
+                reaction._metabolites[metabolite] = coefficient
+                metabolite._reaction.add(reaction)
+            reactions.append(reaction)
+        model.add_reactions(reactions)
+        return model
+
+    def close(self):
+        self.arrays = {}
+        self._mmap.close()
+
+def load_compact(path):
+    """Load a cobra.Model from a compact model file"""
+    return CompactModel(path).to_model()
+
+def convert_file(input_path, output_path=None):
+    """Convert a model file (.pickle, .mat, .xml or .json) to the compact
+    format. By default, the output goes next to the input, with the extension
+    .theseus.
+
+    """
+    from theseus.models import raw_loaders
+
+    base, extension = splitext(input_path)
+    if extension not in raw_loaders:
+        raise Exception('Unsupported model format %s' % extension)
+    if output_path is None:
+        output_path = base + '.theseus'
+    save_compact(raw_loaders[extension](input_path), output_path)
+    return output_path
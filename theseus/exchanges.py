@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+
+"""An index of the exchange reactions in a model and the elemental
+composition of their metabolites."""
+
+import numpy as np
+import weakref
+
+class ExchangeIndex(object):
+    """Exchange reactions (ids that start with EX_) and their elements.
+
+    The index refers to its model weakly, and to the reactions by position,
+    so it does not keep the model alive.
+
+    reactions: The exchange reactions.
+
+    elements: The elements found in the exchanged metabolites.
+
+    composition: An array of element counts, (len(reactions), len(elements)).
+
+    """
+
+    def __init__(self, model):
+        self._model = weakref.ref(model)
+        self.n_reactions = len(model.reactions)
+        self.n_metabolites = len(model.metabolites)
+        # query, so a theseus.clone.ModelClone only copies its exchanges
+        reactions = model.reactions.query(lambda x: x.startswith('EX_'))
+        self.positions = [model.reactions._dict[x.id] for x in reactions]
+        compositions = []
+        for reaction in reactions:
+            if len(reaction._metabolites) > 1:
+                raise Exception('%s not an exchange reaction' % str(reaction))
+            elements = {}
+            for metabolite in reaction._metabolites:
+                elements = metabolite.elements or {}
+            compositions.append(elements)
+        self.elements = sorted(set(e for x in compositions for e in x))
+        element_index = {e: i for i, e in enumerate(self.elements)}
+        self.composition = np.zeros((len(self.positions), len(self.elements)))
+        for i, elements in enumerate(compositions):
+            for element, count in elements.items():
+                self.composition[i, element_index[element]] = count
+
+    @property
+    def model(self):
+        return self._model()
+
+    @property
+    def reactions(self):
+        reactions = self.model.reactions
+        return [reactions[i] for i in self.positions]
+
+    def is_current(self, model):
+        """Check that the index belongs to model and that no reactions or
+        metabolites were added or removed"""
+        return (self.model is model and self.n_reactions == len(model.reactions) and
+                self.n_metabolites == len(model.metabolites))
+
+    def counts(self, element):
+        """Get an array with the number of atoms of element in the metabolite of
+        each exchange reaction"""
+        try:
+            return self.composition[:, self.elements.index(element)]
+        except ValueError:
+            return np.zeros(len(self.positions))
+
+    def lower_bounds(self):
+        return np.array([r.lower_bound for r in self.reactions], dtype=float)
+
+    def reactions_containing(self, element):
+        """Get the exchange reactions whose metabolite contains element"""
+        reactions = self.reactions
+        return [reactions[i] for i in np.flatnonzero(self.counts(element) > 0)]
+
+    def uptake_reactions(self, element):
+        """Get the exchange reactions that can take up element (lower bound
+        below zero)"""
+        reactions = self.reactions
+        mask = (self.counts(element) > 0) & (np.array([r.lower_bound for r in reactions]) < 0)
+        return [reactions[i] for i in np.flatnonzero(mask)]
+
+# the index of each model, kept off the model so it is not pickled with it
+_indexes = weakref.WeakKeyDictionary()
+
+def exchange_index(model, rebuild=False):
+    """Get the ExchangeIndex for a model. The index is kept for as long as the
+    model is, and it is rebuilt when it is out of date. It is not pickled with
+    the model, so a copy from pickle (e.g. from the model cache) builds its
+    own."""
+    index = _indexes.get(model)
+    if rebuild or index is None or not index.is_current(model):
+        index = _indexes[model] = ExchangeIndex(model)
+    return index
+
+def discard_exchange_index(model):
+    """Forget the ExchangeIndex of a model, e.g. after its reactions were
+    replaced"""
+    _indexes.pop(model, None)
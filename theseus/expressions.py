@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+
+"""Incremental compilation of the symbolic expressions of ME models.
+
+model.expressions has the layout of cobrame.solve.symbolic.compile_expressions:
+
+    (met_index, rxn_index): compiled stoichiometry
+    (None, rxn_index): (lower bound, upper bound)
+    (met_index, None): (metabolite bound, constraint sense)
+
+The ids of the reactions and metabolites that were compiled are kept in
+model._compiled_ids, so update_expressions only compiles reactions and
+metabolites that were added (or changed) since the last compile.
+
+"""
+
+from six import iteritems
+import os
+import tempfile
+
+EXPRESSIONS_VERSION = 1
+
+_have_symbolic = None
+
+def have_symbolic():
+    """Check for sympy and cobrame, which are imported on the first call"""
+    global _have_symbolic
+    if _have_symbolic is None:
+        try:
+            import sympy
+            import cobrame.solve.symbolic
+            _have_symbolic = True
+        except ImportError:
+            _have_symbolic = False
+    return _have_symbolic
+
+def _compile(expression, variable):
+    from sympy import Basic, lambdify
+    return lambdify(variable, expression) if isinstance(expression, Basic) else expression
+
+def reaction_expressions(model, index, variable=None):
+    """Compile the expressions for the reaction at index"""
+    from sympy import Basic, lambdify
+    from cobrame.util import mu
+
+    variable = mu if variable is None else variable
+    reaction = model.reactions[index]
+    expressions = {}
+    for metabolite, coefficient in iteritems(reaction._metabolites):
+        if isinstance(coefficient, Basic):
+            expressions[(model.metabolites.index(metabolite), index)] = \
+                lambdify(variable, coefficient)
+    if isinstance(reaction.lower_bound, Basic) or isinstance(reaction.upper_bound, Basic):
+        expressions[(None, index)] = (_compile(reaction.lower_bound, variable),
+                                      _compile(reaction.upper_bound, variable))
+    return expressions
+
+def metabolite_expressions(model, index, variable=None):
+    """Compile the expression for the bound of the metabolite at index"""
+    from sympy import Basic
+    from cobrame.util import mu
+
+    variable = mu if variable is None else variable
+    metabolite = model.metabolites[index]
+    if isinstance(metabolite._bound, Basic):
+        return {(index, None): (_compile(metabolite._bound, variable),
+                                metabolite._constraint_sense)}
+    return {}
+
+def _ids(dict_list):
+    return [x.id for x in dict_list]
+
+def _is_prefix(ids, dict_list):
+    """Check that the first objects in dict_list have ids"""
+    return len(ids) <= len(dict_list) and all(
+        x.id == y for x, y in zip(dict_list, ids))
+
+def update_expressions(model, reactions=(), metabolites=(), variable=None):
+    """Compile the expressions of an ME model that were added since the last
+    compile, and merge them into model.expressions.
+
+    reactions, metabolites: Reactions or metabolites (or ids) that changed
+    since the last compile, and should be compiled again.
+
+    If model.expressions was not compiled by update_expressions, or if
+    reactions or metabolites were removed or reordered since, everything is
+    compiled.
+
+    """
+    expressions = getattr(model, 'expressions', None)
+    compiled = getattr(model, '_compiled_ids', None)
+    if (expressions is None or compiled is None or
+        not _is_prefix(compiled[0], model.reactions) or
+        not _is_prefix(compiled[1], model.metabolites)):
+        from cobrame.solve.symbolic import compile_expressions
+        if variable is None:
+            model.expressions = compile_expressions(model)
+        else:
+            model.expressions = compile_expressions(model, variable)
+        model._compiled_ids = (_ids(model.reactions), _ids(model.metabolites))
+        return model.expressions
+
+    compiled_reactions, compiled_metabolites = compiled
+    reaction_indices = set(model.reactions.index(r) for r in reactions)
+    metabolite_indices = set(model.metabolites.index(m) for m in metabolites)
+    if reaction_indices or metabolite_indices:
+        for key in list(expressions):
+            if ((key[1] is not None and key[1] in reaction_indices) or
+                (key[1] is None and key[0] in metabolite_indices)):
+                del expressions[key]
+    reaction_indices.update(range(len(compiled_reactions), len(model.reactions)))
+    metabolite_indices.update(range(len(compiled_metabolites), len(model.metabolites)))
+
+    for i in sorted(reaction_indices):
+        expressions.update(reaction_expressions(model, i, variable))
+    for i in sorted(metabolite_indices):
+        expressions.update(metabolite_expressions(model, i, variable))
+    model._compiled_ids = (_ids(model.reactions), _ids(model.metabolites))
+    return expressions
+
+def remove_expressions(model, reactions=(), metabolites=()):
+    """Drop the compiled expressions of reactions and metabolites (or ids)
+    that are about to be removed from model, and renumber the others, so the
+    next update_expressions stays incremental. Call it before they are
+    removed."""
+    expressions = getattr(model, 'expressions', None)
+    compiled = getattr(model, '_compiled_ids', None)
+    if expressions is None or compiled is None:
+        return
+    compiled_reactions, compiled_metabolites = compiled
+    removed_reactions = set(getattr(x, 'id', x) for x in reactions)
+    removed_metabolites = set(getattr(x, 'id', x) for x in metabolites)
+
+    def renumber(ids, removed):
+        # old index: new index, or None if removed
+        new_index, i = {}, 0
+        for j, x in enumerate(ids):
+            if x in removed:
+                new_index[j] = None
+            else:
+                new_index[j] = i
+                i += 1
+        return new_index
+    reaction_index = renumber(compiled_reactions, removed_reactions)
+    metabolite_index = renumber(compiled_metabolites, removed_metabolites)
+    if (all(reaction_index[j] == j for j in reaction_index) and
+        all(metabolite_index[j] == j for j in metabolite_index)):
+        # nothing that was compiled is removed
+        return
+
+    updated = {}
+    for (met, rxn), value in iteritems(expressions):
+        new_met = None if met is None else metabolite_index.get(met)
+        new_rxn = None if rxn is None else reaction_index.get(rxn)
+        if (met is not None and new_met is None) or (rxn is not None and new_rxn is None):
+            continue
+        updated[(new_met, new_rxn)] = value
+    model.expressions = updated
+    model._compiled_ids = ([x for x in compiled_reactions if x not in removed_reactions],
+                           [x for x in compiled_metabolites if x not in removed_metabolites])
+
+def expressions_path(model_path):
+    """The path of the compiled expressions cache for an ME model file"""
+    return os.path.splitext(model_path)[0] + '.expressions.pickle'
+
+def _source_stats(model_path):
+    st = os.stat(model_path)
+    return (st.st_size, st.st_mtime)
+
+def save_expressions(model, model_path):
+    """Save the compiled expressions of a model, loaded from model_path, next
+    to it. The functions are serialized with cloudpickle."""
+    import cloudpickle
+
+    data = cloudpickle.dumps({'version': EXPRESSIONS_VERSION,
+                              'source': _source_stats(model_path),
+                              'compiled_ids': model._compiled_ids,
+                              'expressions': model.expressions})
+    path = expressions_path(model_path)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.rename(tmp, path)
+    except:
+        os.remove(tmp)
+        raise
+
+def load_expressions(model, model_path):
+    """Set model.expressions from the cache next to model_path. Returns False
+    if there is no cache, or if it is out of date."""
+    import pickle
+
+    try:
+        with open(expressions_path(model_path), 'rb') as f:
+            data = pickle.load(f)
+    except Exception:
+        return False
+    if (data.get('version') != EXPRESSIONS_VERSION or
+        data.get('source') != _source_stats(model_path) or
+        list(data['compiled_ids'][0]) != _ids(model.reactions) or
+        list(data['compiled_ids'][1]) != _ids(model.metabolites)):
+        return False
+    model.expressions = data['expressions']
+    model._compiled_ids = data['compiled_ids']
+    return True
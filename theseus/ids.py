@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+
+"""Translate ids between id styles.
+
+The translator memoizes every (id, is_metabolite, style) it sees, because
+the same ids (atp_c, h_c, ...) come up again and again across models.
+
+"""
+
+import re
+
+# legacy escapes, in the order they used to be replaced
+legacy_escapes = [('_DASH_', '__'),
+                  ('_FSLASH_', '/'),
+                  ('_BSLASH_', "\\"),
+                  ('_LPAREN_', '('),
+                  ('_LSQBKT_', '['),
+                  ('_RSQBKT_', ']'),
+                  ('_RPAREN_', ')'),
+                  ('_COMMA_', ','),
+                  ('_PERIOD_', '.'),
+                  ('_APOS_', "'"),
+                  ('&amp;', '&'),
+                  ('&lt;', '<'),
+                  ('&gt;', '>'),
+                  ('&quot;', '"')]
+_escape_dict = dict(legacy_escapes)
+_escape_names = '|'.join(x.strip('_') for x, _ in legacy_escapes if x.startswith('_'))
+_escape_re = re.compile('|'.join(re.escape(x) for x, _ in legacy_escapes))
+_escape_hyphen_re = re.compile('|'.join([re.escape(x) for x, _ in legacy_escapes] + ['-']))
+# Escapes that share an underscore (_LPAREN_DASH_), or an &amp; that makes a
+# new entity, depend on the order of the replacements. These rare ids go
+# through the sequential replacements.
+_order_dependent_re = re.compile(r'_(?:%s)_(?:%s)_|&amp;(?:lt|gt|quot);' %
+                                 (_escape_names, _escape_names))
+
+def _replace_escape(match):
+    return _escape_dict.get(match.group(0), '__')
+
+def _fix_legacy_id_sequential(id, use_hyphens=False):
+    for escape, replacement in legacy_escapes:
+        id = id.replace(escape, replacement)
+    if use_hyphens:
+        id = id.replace('__', '-')
+    else:
+        id = id.replace("-", "__")
+    return id
+
+def _fix_legacy_id(id, use_hyphens=False):
+    if _order_dependent_re.search(id):
+        return _fix_legacy_id_sequential(id, use_hyphens)
+    if use_hyphens:
+        return _escape_re.sub(_replace_escape, id).replace('__', '-')
+    # '-' becomes '__' in the same pass
+    return _escape_hyphen_re.sub(_replace_escape, id)
+
+# the regex to separate the base id, the chirality ('_L') and the compartment ('_c')
+reg = re.compile(r'(.*?)(?:(.*[^_])_([LDSR]))?[_\(\[]([a-z])[_\)\]]?$')
+
+def _join_cobrapy(the_id, the_compartment, is_metabolite):
+    if the_compartment:
+        the_id = the_id+'_'+the_compartment
+    return the_id.replace('-', '__')
+
+def _join_simpheny(the_id, the_compartment, is_metabolite):
+    if the_compartment and is_metabolite:
+        the_id = the_id+'['+the_compartment+']'
+    elif the_compartment:
+        the_id = the_id+'('+the_compartment+')'
+    return the_id.replace('__', '-')
+
+_join_parts = {'cobrapy': _join_cobrapy, 'simpheny': _join_simpheny}
+
+def _id_for_new_id_style(old_id, is_metabolite, join_parts):
+    # separate the base id, the chirality ('_L') and the compartment ('_c')
+    m = reg.match(old_id)
+    if m is None:
+        # still change the underscore/dash
+        new_id = join_parts(old_id, None, is_metabolite)
+    elif m.group(2) is None:
+        new_id = join_parts(m.group(1), m.group(4), is_metabolite)
+    else:
+        # if the chirality is not joined by two underscores, then fix that
+        new_id = join_parts(m.group(2) + '__' + m.group(3), m.group(4), is_metabolite)
+
+    # deal with inconsistent notation of (sec) vs. [sec] in iJO1366 versions
+    if 'sec' in new_id:
+        new_id = new_id.replace('[sec]', '_sec_').replace('(sec)', '_sec_')
+
+    return new_id
+
+def _get_join_parts(new_id_style):
+    try:
+        return _join_parts[new_id_style.lower()]
+    except KeyError:
+        raise Exception('Invalid id style')
+
+class IdTranslator(object):
+    """Memoized id translation.
+
+    max_size: The maximum number of memoized ids. When the memo is full, it is
+    cleared.
+
+    """
+
+    def __init__(self, max_size=200000):
+        self.max_size = max_size
+        self._memo = {}
+
+    def __len__(self):
+        return len(self._memo)
+
+    def clear(self):
+        self._memo.clear()
+
+    def _remember(self, key, value):
+        if len(self._memo) >= self.max_size:
+            self._memo.clear()
+        self._memo[key] = value
+        return value
+
+    def id_for_new_id_style(self, old_id, is_metabolite=False, new_id_style='cobrapy'):
+        """Get the new style id"""
+        key = (old_id, is_metabolite, new_id_style)
+        try:
+            return self._memo[key]
+        except KeyError:
+            return self._remember(key, _id_for_new_id_style(old_id, is_metabolite,
+                                                            _get_join_parts(new_id_style)))
+
+    def fix_legacy_id(self, id, use_hyphens=False):
+        """Replace the escapes in a legacy SBML id"""
+        key = (id, use_hyphens)
+        try:
+            return self._memo[key]
+        except KeyError:
+            return self._remember(key, _fix_legacy_id(id, use_hyphens))
+
+    def ids_for_new_id_style(self, old_ids, is_metabolite=False, new_id_style='cobrapy'):
+        """Get the new style ids for a list of ids"""
+        memo = self._memo
+        join_parts = _get_join_parts(new_id_style)
+        new_ids = []
+        for old_id in old_ids:
+            key = (old_id, is_metabolite, new_id_style)
+            new_id = memo.get(key)
+            if new_id is None:
+                new_id = self._remember(key, _id_for_new_id_style(old_id, is_metabolite,
+                                                                  join_parts))
+            new_ids.append(new_id)
+        return new_ids
+
+    def fix_legacy_ids(self, ids, use_hyphens=False):
+        """Replace the escapes in a list of legacy SBML ids"""
+        memo = self._memo
+        new_ids = []
+        for id in ids:
+            key = (id, use_hyphens)
+            new_id = memo.get(key)
+            if new_id is None:
+                new_id = self._remember(key, _fix_legacy_id(id, use_hyphens))
+            new_ids.append(new_id)
+        return new_ids
+
+# the shared translator
+translator = IdTranslator()
+
+def id_for_new_id_style(old_id, is_metabolite=False, new_id_style='cobrapy'):
+    """ Get the new style id"""
+    return translator.id_for_new_id_style(old_id, is_metabolite, new_id_style)
+
+def ids_for_new_id_style(old_ids, is_metabolite=False, new_id_style='cobrapy'):
+    """Get the new style ids for a list of ids"""
+    return translator.ids_for_new_id_style(old_ids, is_metabolite, new_id_style)
+
+def fix_legacy_id(id, use_hyphens=False):
+    return translator.fix_legacy_id(id, use_hyphens)
+
+def fix_legacy_ids(ids, use_hyphens=False):
+    return translator.fix_legacy_ids(ids, use_hyphens)
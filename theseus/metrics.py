@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+
+"""Stage timers and counters for the load pipeline and the server.
+
+    with metrics.stage('convert_ids', model='iJO1366'):
+        ...
+    metrics.count('bytes_served', len(data), model='iJO1366')
+
+Metrics go to sinks (LoggingSink, HistogramSink, or any object with record and
+count methods). They are off until enable is called with a sink. While they
+are off, stage returns a shared no-op context manager and count returns at
+once, so the instrumentation costs one check of a global.
+
+Each stage records its wall time and the growth of the peak resident memory
+of the process during the stage. Metrics are recorded in the process where
+the stage runs, so with a process pool (theseus.server --executor=process),
+the stages of model loads are recorded in the workers.
+
+"""
+
+from collections import deque, namedtuple
+from os.path import join
+import logging
+import os
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+timer = getattr(time, 'perf_counter', time.time)
+
+StageRecord = namedtuple('StageRecord', ['stage', 'model', 'seconds', 'memory', 'error'])
+
+_sinks = []
+_profile_directory = None
+
+def enable(*sinks, **kwargs):
+    """Send metrics to sinks.
+
+    profile_directory: If given, profile() dumps cProfile stats there.
+
+    """
+    _sinks.extend(sinks)
+    if kwargs.get('profile_directory'):
+        global _profile_directory
+        _profile_directory = kwargs['profile_directory']
+        if not os.path.exists(_profile_directory):
+            os.makedirs(_profile_directory)
+
+def disable():
+    """Remove the sinks and stop profiling"""
+    global _profile_directory
+    del _sinks[:]
+    _profile_directory = None
+
+def enabled():
+    return len(_sinks) > 0
+
+def sinks():
+    return list(_sinks)
+
+def max_rss():
+    """Peak resident memory of the process in bytes, or 0 if unknown"""
+    if resource is None:
+        return 0
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes, except on macOS
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+def record(stage, seconds, model=None, memory=0, error=None):
+    """Send a stage that was timed elsewhere (e.g. a request) to the sinks"""
+    if _sinks:
+        stage_record = StageRecord(stage, model, seconds, memory, error)
+        for sink in _sinks:
+            sink.record(stage_record)
+
+def count(name, value=1, model=None):
+    """Add value to a counter, e.g. cache hits or bytes served"""
+    if _sinks:
+        for sink in _sinks:
+            sink.count(name, value, model)
+
+class _NullStage(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+_null_stage = _NullStage()
+
+class Stage(object):
+    __slots__ = ['name', 'model', 'start', 'start_rss']
+
+    def __init__(self, name, model):
+        self.name = name
+        self.model = model
+
+    def __enter__(self):
+        self.start_rss = max_rss()
+        self.start = timer()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        seconds = timer() - self.start
+        record(self.name, seconds, self.model, max_rss() - self.start_rss,
+               None if exc_type is None else exc_type.__name__)
+        return False
+
+def stage(name, model=None):
+    """Time the stage name in a with block"""
+    return Stage(name, model) if _sinks else _null_stage
+
+class _Profile(object):
+    def __init__(self, path):
+        self.path = path
+
+    def __enter__(self):
+        import cProfile
+        self.profiler = cProfile.Profile()
+        self.profiler.enable()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profiler.disable()
+        self.profiler.dump_stats(self.path)
+        return False
+
+def profile(name):
+    """Run a with block under cProfile, and dump the stats to
+    <profile_directory>/<name>-<time>.prof. Does nothing unless enable was
+    called with a profile_directory."""
+    if _profile_directory is None:
+        return _null_stage
+    filename = '%s-%d.prof' % (''.join(x if x.isalnum() or x in '-_.' else '_' for x in name),
+                               int(time.time() * 1000))
+    return _Profile(join(_profile_directory, filename))
+
+class Sink(object):
+    """The sink interface. Sinks are called from any thread."""
+
+    def record(self, stage_record):
+        pass
+
+    def count(self, name, value, model):
+        pass
+
+class LoggingSink(Sink):
+    """Log each stage and counter"""
+
+    def __init__(self, logger=None, level=logging.INFO):
+        self.logger = logger or logging.getLogger('theseus.metrics')
+        self.level = level
+
+    def record(self, stage_record):
+        self.logger.log(self.level, '%s %s %.2f ms %+d bytes%s', stage_record.stage,
+                        stage_record.model or '-', stage_record.seconds * 1000,
+                        stage_record.memory,
+                        ' (%s)' % stage_record.error if stage_record.error else '')
+
+    def count(self, name, value, model):
+        self.logger.log(self.level, '%s %s +%s', name, model or '-', value)
+
+def _escape(value):
+    return (value or '').replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+class HistogramSink(Sink):
+    """Keep the last max_samples times of each stage and model, for
+    percentiles, and totals of the counters."""
+
+    def __init__(self, max_samples=1024):
+        self.max_samples = max_samples
+        self._lock = threading.Lock()
+        # (stage, model): [samples, count, seconds, memory, errors]
+        self._stages = {}
+        # (name, model): total
+        self._counts = {}
+
+    def record(self, stage_record):
+        key = (stage_record.stage, stage_record.model)
+        with self._lock:
+            entry = self._stages.get(key)
+            if entry is None:
+                entry = self._stages[key] = [deque(maxlen=self.max_samples), 0, 0.0, 0, 0]
+            entry[0].append(stage_record.seconds)
+            entry[1] += 1
+            entry[2] += stage_record.seconds
+            entry[3] += stage_record.memory
+            entry[4] += stage_record.error is not None
+
+    def count(self, name, value, model):
+        with self._lock:
+            self._counts[(name, model)] = self._counts.get((name, model), 0) + value
+
+    def percentiles(self, stage, model=None, quantiles=(0.5, 0.9, 0.99)):
+        """Get the quantiles of the recent times of a stage, in seconds.
+        Returns None if the stage was not recorded."""
+        with self._lock:
+            entry = self._stages.get((stage, model))
+            samples = sorted(entry[0]) if entry is not None else None
+        if not samples:
+            return None
+        return [samples[min(len(samples) - 1, int(q * len(samples)))] for q in quantiles]
+
+    def stages(self):
+        """Get {(stage, model): (count, seconds, memory, errors)}"""
+        with self._lock:
+            return {k: tuple(v[1:]) for k, v in self._stages.items()}
+
+    def counts(self):
+        """Get {(name, model): total}"""
+        with self._lock:
+            return dict(self._counts)
+
+    def clear(self):
+        with self._lock:
+            self._stages.clear()
+            self._counts.clear()
+
+    def prometheus(self, quantiles=(0.5, 0.9, 0.99)):
+        """Render the metrics in the Prometheus text format"""
+        lines = ['# TYPE theseus_stage_seconds summary']
+        memory_lines, error_lines = [], []
+        for (stage, model), (n, seconds, memory, errors) in sorted(self.stages().items(),
+                                                                   key=lambda x: repr(x[0])):
+            labels = 'stage="%s",model="%s"' % (_escape(stage), _escape(model))
+            for q, value in zip(quantiles, self.percentiles(stage, model, quantiles) or []):
+                lines.append('theseus_stage_seconds{%s,quantile="%g"} %r' % (labels, q, value))
+            lines.append('theseus_stage_seconds_sum{%s} %r' % (labels, seconds))
+            lines.append('theseus_stage_seconds_count{%s} %d' % (labels, n))
+            memory_lines.append('theseus_stage_memory_bytes_total{%s} %d' % (labels, memory))
+            error_lines.append('theseus_stage_errors_total{%s} %d' % (labels, errors))
+        lines += ['# TYPE theseus_stage_memory_bytes_total counter'] + memory_lines
+        lines += ['# TYPE theseus_stage_errors_total counter'] + error_lines
+        counters = {}
+        for (name, model), value in self.counts().items():
+            counters.setdefault(name, []).append((model, value))
+        for name in sorted(counters):
+            lines.append('# TYPE theseus_%s_total counter' % name)
+            for model, value in sorted(counters[name], key=lambda x: x[0] or ''):
+                lines.append('theseus_%s_total{model="%s"} %r' % (name, _escape(model), value))
+        return '\n'.join(lines) + '\n'
@@ -1,73 +1,75 @@
 # -*- coding: utf-8 -*-
 
-import cobra
-import cobra.io
-from cobra.core.Formula import Formula
+from theseus.cache import ModelCache, CACHE_VERSION, key_filename, write_atomic
+from theseus.catalog import catalog
+from theseus.compact import load_compact, save_compact
+from theseus.view import ModelView
+from theseus.exchanges import ExchangeIndex, exchange_index
+from theseus.expressions import (have_symbolic, update_expressions, load_expressions,
+                                 save_expressions, remove_expressions)
+from theseus.ids import (reg, id_for_new_id_style, ids_for_new_id_style,
+                         fix_legacy_id, fix_legacy_ids)
+from theseus import metrics
+
+from collections import namedtuple, OrderedDict
+import json
 import os
-from os.path import join, abspath, dirname
+from os.path import join, abspath, dirname, splitext
 import re
+import shutil
+import tempfile
+import threading
+import warnings
+import numpy as np
 import pickle
-from six import iterkeys
+from six import iterkeys, iteritems, string_types
 
-try:
-    from cobrame import MetabolicReaction, StoichiometricData
-    from cobrame.solve.symbolic import compile_expressions
-except ImportError:
-    pass
+# cobra, cobra.io and cobrame are imported by the functions that need them, so
+# importing theseus (e.g. for get_model_list and check_for_model) is fast
 
 data_path = join(abspath(dirname(__file__)), 'data')
 
+# processed models, shared by every load_model call in this process
+model_cache = ModelCache()
+
 def get_model_list():
-    """Get the models that are available, as SBML, in data/models"""
-    return [x.replace('.xml', '').replace('.mat', '').replace('.json', '') for x in
-            os.listdir(join(data_path, 'models'))
-            if '.xml' in x or '.mat' in x or '.json' in x]
+    """Get the models that are available, as SBML, MAT or JSON, in data/models"""
+    return catalog.names()
 
 def check_for_model(name):
     """Check for model, case insensitive, and ignore periods and underscores"""
-    def min_name(n):
-        return n.lower().replace('.','').replace(' ','').replace('_','')
-    for x in get_model_list():
-        if min_name(name)==min_name(x):
-            return x
-    return None
-
-# the regex to separate the base id, the chirality ('_L') and the compartment ('_c')
-reg = re.compile(r'(.*?)(?:(.*[^_])_([LDSR]))?[_\(\[]([a-z])[_\)\]]?$')
-def id_for_new_id_style(old_id, is_metabolite=False, new_id_style='cobrapy'):
-    """ Get the new style id"""
-
-    def join_parts(the_id, the_compartment):
-        if (new_id_style.lower()=='cobrapy'):
-            if the_compartment:
-                the_id = the_id+'_'+the_compartment
-            the_id = the_id.replace('-', '__')
-        elif (new_id_style.lower()=='simpheny'):
-            if the_compartment and is_metabolite:
-                the_id = the_id+'['+the_compartment+']'
-            elif the_compartment:
-                the_id = the_id+'('+the_compartment+')'
-            the_id = the_id.replace('__', '-')
-        else:
-            raise Exception('Invalid id style')
-        return the_id
-
-    # separate the base id, the chirality ('_L') and the compartment ('_c')
-    m = reg.match(old_id)
-    if m is None:
-        # still change the underscore/dash
-        new_id = join_parts(old_id, None)
-    elif m.group(2) is None:
-        new_id = join_parts(m.group(1), m.group(4))
-    else:
-        # if the chirality is not joined by two underscores, then fix that
-        a = "__".join(m.groups()[1:3])
-        new_id = join_parts(a, m.group(4))
+    return catalog.find(name)
+
+def get_id_mapping(model, new_id_style):
+    """Compute the new ids for a model in a single pass, without changing the
+    model.
+
+    Returns (reaction_ids, metabolite_ids, boundary), where reaction_ids and
+    metabolite_ids are dictionaries of old ids to new ids, and boundary is the
+    set of ids for boundary metabolites that should be removed.
 
-    # deal with inconsistent notation of (sec) vs. [sec] in iJO1366 versions
-    new_id = new_id.replace('[sec]', '_sec_').replace('(sec)', '_sec_')
+    """
+    # legacy_ids add special characters to the names again. Exchanges are
+    # found with the fixed ids, as in cobra.io.sbml
+    old_ids = [x.id for x in model.reactions]
+    fixed_ids = fix_legacy_ids(old_ids, use_hyphens=False)
+    exchanges = set(r for r, fixed_id in zip(model.reactions, fixed_ids)
+                    if fixed_id.startswith('EX_'))
+    reaction_ids = dict(zip(old_ids, ids_for_new_id_style(fixed_ids, new_id_style=new_id_style)))
+
+    # boundary metabolites end in _b and are present in exchanges
+    old_ids, fixed_ids, boundary = [], [], set()
+    for metabolite, fixed_id in zip(model.metabolites,
+                                    fix_legacy_ids([x.id for x in model.metabolites])):
+        if fixed_id.endswith('_b') and not exchanges.isdisjoint(metabolite._reaction):
+            boundary.add(metabolite.id)
+        else:
+            old_ids.append(metabolite.id)
+            fixed_ids.append(fixed_id)
+    metabolite_ids = dict(zip(old_ids, ids_for_new_id_style(fixed_ids, is_metabolite=True,
+                                                            new_id_style=new_id_style)))
 
-    return new_id
+    return reaction_ids, metabolite_ids, boundary
 
 def convert_ids(model, new_id_style):
     """Converts metabolite and reaction ids to the new style. Style options:
@@ -76,53 +78,362 @@ def convert_ids(model, new_id_style):
     simpheny: EX_lac-L(e)
 
     """
-    # loop through the ids:
-
-    # this code comes from cobra.io.sbml
-    # legacy_ids add special characters to the names again
-    for metabolite in model.metabolites:
-        metabolite.id = fix_legacy_id(metabolite.id, use_hyphens=False)
-    model.metabolites._generate_index()
-    for reaction in model.reactions:
-        reaction.id = fix_legacy_id(reaction.id, use_hyphens=False)
-    model.reactions._generate_index()
-    # remove boundary metabolites (end in _b and only present in exchanges) . Be
-    # sure to loop through a static list of ids so the list does not get
-    # shorter as the metabolites are deleted
-    for metabolite_id in [str(x) for x in model.metabolites]:
-        metabolite = model.metabolites.get_by_id(metabolite_id)
-        if not metabolite.id.endswith("_b"):
-            continue
-        for reaction in list(metabolite._reaction):
-            if reaction.id.startswith("EX_"):
-                metabolite.remove_from_model()
-                break
-    model.metabolites._generate_index()
-
-    # separate ids and compartments, and convert to the new_id_style
+    reaction_ids, metabolite_ids, boundary = get_id_mapping(model, new_id_style)
+
+    # remove boundary metabolites in bulk, then rebuild each index once
+    if boundary:
+        keep = []
+        for metabolite in model.metabolites:
+            if metabolite.id not in boundary:
+                keep.append(metabolite)
+                continue
+            for reaction in metabolite._reaction:
+                del reaction._metabolites[metabolite]
+            metabolite._reaction.clear()
+            metabolite._model = None
+        list.__setitem__(model.metabolites, slice(None), keep)
+
+    return rename_ids(model, reaction_ids, metabolite_ids)
+
+def rename_ids(model, reaction_ids, metabolite_ids):
+    """Rename reactions and metabolites in bulk, and rebuild each index once.
+    Ids that are not in reaction_ids or metabolite_ids are kept. Changes
+    model."""
     for reaction in model.reactions:
-        reaction.id = id_for_new_id_style(reaction.id, new_id_style=new_id_style)
+        reaction.id = reaction_ids.get(reaction.id, reaction.id)
     model.reactions._generate_index()
     for metabolite in model.metabolites:
-        metabolite.id = id_for_new_id_style(metabolite.id, is_metabolite=True, new_id_style=new_id_style)
+        metabolite.id = metabolite_ids.get(metabolite.id, metabolite.id)
     model.metabolites._generate_index()
+    return model
+
+me_path = join(data_path, 'models', 'prototype_67.pickle')
+
+# compiled expressions for each ME variant in model_cache, by cache key
+_me_expressions = {}
+
+def me_cache_key(unmodified_me=False):
+    """Get the key for an ME model variant in model_cache"""
+    st = os.stat(me_path)
+    return ('ME', 'unmodified' if unmodified_me else 'no_glucose', CACHE_VERSION,
+            ((os.path.basename(me_path), st.st_size, st.st_mtime),))
+
+def _attach_expressions(me, key):
+    """Set the compiled expressions of an ME model variant. They are compiled
+    once per process (or loaded from the cache next to the ME pickle), and
+    each model gets its own copy of the dictionary."""
+    if key not in _me_expressions:
+        if not load_expressions(me, me_path):
+            update_expressions(me)
+            try:
+                save_expressions(me, me_path)
+            except Exception as err:
+                warnings.warn('Could not save compiled expressions: %s' % err)
+        # the variants differ in the bounds of EX_glc__D_e
+        update_expressions(me, reactions=['EX_glc__D_e'])
+        _me_expressions[key] = (me.expressions, me._compiled_ids)
+    expressions, compiled_ids = _me_expressions[key]
+    me.expressions = dict(expressions)
+    me._compiled_ids = compiled_ids
+    return me
+
+def load_model_me(unmodified_me=False, expressions=True, use_cache=True):
+    """Load the ME model.
+
+    unmodified_me: If False, turn off glucose uptake (EX_glc__D_e).
+
+    expressions: If True, set me.expressions to the compiled expressions of
+    the model. They are saved next to the ME pickle the first time.
+
+    use_cache: If True, check out a copy of the model from model_cache, where
+    the unmodified and the no-glucose variants are kept separately, pickled
+    at the highest protocol.
+
+    """
+    key = me_cache_key(unmodified_me)
+    me = model_cache.get(key) if use_cache else None
+    if me is None:
+        with open(me_path, 'rb') as f:
+            me = pickle.load(f)
+        if not unmodified_me:
+            me.reactions.get_by_id('EX_glc__D_e').lower_bound = 0
+        if use_cache:
+            model_cache.put(key, me)
+
+    if expressions and have_symbolic():
+        _attach_expressions(me, key)
+    return me
+
+def source_files(name):
+    """Get the files that a model is loaded from, in order of preference."""
+    return [join(data_path, 'model_pickles', name+'.theseus'),
+            join(data_path, 'model_pickles', name+'.pickle'),
+            join(data_path, 'models', name+'.theseus'),
+            join(data_path, 'models', name+'.mat'),
+            join(data_path, 'models', name+'.xml'),
+            join(data_path, 'models', name+'.json')]
+
+def model_source_stats(name):
+    """Get (file name, size, mtime) for each source file of a model in
+    data/models. The files that loading derives in data/model_pickles are left
+    out, so the stats only change when a source changes."""
+    stats = []
+    for path in source_files(name):
+        if dirname(path) != join(data_path, 'models'):
+            continue
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        stats.append((os.path.basename(path), st.st_size, st.st_mtime))
+    return tuple(stats)
+
+def model_cache_key(name, id_style):
+    """Get the key for a processed model in model_cache. The key includes the
+    size and mtime of each source file, so the cache is invalidated when a
+    source changes.
+
+    """
+    stats = []
+    for path in source_files(name):
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        stats.append((os.path.basename(path), st.st_size, st.st_mtime))
+    return (name, id_style.lower(), CACHE_VERSION, tuple(stats))
+
+def _load_pickle(path):
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+def _load_matlab(path):
+    from cobra.io import load_matlab_model
+    return load_matlab_model(path)
+
+def _load_sbml(path):
+    from cobra.io import read_sbml_model
+    return read_sbml_model(path)
+
+def _load_json(path):
+    from cobra.io import load_json_model
+    return load_json_model(path)
+
+raw_loaders = {'.theseus': load_compact,
+               '.pickle': _load_pickle,
+               '.mat': _load_matlab,
+               '.xml': _load_sbml,
+               '.json': _load_json}
+
+def load_raw_model(name):
+    """Load the compact model file, or, if not, the pickle, or the mat, sbml or
+    json file. The formats are tried in the order of catalog.formats. After a
+    slower format, save a compact model file for next time. Compact files and
+    pickles that are older than the newest source file are skipped (see
+    ModelCatalog.preferred_files), so they are saved again.
+
+    """
+    error = Exception('Could not find model')
+    for model_file in catalog.preferred_files(name):
+        extension = splitext(model_file.path)[1]
+        try:
+            with metrics.stage('load_' + extension.lstrip('.'), name):
+                model = raw_loaders[extension](model_file.path)
+        except Exception as err:
+            error = err
+            continue
+        if extension != '.theseus':
+            try:
+                with metrics.stage('save_compact', name):
+                    save_compact(model, join(data_path, 'model_pickles', name+'.theseus'))
+            except Exception:
+                # e.g. symbolic coefficients
+                if extension != '.pickle':
+                    with open(join(data_path, 'model_pickles', name+'.pickle'), 'wb') as f:
+                        pickle.dump(model, f)
+        return model
+    raise error
+
+def process_model(model, id_style='cobrapy', name=None):
+    """Process a raw model, as load_model does. Changes model.
+
+    name: The model name for metrics. Defaults to model.id.
+
+    """
+    name = model.id if name is None else name
+
+    # convert the ids
+    with metrics.stage('convert_ids', name):
+        model = convert_ids(model, id_style)
+
+    # extract metabolite formulas from names (e.g. for iAF1260)
+    with metrics.stage('get_formulas_from_names', name):
+        model = get_formulas_from_names(model)
+
+    # turn off carbon sources
+    with metrics.stage('turn_off_carbon_sources', name):
+        model = turn_off_carbon_sources(model)
 
     return model
 
-def load_model_me(unmodified_me=False):
-    import cloudpickle
+# load_model processes each model once, in the canonical id style, and makes
+# the other styles by renaming a copy with the id maps of the model
+canonical_style = 'cobrapy'
+id_styles = ('cobrapy', 'simpheny')
+
+# Maps between the canonical ids of a model and the ids of a style, for
+# reactions and metabolites, in both directions
+IdMap = namedtuple('IdMap', ['reactions', 'metabolites', 'reactions_to_canonical',
+                             'metabolites_to_canonical'])
+
+# {id_maps_key: {style: IdMap}}, or None for models whose ids cannot be mapped.
+# The id maps of the max_id_maps most recently used models are kept.
+max_id_maps = 32
+_id_maps = OrderedDict()
+_id_maps_lock = threading.Lock()
+
+def _get_cached_id_maps(key):
+    """Get the id maps for key from memory. Returns False if they are not
+    there."""
+    with _id_maps_lock:
+        if key not in _id_maps:
+            return False
+        # move to the most recently used end
+        maps = _id_maps[key] = _id_maps.pop(key)
+        return maps
+
+def _put_cached_id_maps(key, maps):
+    with _id_maps_lock:
+        # the maps for older source files of the same model are stale
+        for old in [k for k in _id_maps if k[0] == key[0]]:
+            del _id_maps[old]
+        _id_maps[key] = maps
+        while len(_id_maps) > max_id_maps:
+            _id_maps.popitem(last=False)
+
+def _id_map(reactions, metabolites):
+    return IdMap(reactions, metabolites, {v: k for k, v in iteritems(reactions)},
+                 {v: k for k, v in iteritems(metabolites)})
+
+def id_maps_key(name):
+    """Get the key for the id maps of a model. Like model_cache_key, it
+    changes when a source file changes."""
+    return (name, 'ids') + model_cache_key(name, canonical_style)[2:]
+
+def compute_id_maps(model):
+    """Compute the id maps of a raw model, {style: IdMap}, for each of
+    id_styles. Returns None if two ids have the same canonical id."""
+    canonical_reactions, canonical_metabolites, _ = get_id_mapping(model, canonical_style)
+    if (len(set(canonical_reactions.values())) != len(canonical_reactions) or
+        len(set(canonical_metabolites.values())) != len(canonical_metabolites)):
+        return None
+    maps = {}
+    for id_style in id_styles:
+        reaction_ids, metabolite_ids, _ = get_id_mapping(model, id_style)
+        maps[id_style] = _id_map(
+            {canonical_reactions[k]: v for k, v in iteritems(reaction_ids)},
+            {canonical_metabolites[k]: v for k, v in iteritems(metabolite_ids)})
+    return maps
+
+def _read_id_maps(key):
+    """Read the id maps from the disk. Returns False if they are not there,
+    and None if the model ids cannot be mapped."""
+    if model_cache.directory is None:
+        return False
+    try:
+        with open(join(model_cache.directory, key_filename(key, extension='ids')), 'r') as f:
+            data = json.load(f)
+    except (IOError, OSError, ValueError):
+        return False
+    if data is None:
+        return None
+    return {k: _id_map(v['reactions'], v['metabolites']) for k, v in iteritems(data)}
+
+def _write_id_maps(key, maps):
+    if model_cache.directory is None:
+        return
+    data = None if maps is None else {k: {'reactions': v.reactions,
+                                          'metabolites': v.metabolites}
+                                      for k, v in iteritems(maps)}
+    try:
+        write_atomic(model_cache.directory, key_filename(key, extension='ids'),
+                     json.dumps(data).encode('utf-8'))
+    except (IOError, OSError):
+        pass
 
-    def me_no_glucose_ex(me):
-        me.reactions.get_by_id('EX_glc__D_e').lower_bound = 0
-        return me
+def get_id_maps(name, model=None):
+    """Get the id maps of a model, {style: IdMap}, from memory, from the disk
+    next to model_cache, or by computing them from the raw model. The maps of
+    the max_id_maps most recently used models are kept in memory.
 
-    with open(join(data_path, 'models', 'prototype_67.pickle'), 'rb') as f:
-        me = pickle.load(f)
+    model: The raw model, if it is already loaded.
 
-    return me if unmodified_me else me_no_glucose_ex(me)
+    """
+    key = id_maps_key(name)
+    maps = _get_cached_id_maps(key)
+    if maps is not False:
+        return maps
+    maps = _read_id_maps(key)
+    if maps is False:
+        if model is None:
+            model = load_raw_model(name)
+            # loading may have written the raw pickle, so get a fresh key
+            key = id_maps_key(name)
+        maps = compute_id_maps(model)
+        _write_id_maps(key, maps)
+    _put_cached_id_maps(key, maps)
+    return maps
+
+def translate_ids(model_name, ids, from_style, to_style, kind=None):
+    """Translate reaction or metabolite ids of a model from one id style to
+    another, with the id maps of the model, without loading the model.
+
+    kind: 'reaction' or 'metabolite'. By default, ids are looked up in the
+    reactions, then the metabolites.
+
+    Returns a list of ids. Raises an Exception for ids that are not in the
+    model.
 
-def load_model(name, id_style='cobrapy', unmodified_me=False):
-    """Load a model, and give it a particular id style"""
+    """
+    name = check_for_model(model_name)
+    if not name:
+        raise Exception('Could not find model')
+    from_style, to_style = from_style.lower(), to_style.lower()
+    for id_style in from_style, to_style:
+        if id_style not in id_styles:
+            raise Exception('Invalid id style %s' % id_style)
+    if kind not in (None, 'reaction', 'metabolite'):
+        raise Exception('Invalid kind %s' % kind)
+    maps = get_id_maps(name)
+    if maps is None:
+        raise Exception('The ids of %s cannot be translated' % name)
+    source, target = maps[from_style], maps[to_style]
+    tables = []
+    if kind in (None, 'reaction'):
+        tables.append((source.reactions_to_canonical, target.reactions))
+    if kind in (None, 'metabolite'):
+        tables.append((source.metabolites_to_canonical, target.metabolites))
+    result, missing = [], []
+    for id in ids:
+        for to_canonical, from_canonical in tables:
+            if id in to_canonical:
+                result.append(from_canonical[to_canonical[id]])
+                break
+        else:
+            missing.append(id)
+    if missing:
+        raise Exception('Ids not found in %s: %s' % (name, ', '.join(missing)))
+    return result
+
+def load_model(name, id_style='cobrapy', unmodified_me=False, use_cache=True):
+    """Load a model, and give it a particular id style.
+
+    use_cache: If True, check out a copy of the processed model from
+    model_cache, or process the model and store it there. Models are
+    processed once, in the canonical style, and other styles are made by
+    renaming the ids of a copy.
+
+    """
 
     if name == 'ME':
         me = load_model_me(unmodified_me)
@@ -134,95 +445,223 @@ def load_model(name, id_style='cobrapy', unmodified_me=False):
     if not name:
         raise Exception('Could not find model')
 
-    # load the model pickle, or, if not, the sbml
+    if not use_cache:
+        return process_model(load_raw_model(name), id_style, name)
+
+    key = model_cache_key(name, id_style)
+    with metrics.stage('model_cache_get', name):
+        model = model_cache.get(key)
+    if model is not None:
+        metrics.count('model_cache_hits', model=name)
+        return model
+    metrics.count('model_cache_misses', model=name)
+
+    id_style = id_style.lower()
+    model = None
+    if id_style in id_styles and id_style != canonical_style:
+        with metrics.stage('model_cache_get', name):
+            model = model_cache.get(model_cache_key(name, canonical_style))
+    if model is not None:
+        maps = get_id_maps(name)
+    else:
+        raw = load_raw_model(name)
+        maps = get_id_maps(name, raw) if id_style in id_styles else None
+        # process in the canonical style, and keep that too
+        style = canonical_style if maps is not None else id_style
+        model = process_model(raw, style, name)
+        # loading may have written the raw pickle, so get a fresh key
+        model_cache.put(model_cache_key(name, style), model)
+        if style == id_style:
+            return model
+
+    if maps is None:
+        # the ids cannot be mapped, so process the model in this style
+        model = process_model(load_raw_model(name), id_style, name)
+    else:
+        with metrics.stage('rename_ids', name):
+            model = rename_ids(model, maps[id_style].reactions, maps[id_style].metabolites)
+    model_cache.put(model_cache_key(name, id_style), model)
+    return model
+
+def install_model(name, model, source_path=None, id_styles=('cobrapy',)):
+    """Add a model to data/models, and store the processed model in
+    model_cache, so the next load_model is instant.
+
+    name: The name for the model in data/models.
+
+    model: The raw cobra model.
+
+    source_path: A .mat, .xml or .json file for the model, to copy into
+    data/models. By default, the model is saved as JSON.
+
+    id_styles: Process the model for each of these id styles.
+
+    """
+    directory = join(data_path, 'models')
+    extension = '.json' if source_path is None else splitext(source_path)[1]
+    if extension not in raw_loaders or extension in ('.theseus', '.pickle'):
+        raise Exception('Unsupported model format %s' % extension)
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    os.close(fd)
     try:
-        with open(join(data_path, 'model_pickles', name+'.pickle'), 'rb') as f:
-            model = pickle.load(f)
+        if source_path is None:
+            from cobra.io import save_json_model
+            save_json_model(model, tmp)
+        else:
+            shutil.copyfile(source_path, tmp)
+        os.rename(tmp, join(directory, name+extension))
     except:
-        try:
-            model = cobra.io.load_matlab_model(join(data_path, 'models', name+'.mat'))
-        except:
-            try:
-                model = cobra.io.read_sbml_model(join(data_path, 'models', name+'.xml'))
-            except:
-                model = cobra.io.load_json_model(join(data_path, 'models', name+'.json'))
-        with open(join(data_path, 'model_pickles', name+'.pickle'), 'w') as f:
-            pickle.dump(model, f)
+        os.remove(tmp)
+        raise
+    try:
+        save_compact(model, join(data_path, 'model_pickles', name+'.theseus'))
+    except Exception:
+        pass
+    catalog.refresh(force=True)
 
-    # convert the ids
-    model = convert_ids(model, id_style)
+    for id_style in id_styles:
+        model_cache.put(model_cache_key(name, id_style),
+                        process_model(model.copy(), id_style, name))
+    return name
 
-    # extract metabolite formulas from names (e.g. for iAF1260)
-    model = get_formulas_from_names(model)
+def load_model_view(name, id_style='cobrapy'):
+    """Load a read-only, array-backed ModelView of a processed model.
 
-    # turn off carbon sources
-    model = turn_off_carbon_sources(model)
-
-    return model
+    The processed model is saved as a compact model file in
+    data/model_pickles/views the first time, and memory-mapped after that.
+    Use ModelView.to_model to get a full cobra.Model.
 
+    """
+    found = check_for_model(name)
+    if not found:
+        raise Exception('Could not find model')
+    key = model_cache_key(found, id_style)
+    directory = join(data_path, 'model_pickles', 'views')
+    path = join(directory, key_filename(key, extension='theseus'))
+    if not os.path.exists(path):
+        model = load_model(found, id_style=id_style)
+        # the source files may have changed while loading
+        key = model_cache_key(found, id_style)
+        path = join(directory, key_filename(key, extension='theseus'))
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        # remove views for older versions of the source files
+        prefix = key_filename(key, extension='theseus').rsplit('.', 2)[0] + '.'
+        for old in os.listdir(directory):
+            if old.startswith(prefix):
+                os.remove(join(directory, old))
+        save_compact(model, path)
+    return ModelView(path)
+
+# formulas at the end of metabolite names, e.g. for iAF1260
+formula_reg = re.compile(r'.*_([A-Za-z0-9]+)$')
 def get_formulas_from_names(model):
-    reg = re.compile(r'.*_([A-Za-z0-9]+)$')
+    """Set missing metabolite formulas from the ends of the names. This runs
+    over every metabolite, not only the exchanged ones, and before the
+    ExchangeIndex is built (which needs the formulas), so it does not use the
+    index."""
+    from cobra.core.Formula import Formula
     for metabolite in model.metabolites:
         if (metabolite.formula is not None
             and str(metabolite.formula).strip() != ''): continue
-        m = reg.match(metabolite.name)
+        m = formula_reg.match(metabolite.name)
         if m:
             metabolite.formula = Formula(m.group(1))
     return model
 
 def turn_off_carbon_sources(model):
-    for reaction in model.reactions:
-        if not reaction.id.startswith('EX_'): continue
-        if carbons_for_exchange_reaction(reaction) > 0:
-            reaction.lower_bound = 0
+    """Set the lower bound to 0 for every exchange of a metabolite with
+    carbon. Uses the ExchangeIndex of the model."""
+    for reaction in exchange_index(model).reactions_containing('C'):
+        reaction.lower_bound = 0
     return model
 
-def setup_model(model, substrate_reactions, aerobic=True, sur=10, max_our=10):
-    """Set up the model with environmntal parameters.
-
-    model: a cobra model
-    substrate_reactions: A single reaction id, list of reaction ids, or dictionary with reaction
-    ids as keys and max substrate uptakes as keys. If a list or single id is
-    given, then each substrate will be limited to /sur/
-    aerobic: True or False
-    sur: substrate uptake rate. Ignored if substrate_reactions is a dictionary.
-    max_our: Max oxygen uptake rate.
-    id_style: 'cobrapy' or 'simpheny'.
+# model specific setup, for setup_model and theseus.scenarios. Each model id
+# has a list of rules:
+#
+# aerobic: Apply the rule only to aerobic (True) or anaerobic (False)
+# conditions. Leave out to apply it to both.
+# bounds: {reaction id: (lower bound, upper bound)}
+# objective: {reaction id: objective coefficient}
+model_rules = {
+    'iJO1366': [{'aerobic': False,
+                 'bounds': {r: (0, 0) for r in ['CAT', 'SPODM', 'SPODMpp']}}],
+    'iJR904': [{'objective': {'BIOMASS_Ecoli': 1}}],
+    'iMM904': [{'aerobic': False,
+                'bounds': {r: (-1000, 1000) for r in ['EX_ergst_e', 'EX_zymst_e', 'EX_hdcea_e',
+                                                      'EX_ocdca_e', 'EX_ocdcea_e',
+                                                      'EX_ocdcya_e']}}],
+}
+
+def condition_changes(model_id, substrate_reactions, aerobic=True, sur=10, max_our=10):
+    """Get the changes that setup_model makes for a condition, without changing
+    a model. The arguments are the same as for setup_model.
+
+    Returns (bounds, objective). bounds is a dictionary of reaction id to
+    (lower bound, upper bound), where None leaves that bound unchanged.
+    objective is a dictionary of reaction id to objective coefficient, or None
+    to leave the objective unchanged.
 
     """
+    bounds = {}
+    def set_bounds(reaction_id, lower_bound, upper_bound=None):
+        old_lower_bound, old_upper_bound = bounds.get(reaction_id, (None, None))
+        bounds[reaction_id] = (old_lower_bound if lower_bound is None else lower_bound,
+                               old_upper_bound if upper_bound is None else upper_bound)
 
     if isinstance(substrate_reactions, dict):
-        for r, v in substrate_reactions.iteritems():
-            model.reactions.get_by_id(r).lower_bound = -abs(v)
-    elif isinstance(substrate_reactions, list):
+        for r, v in iteritems(substrate_reactions):
+            set_bounds(r, -abs(v))
+    elif isinstance(substrate_reactions, (list, tuple)):
         for r in substrate_reactions:
-            model.reactions.get_by_id(r).lower_bound = -abs(sur)
-    elif isinstance(substrate_reactions, str):
-        model.reactions.get_by_id(substrate_reactions).lower_bound = -abs(sur)
+            set_bounds(r, -abs(sur))
+    elif isinstance(substrate_reactions, string_types):
+        set_bounds(substrate_reactions, -abs(sur))
     else: raise Exception('bad substrate_reactions argument')
 
     o2 = 'EX_o2_e'
     if aerobic:
-        model.reactions.get_by_id(o2).lower_bound = -abs(max_our)
+        set_bounds(o2, -abs(max_our))
     else:
-        model.reactions.get_by_id(o2).lower_bound = 0
+        set_bounds(o2, 0)
 
-    # model specific setup
-    if str(model) == 'iJO1366' and aerobic is False:
-        for r in ['CAT', 'SPODM', 'SPODMpp']:
-            model.reactions.get_by_id(r).lower_bound = 0
-            model.reactions.get_by_id(r).upper_bound = 0
+    objective = None
+    for rule in model_rules.get(model_id, []):
+        if 'aerobic' in rule and bool(aerobic) != rule['aerobic']:
+            continue
+        for r, (lower_bound, upper_bound) in iteritems(rule.get('bounds', {})):
+            set_bounds(r, lower_bound, upper_bound)
+        if 'objective' in rule:
+            objective = dict(rule['objective'])
 
-    elif str(model) == 'iJR904':
-        model.objective = {model.reactions.get_by_id('BIOMASS_Ecoli'): 1}
+    return bounds, objective
 
-    elif str(model) == 'iMM904' and aerobic is False:
-        necessary_ex = ['EX_ergst_e', 'EX_zymst_e', 'EX_hdcea_e', 'EX_ocdca_e',
-                        'EX_ocdcea_e', 'EX_ocdcya_e']
-        for r in necessary_ex:
-            rxn = model.reactions.get_by_id(r)
-            rxn.lower_bound = -1000
-            rxn.upper_bound = 1000
+def setup_model(model, substrate_reactions, aerobic=True, sur=10, max_our=10):
+    """Set up the model with environmntal parameters.
+
+    model: a cobra model
+    substrate_reactions: A single reaction id, list of reaction ids, or dictionary with reaction
+    ids as keys and max substrate uptakes as keys. If a list or single id is
+    given, then each substrate will be limited to /sur/
+    aerobic: True or False
+    sur: substrate uptake rate. Ignored if substrate_reactions is a dictionary.
+    max_our: Max oxygen uptake rate.
+
+    Model specific setup comes from model_rules. To run many conditions on one
+    model, see theseus.scenarios.
+
+    """
+    bounds, objective = condition_changes(model.id, substrate_reactions, aerobic=aerobic,
+                                          sur=sur, max_our=max_our)
+    for r, (lower_bound, upper_bound) in iteritems(bounds):
+        reaction = model.reactions.get_by_id(r)
+        if lower_bound is not None:
+            reaction.lower_bound = lower_bound
+        if upper_bound is not None:
+            reaction.upper_bound = upper_bound
+
+    if objective is not None:
+        model.objective = {model.reactions.get_by_id(r): v for r, v in iteritems(objective)}
 
     return model
 
@@ -246,15 +685,18 @@ def carbons_for_exchange_reaction(reaction):
 
 def add_me_reaction(model, reaction_id, stoichiometry, bounds=(-1000.0, 1000.0),
                     keff=65.0):
-    """Add a new reaction to the ME model.
+    """Add a new reaction to the ME model. Returns the new MetabolicReactions.
 
     stoichiometry: {metabolite_id: coefficient}
 
     """
+    from cobrame import MetabolicReaction, StoichiometricData
+
     data = StoichiometricData(reaction_id, model)
     data.lower_bound, data.upper_bound = bounds
     data._stoichiometry = stoichiometry
 
+    reactions = []
     for rev_str, reverse in ('FWD', False), ('REV', True):
         reaction = MetabolicReaction('%s_%s_CPLX_dummy' % (reaction_id, rev_str))
         reaction.keff = keff
@@ -263,50 +705,120 @@ def add_me_reaction(model, reaction_id, stoichiometry, bounds=(-1000.0, 1000.0),
         reaction.complex_data = model.complex_data.CPLX_dummy
         model.add_reaction(reaction)
         reaction.update()
+        reactions.append(reaction)
+    return reactions
 
-def add_pathway(model, new_metabolites, new_reactions, subsystems, bounds,
-                check_mass_balance=False, check_charge_balance=False,
-                ignore_repeats=False, recompile_expressions=True):
-    """Add a pathway to the model. Reversibility defaults to reversible (1).
+def pathway_balance(reactions, check_charge_balance=False):
+    """Check the mass balance of many reactions at once, with one matrix
+    product. The reactions do not need to be in a model.
 
-    check_charge_balance: Only works if check_mass_balance is True.
+    check_charge_balance: If True, also check the charge balance.
 
-    recompile_expressions: If True, then recompile_expressions when new ME
-    reactions are added.
+    Returns a dictionary of reaction id to {element: imbalance}, like
+    Reaction.check_mass_balance, for the unbalanced reactions.
 
+    """
+    metabolite_index = {}
+    for reaction in reactions:
+        for metabolite in reaction._metabolites:
+            metabolite_index.setdefault(metabolite, len(metabolite_index))
+    compositions = [None] * len(metabolite_index)
+    for metabolite, i in iteritems(metabolite_index):
+        compositions[i] = dict(metabolite.elements or {})
+        if check_charge_balance and metabolite.charge is not None:
+            compositions[i]['charge'] = metabolite.charge
+    columns = sorted(set(e for x in compositions for e in x))
+    column_index = {e: j for j, e in enumerate(columns)}
+
+    composition = np.zeros((len(metabolite_index), len(columns)))
+    for i, elements in enumerate(compositions):
+        for element, count in iteritems(elements):
+            composition[i, column_index[element]] = count
+    stoichiometry = np.zeros((len(reactions), len(metabolite_index)))
+    for i, reaction in enumerate(reactions):
+        for metabolite, coefficient in iteritems(reaction._metabolites):
+            stoichiometry[i, metabolite_index[metabolite]] = coefficient
+
+    balance = stoichiometry.dot(composition)
+    result = {}
+    for i, j in zip(*np.nonzero(np.abs(balance) > 1e-9)):
+        result.setdefault(reactions[i].id, {})[columns[j]] = balance[i, j]
+    return result
+
+def _in_list(dict_list, x):
+    """Check whether x itself is in a DictList. Reads the list directly, so
+    the reactions of a ModelClone are not copied."""
+    return x.id in dict_list._dict and list.__getitem__(dict_list, dict_list._dict[x.id]) is x
+
+def _remove_all(dict_list, objects):
+    """Remove objects from a DictList with one index update. Only the objects
+    after the first removed one are reindexed, and the list is read directly,
+    so the reactions of a ModelClone are not copied."""
+    ids = set(x.id for x in objects)
+    positions = sorted(dict_list._dict[x] for x in ids)
+    if not positions:
+        return
+    for i in reversed(positions):
+        list.__delitem__(dict_list, i)
+    for x in ids:
+        del dict_list._dict[x]
+    for i in range(positions[0], len(dict_list)):
+        dict_list._dict[list.__getitem__(dict_list, i).id] = i
+
+def remove_pathway(model, reactions, metabolites):
+    """Remove reactions and metabolites that were added by add_pathway.
+    Objects that are not in the model are skipped."""
+    reactions = [r for r in reactions if _in_list(model.reactions, r)]
+    metabolites = [m for m in metabolites if _in_list(model.metabolites, m)]
+    for reaction in reactions:
+        for metabolite in reaction._metabolites:
+            metabolite._reaction.discard(reaction)
+        reaction._model = None
+    for metabolite in metabolites:
+        metabolite._model = None
+    # keep the compiled expressions of ME models in step
+    remove_expressions(model, reactions, metabolites)
+    _remove_all(model.reactions, reactions)
+    _remove_all(model.metabolites, metabolites)
+    return model
 
-    new_metabolites: e.g. { 'ggpp_c': {'formula': 'C20H33O7P2', 'name': 'name'},
-                            'phyto_c': {'formula': 'C40H64'}},
-                            'lyco_c': {'formula': 'C40H56'},
-                            'lyco_e': {'formula': 'C40H56'} }
-    new_reactions: e.g. { 'FPS': { 'ipdp_c': -2,
-                                   'ppi_c': 1,
-                                   'grdp_c': 1 },
-                          'CRTE': { 'ipdp_c': -1,
-                                    'frdp_c': -1,
-                                    'ggpp_c': 1,
-                                    'ppi_c': 1 } }
-    subsystems: e.g. { 'FPS': 'Lycopene production',
-                       'CRTE': 'Lycopene production' }
-    bound: e.g. { 'FPS': (0, 0),
-                  'CRTE': (0, 1000) }
+def build_pathway(model, new_metabolites, new_reactions, subsystems, bounds,
+                  ignore_repeats=False):
+    """Validate a pathway and make the objects for add_pathway, without
+    changing the model.
+
+    Returns (metabolites, reactions, me_reactions), where metabolites and
+    reactions are new cobra objects, and me_reactions is a list of (reaction
+    id, stoichiometry, bounds) for add_me_reaction.
 
     """
+    import cobra
 
-    for k, v in new_metabolites.iteritems():
+    metabolites = []
+    for k, v in iteritems(new_metabolites):
+        # like add_metabolites, keep the metabolites that are already in the
+        # model
+        if k in model.metabolites:
+            continue
         m = cobra.Metabolite(id=k,
                              formula=v.get('formula', None),
                              name=v.get('name', None))
         m.charge = v.get('charge', None)
+        metabolites.append(m)
+    new = {m.id: m for m in metabolites}
+
+    def get_metabolite(metabolite_id, reaction_id):
         try:
-            model.add_metabolites([m])
-        except Exception as err:
-            if (not ignore_repeats or
-                "already in the model" not in str(err)):
-                raise(err)
+            return new[metabolite_id]
+        except KeyError:
+            pass
+        try:
+            return model.metabolites.get_by_id(metabolite_id)
+        except KeyError:
+            raise Exception('Could not find metabolite %s for %s' % (metabolite_id, reaction_id))
 
-    has_new_me_reactions = False
-    for name, mets in new_reactions.iteritems():
+    reactions, me_reactions = [], []
+    for name, mets in iteritems(new_reactions):
         if bounds and (name in bounds):
             r_bounds = bounds[name]
         else:
@@ -314,59 +826,144 @@ def add_pathway(model, new_metabolites, new_reactions, subsystems, bounds,
 
         if model.id == 'ME' and not name.startswith('EX_'):
             # me reaction
-            if ignore_repeats and ('%_FWD_CPLX_dummy' % name in model.reactions or
-                                   '%_REV_CPLX_dummy' % name in model.reactions):
-                continue
-            print('Adding ME reactions for %s' % name)
-            add_me_reaction(model, name, mets, r_bounds)
-            has_new_me_reactions = True
+            if ('%s_FWD_CPLX_dummy' % name in model.reactions or
+                '%s_REV_CPLX_dummy' % name in model.reactions):
+                if ignore_repeats:
+                    continue
+                raise Exception('Reaction %s already in the model' % name)
+            for k in mets:
+                get_metabolite(k, name)
+            me_reactions.append((name, mets, r_bounds))
         else:
             # m reaction
-            if ignore_repeats and name in model.reactions:
-                continue
+            if name in model.reactions:
+                if ignore_repeats:
+                    continue
+                raise Exception('Reaction %s already in the model' % name)
             r = cobra.Reaction(name)
-            m_obj = {}
-            for k, v in mets.iteritems():
-                m_obj[model.metabolites.get_by_id(k)] = v
-            r.add_metabolites(m_obj)
+            # add_reactions links the metabolites to the reaction
+            r._metabolites = {get_metabolite(k, name): v for k, v in iteritems(mets)}
             r.lower_bound, r.upper_bound = r_bounds
             if subsystems and (name in subsystems):
                 r.subsystem = subsystems[name]
-            model.add_reaction(r)
+            reactions.append(r)
 
-            # mass balance
-            if check_mass_balance and 'EX_' not in name:
-                balance = model.reactions.get_by_id(name).check_mass_balance()
-                if not check_charge_balance and 'charge' in balance:
-                    del balance['charge']
-                if len(balance) > 0:
-                    raise Exception('Bad balance: %s' % str(balance))
+    return metabolites, reactions, me_reactions
 
-    # recompile the expressions
-    if has_new_me_reactions and recompile_expressions:
-        print('Recompiling expressions')
-        model.expressions = compile_expressions(model)
+def add_pathway(model, new_metabolites, new_reactions, subsystems, bounds,
+                check_mass_balance=False, check_charge_balance=False,
+                ignore_repeats=False, recompile_expressions=True):
+    """Add a pathway to the model. Reversibility defaults to reversible (1).
+
+    The whole pathway is validated, and balanced if check_mass_balance is
+    True, before the model changes. Then the metabolites and reactions are
+    added with one add_metabolites and one add_reactions call. If anything
+    fails, the model is left as it was.
+
+    check_charge_balance: Only works if check_mass_balance is True.
+
+    recompile_expressions: If True, then compile the expressions of the new ME
+    reactions, and merge them into model.expressions (see
+    theseus.expressions.update_expressions).
+
+
+    new_metabolites: e.g. { 'ggpp_c': {'formula': 'C20H33O7P2', 'name': 'name'},
+                            'phyto_c': {'formula': 'C40H64'}},
+                            'lyco_c': {'formula': 'C40H56'},
+                            'lyco_e': {'formula': 'C40H56'} }
+    new_reactions: e.g. { 'FPS': { 'ipdp_c': -2,
+                                   'ppi_c': 1,
+                                   'grdp_c': 1 },
+                          'CRTE': { 'ipdp_c': -1,
+                                    'frdp_c': -1,
+                                    'ggpp_c': 1,
+                                    'ppi_c': 1 } }
+    subsystems: e.g. { 'FPS': 'Lycopene production',
+                       'CRTE': 'Lycopene production' }
+    bound: e.g. { 'FPS': (0, 0),
+                  'CRTE': (0, 1000) }
 
+    """
+    _add_pathway(model, new_metabolites, new_reactions, subsystems, bounds,
+                 check_mass_balance, check_charge_balance, ignore_repeats,
+                 recompile_expressions)
     return model
 
+def _add_pathway(model, new_metabolites, new_reactions, subsystems, bounds,
+                 check_mass_balance, check_charge_balance, ignore_repeats,
+                 recompile_expressions):
+    """Add a pathway, and return the (reactions, metabolites) that were
+    added"""
+    metabolites, reactions, me_reactions = build_pathway(model, new_metabolites, new_reactions,
+                                                         subsystems, bounds, ignore_repeats)
+
+    # mass balance
+    if check_mass_balance:
+        balance = pathway_balance([r for r in reactions if 'EX_' not in r.id],
+                                  check_charge_balance)
+        if len(balance) > 0:
+            raise Exception('Bad balance: %s' % str(balance))
+
+    added = []
+    try:
+        model.add_metabolites(metabolites)
+        model.add_reactions(reactions)
+        if me_reactions:
+            with metrics.stage('add_me_reactions', model.id):
+                for name, mets, r_bounds in me_reactions:
+                    added.extend(add_me_reaction(model, name, mets, r_bounds))
+    except:
+        remove_pathway(model, reactions + added, metabolites)
+        raise
 
-def fix_legacy_id(id, use_hyphens=False):
-    id = id.replace('_DASH_', '__')
-    id = id.replace('_FSLASH_', '/')
-    id = id.replace('_BSLASH_', "\\")
-    id = id.replace('_LPAREN_', '(')
-    id = id.replace('_LSQBKT_', '[')
-    id = id.replace('_RSQBKT_', ']')
-    id = id.replace('_RPAREN_', ')')
-    id = id.replace('_COMMA_', ',')
-    id = id.replace('_PERIOD_', '.')
-    id = id.replace('_APOS_', "'")
-    id = id.replace('&amp;', '&')
-    id = id.replace('&lt;', '<')
-    id = id.replace('&gt;', '>')
-    id = id.replace('&quot;', '"')
-    if use_hyphens:
-        id = id.replace('__', '-')
-    else:
-        id = id.replace("-", "__")
-    return id
+    # recompile the expressions
+    if len(me_reactions) > 0 and recompile_expressions:
+        with metrics.stage('compile_expressions', model.id):
+            update_expressions(model)
+
+    return reactions + added, metabolites
+
+def merge_pathways(pathways):
+    """Merge a list of pathways, each (new_metabolites, new_reactions,
+    subsystems, bounds), into one. Raises an Exception if two pathways define
+    the same id differently."""
+    merged = ({}, {}, {}, {})
+    for pathway in pathways:
+        for merged_part, part in zip(merged, pathway):
+            for k, v in iteritems(part or {}):
+                if k in merged_part and merged_part[k] != v:
+                    raise Exception('Conflicting definitions for %s' % k)
+                merged_part[k] = v
+    return merged
+
+def add_pathways(model, pathways, **kwargs):
+    """Add a library of pathways to one model, validated and added together.
+    Keyword arguments are passed to add_pathway."""
+    return add_pathway(model, *merge_pathways(pathways), **kwargs)
+
+def iter_pathway_models(model, pathways, copy=False, check_mass_balance=False,
+                        check_charge_balance=False, ignore_repeats=False,
+                        recompile_expressions=True):
+    """For each pathway, yield the model with that pathway added.
+
+    By default, each pathway is added to model and removed again when the
+    next one is requested, so the model is never copied. Do not keep the
+    yielded model between iterations. With copy=True, each pathway is added to
+    a new theseus.clone.ModelClone of model instead, so model must not change
+    while the clones are used.
+
+    The other arguments are the same as for add_pathway.
+
+    """
+    from theseus.clone import clone_model
+
+    options = (check_mass_balance, check_charge_balance, ignore_repeats,
+               recompile_expressions)
+    for pathway in pathways:
+        target = clone_model(model) if copy else model
+        reactions, metabolites = _add_pathway(target, *(tuple(pathway) + options))
+        try:
+            yield target
+        finally:
+            if not copy:
+                remove_pathway(model, reactions, metabolites)
@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+
+"""Run scenarios, knockouts and pathway insertions for one model in a process
+pool.
+
+The model is loaded and processed once, in the parent. Where processes are
+forked, the workers share it copy-on-write. Otherwise, each worker gets one
+pickled copy when it starts. Jobs are sent to the workers in chunks, and each
+worker keeps one LP per model, so a worker never parses or rebuilds the model.
+
+"""
+
+from theseus.clone import clone_model
+from theseus.models import add_pathway, setup_model
+from theseus.scenarios import run_scenarios, iter_scenarios
+
+from cobra.solvers import solver_dict, get_solver_name
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from six import string_types
+import itertools
+import multiprocessing
+import os
+import pickle
+import time
+
+# models shared with the workers, by token
+_models = {}
+# LPs in this worker, by (token, solver)
+_problems = {}
+_tokens = itertools.count()
+
+def _init_worker(token, data):
+    _models[token] = pickle.loads(data)
+
+def _get_problem(token, solver):
+    """Get the LP for a shared model in this worker. Jobs undo their changes,
+    so the LP can be reused."""
+    key = (token, solver)
+    if key not in _problems:
+        model = _models[token]
+        interface = solver_dict[solver]
+        _problems[key] = (interface, interface.create_problem(model),
+                          {r.id: i for i, r in enumerate(model.reactions)})
+    return _problems[key]
+
+def _solve_knockout(token, solver, reaction_ids):
+    """Solve the LP with the reactions turned off, then turn them on again"""
+    interface, lp, index = _get_problem(token, solver)
+    reactions = _models[token].reactions
+    indices = [index[r] for r in reaction_ids]
+    for i in indices:
+        interface.change_variable_bounds(lp, i, 0, 0)
+    status = interface.solve_problem(lp)
+    f = interface.get_objective_value(lp) if status == 'optimal' else None
+    for i in indices:
+        interface.change_variable_bounds(lp, i, reactions[i].lower_bound,
+                                         reactions[i].upper_bound)
+    return status, f
+
+def _run_scenarios(token, solver, jobs):
+    results = []
+    start = time.time()
+    for result in run_scenarios(_models[token], jobs, solver=solver):
+        now = time.time()
+        result['time'] = now - start
+        start = now
+        results.append(result)
+    return results
+
+def _run_reaction_knockouts(token, solver, jobs):
+    results = []
+    for job in jobs:
+        start = time.time()
+        status, f = _solve_knockout(token, solver, [job] if isinstance(job, string_types) else job)
+        results.append({'knockout': job, 'status': status, 'f': f,
+                        'time': time.time() - start})
+    return results
+
+def _run_gene_knockouts(token, solver, jobs):
+    from cobra.manipulation import find_gene_knockout_reactions
+    results = []
+    for job in jobs:
+        start = time.time()
+        genes = [job] if isinstance(job, string_types) else job
+        reactions = find_gene_knockout_reactions(_models[token], genes)
+        status, f = _solve_knockout(token, solver, [r.id for r in reactions])
+        results.append({'knockout': job, 'reactions': sorted(r.id for r in reactions),
+                        'status': status, 'f': f, 'time': time.time() - start})
+    return results
+
+def _run_pathways(token, solver, jobs):
+    results = []
+    for job in jobs:
+        start = time.time()
+        pathway, condition, objective = job
+        model = clone_model(_models[token])
+        add_pathway(model, *pathway)
+        if condition is not None:
+            setup_model(model, *next(iter_scenarios([condition])))
+        if objective is not None:
+            model.objective = objective
+        solution = model.optimize(solver=solver)
+        results.append({'pathway': pathway, 'status': solution.status, 'f': solution.f,
+                        'time': time.time() - start})
+    return results
+
+def _run_chunk(function, token, solver, offset, jobs):
+    results = function(token, solver, jobs)
+    for i, result in enumerate(results):
+        result['index'] = offset + i
+    return results
+
+def cpu_count():
+    try:
+        return os.cpu_count() or 1
+    except AttributeError:
+        # Python 2
+        return multiprocessing.cpu_count()
+
+class ParallelRunner(object):
+    """Run jobs for one model in a ProcessPoolExecutor.
+
+    model: A loaded (and set up) cobra model. Changing it after the first run
+    does not change the copies in the workers.
+
+    workers: Number of processes. Defaults to the number of cores.
+
+    solver: The name of a cobra solver. Defaults to the best installed solver.
+
+    chunksize: Jobs per chunk. Defaults to about four chunks per worker.
+
+    progress: A function called in the parent after each chunk, with (jobs
+    done, total jobs).
+
+    Each run method yields a dictionary for each job, with status, f (the
+    objective value), time (seconds spent on the job in the worker) and index
+    (the position of the job in the input). Results come back as chunks finish,
+    so they may be out of order.
+
+    """
+
+    def __init__(self, model, workers=None, solver=None, chunksize=None, progress=None):
+        self.model = model
+        self.workers = workers or cpu_count()
+        self.solver = get_solver_name() if solver is None else solver
+        self.chunksize = chunksize
+        self.progress = progress
+        self.token = next(_tokens)
+        _models[self.token] = model
+        self._executor = None
+
+    def _get_executor(self):
+        if self._executor is None:
+            try:
+                methods = multiprocessing.get_all_start_methods()
+            except AttributeError:
+                # Python 2 forks on posix
+                methods = ['fork']
+            if 'fork' in methods:
+                try:
+                    self._executor = ProcessPoolExecutor(
+                        self.workers, mp_context=multiprocessing.get_context('fork'))
+                except (AttributeError, TypeError):
+                    # Python 2
+                    self._executor = ProcessPoolExecutor(self.workers)
+            else:
+                data = pickle.dumps(self.model, pickle.HIGHEST_PROTOCOL)
+                self._executor = ProcessPoolExecutor(self.workers, initializer=_init_worker,
+                                                     initargs=(self.token, data))
+        return self._executor
+
+    def _run(self, function, jobs):
+        jobs = list(jobs)
+        chunksize = self.chunksize or max(1, len(jobs) // (self.workers * 4))
+        executor = self._get_executor()
+        futures = [executor.submit(_run_chunk, function, self.token, self.solver, start,
+                                   jobs[start:start + chunksize])
+                   for start in range(0, len(jobs), chunksize)]
+        done = 0
+        try:
+            for future in as_completed(futures):
+                results = future.result()
+                done += len(results)
+                if self.progress is not None:
+                    self.progress(done, len(jobs))
+                for result in results:
+                    yield result
+        finally:
+            for future in futures:
+                future.cancel()
+
+    def scenarios(self, conditions):
+        """Run conditions with theseus.scenarios.run_scenarios. See
+        theseus.scenarios.iter_scenarios for the table of conditions."""
+        return self._run(_run_scenarios, iter_scenarios(conditions))
+
+    def reaction_knockouts(self, knockouts):
+        """Optimize with each reaction id (or list of reaction ids) in
+        knockouts turned off"""
+        return self._run(_run_reaction_knockouts, knockouts)
+
+    def gene_knockouts(self, knockouts):
+        """Optimize with each gene id (or list of gene ids) in knockouts
+        turned off. The results include the reactions that were turned off."""
+        return self._run(_run_gene_knockouts, knockouts)
+
+    def pathways(self, pathways, condition=None, objective=None):
+        """Add each pathway to a copy of the model and optimize.
+
+        pathways: A list of (new_metabolites, new_reactions, subsystems,
+        bounds), the arguments to add_pathway.
+
+        condition: Arguments to setup_model, applied after the pathway is
+        added, e.g. ('EX_glc_e', False).
+
+        objective: A new objective for the model, e.g. a reaction id.
+
+        """
+        return self._run(_run_pathways, [(tuple(p), condition, objective) for p in pathways])
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        _models.pop(self.token, None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -1,6 +1,5 @@
 from sys import argv, exit
-from cobra.io import save_json_model
-from theseus import load_model
+from theseus.cli import main
 
 try:
     name = argv[1]
@@ -8,6 +7,5 @@ except IndexError:
     print('Usage python -m theseus.save_json iJO1366')
     exit()
 
-model = load_model(name)
-    
-save_json_model(model, name + '.json')
+# same as theseus export NAME --format json
+exit(main(['export', name, '--format', 'json', '--workers', '1']))
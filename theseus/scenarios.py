@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+
+"""Run many environmental conditions (scenarios) on one model.
+
+Each scenario is applied as a set of bound changes on a single LP built from
+the model, and the changes are undone before the next scenario. The model is
+not copied or changed, and the solver starts each run from the basis of the
+last one.
+
+"""
+
+from theseus.models import condition_changes
+
+from cobra.solvers import solver_dict, get_solver_name
+from collections import namedtuple
+from six import iteritems, string_types
+
+Scenario = namedtuple('Scenario', ['substrate_reactions', 'aerobic', 'sur', 'max_our'])
+# same defaults as setup_model
+Scenario.__new__.__defaults__ = (True, 10, 10)
+
+def iter_scenarios(conditions):
+    """Get a Scenario for each condition in a table of conditions.
+
+    conditions: A list of dictionaries (with the keys of Scenario), tuples (in
+    the order of Scenario), or substrate reaction ids, or a pandas.DataFrame
+    with Scenario columns.
+
+    """
+    if hasattr(conditions, 'iterrows'):
+        conditions = (row.to_dict() for _, row in conditions.iterrows())
+    for condition in conditions:
+        if isinstance(condition, Scenario):
+            yield condition
+        elif isinstance(condition, dict):
+            yield Scenario(**condition)
+        elif isinstance(condition, string_types):
+            yield Scenario(condition)
+        else:
+            yield Scenario(*condition)
+
+def run_scenarios(model, conditions, solver=None, objective_sense='maximize', fluxes=False,
+                  **solver_parameters):
+    """Optimize the model for each condition, and yield the results as they
+    are solved.
+
+    model: A cobra model. It is not changed.
+
+    conditions: A table of conditions. See iter_scenarios.
+
+    solver: The name of a cobra solver. Defaults to the best installed solver.
+
+    fluxes: If True, include the fluxes of each solution.
+
+    Yields a dictionary for each condition, with the Scenario fields, status,
+    f (the objective value, or None if the problem was not solved), and x_dict
+    if fluxes is True.
+
+    """
+    interface = solver_dict[get_solver_name() if solver is None else solver]
+    lp = interface.create_problem(model, objective_sense=objective_sense)
+
+    index = {r.id: i for i, r in enumerate(model.reactions)}
+    lower_bounds = [r.lower_bound for r in model.reactions]
+    upper_bounds = [r.upper_bound for r in model.reactions]
+    coefficients = [r.objective_coefficient for r in model.reactions]
+
+    def set_objective(new_coefficients):
+        for i, coefficient in iteritems(new_coefficients):
+            interface.change_variable_objective(lp, i, coefficient)
+
+    for scenario in iter_scenarios(conditions):
+        bounds, objective = condition_changes(model.id, *scenario)
+
+        changed = []
+        for r, (lower_bound, upper_bound) in iteritems(bounds):
+            i = index[r]
+            interface.change_variable_bounds(
+                lp, i,
+                lower_bounds[i] if lower_bound is None else lower_bound,
+                upper_bounds[i] if upper_bound is None else upper_bound)
+            changed.append(i)
+
+        if objective is not None:
+            new_coefficients = {i: 0 for i, c in enumerate(coefficients) if c != 0}
+            new_coefficients.update((index[r], v) for r, v in iteritems(objective))
+            set_objective(new_coefficients)
+
+        status = interface.solve_problem(lp, **solver_parameters)
+        result = dict(scenario._asdict())
+        result['status'] = status
+        result['f'] = interface.get_objective_value(lp) if status == 'optimal' else None
+        if fluxes:
+            result['x_dict'] = (interface.format_solution(lp, model).x_dict
+                                if status == 'optimal' else None)
+
+        # undo the changes, before the caller gets control
+        for i in changed:
+            interface.change_variable_bounds(lp, i, lower_bounds[i], upper_bounds[i])
+        if objective is not None:
+            set_objective({i: coefficients[i] for i in new_coefficients})
+
+        yield result
+
+def scenario_frame(model, conditions, **kwargs):
+    """Run the conditions with run_scenarios, and collect the results in a
+    pandas.DataFrame with a row for each condition."""
+    try:
+        import pandas
+    except ImportError:
+        raise Exception('pandas is not installed')
+    return pandas.DataFrame(list(run_scenarios(model, conditions, **kwargs)))
@@ -0,0 +1,344 @@
+# -*- coding: utf-8 -*-
+
+"""An inverted index of the reactions and metabolites of every model in the
+catalog, in SQLite.
+
+    search('glc__D_e')                      # any field
+    search('EX_glc(e)', field='id')         # ids in any id style
+    search('C6H12O6', field='formula', kind='metabolite')
+    search('glucose', field='name', prefix=True)
+
+Ids are indexed in each id style (with the id maps of theseus.models), and
+matched case insensitively. Names are indexed whole and by word, formulas in
+Hill order, and compartments by id. Each model is indexed with a fingerprint
+of its source files in data/models, and only models whose fingerprint
+changed are indexed again. Models that could not be loaded are recorded
+too, and tried again when they change. search does not index; call
+update_index (or SearchIndex.update) first, e.g. when a server starts.
+
+"""
+
+from theseus.catalog import catalog, data_path
+
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from os.path import join, dirname, exists
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+
+try:
+    from urllib.request import pathname2url
+except ImportError:
+    from urllib import pathname2url
+
+# bump this when the indexed terms change
+INDEX_VERSION = 1
+
+index_path = join(data_path, 'model_pickles', 'search.sqlite')
+
+fields = ('id', 'name', 'formula', 'compartment')
+kinds = ('reaction', 'metabolite')
+
+Hit = namedtuple('Hit', ['model', 'kind', 'id', 'name', 'formula', 'compartment', 'field'])
+
+schema = """
+CREATE TABLE IF NOT EXISTS models (name TEXT PRIMARY KEY, fingerprint TEXT, error TEXT);
+CREATE TABLE IF NOT EXISTS entries (entry INTEGER PRIMARY KEY, model TEXT, kind TEXT, id TEXT,
+                                    name TEXT, formula TEXT, compartment TEXT);
+CREATE TABLE IF NOT EXISTS terms (term TEXT, field TEXT, entry INTEGER);
+CREATE INDEX IF NOT EXISTS terms_term ON terms (term, field);
+CREATE INDEX IF NOT EXISTS entries_model ON entries (model);
+"""
+
+element_reg = re.compile(r'([A-Z][a-z]*)(\d*\.?\d*)')
+word_reg = re.compile(r'[^\W_]{2,}', re.UNICODE)
+
+def normalize_formula(formula):
+    """Write a formula in Hill order (C, H, then alphabetical), e.g. OH2 ->
+    H2O. Returns None if formula is not a formula."""
+    if not formula:
+        return None
+    formula = str(formula).strip()
+    if element_reg.sub('', formula) != '':
+        return None
+    elements = {}
+    for element, count in element_reg.findall(formula):
+        elements[element] = elements.get(element, 0) + (float(count) if count else 1)
+    order = sorted(elements, key=lambda x: (x != 'C', x != 'H' or 'C' not in elements, x))
+    return ''.join(x + ('' if elements[x] == 1 else '%g' % elements[x]) for x in order)
+
+def fingerprint(name, catalog=catalog):
+    """Get a fingerprint of the source files of a model in data/models"""
+    stats = sorted((os.path.basename(x.path), x.size, x.mtime)
+                   for x in catalog.files(name).values()
+                   if dirname(x.path) == catalog.models_directory)
+    return hashlib.sha1(repr((INDEX_VERSION, stats)).encode('utf-8')).hexdigest()
+
+def index_rows(name, model_files=None):
+    """Get the rows to index for a model: a list of (kind, id, name, formula,
+    compartment, terms), where terms is a set of (term, field). Loads the
+    processed model, in the canonical id style.
+
+    model_files: The ModelFiles to load the model from, in order of
+    preference (see ModelCatalog.preferred_files). By default, the model is
+    loaded from the bundled catalog with load_model.
+
+    """
+    from theseus.models import (load_model, get_id_maps, compute_id_maps, process_model,
+                                raw_loaders, canonical_style)
+
+    if model_files is None:
+        model = load_model(name)
+        maps = get_id_maps(name) or {}
+    else:
+        error = Exception('Could not find model')
+        for model_file in model_files:
+            try:
+                raw = raw_loaders[os.path.splitext(model_file.path)[1]](model_file.path)
+                break
+            except Exception as err:
+                error = err
+        else:
+            raise error
+        maps = compute_id_maps(raw) or {}
+        model = process_model(raw, canonical_style, name)
+    rows = []
+    for kind, objects in (('reaction', model.reactions), ('metabolite', model.metabolites)):
+        for x in objects:
+            terms = set()
+            ids = set([x.id])
+            for id_map in maps.values():
+                ids.add(getattr(id_map, kind + 's').get(x.id, x.id))
+            terms.update((y.lower(), 'id') for y in ids)
+            if x.name:
+                terms.add((x.name.lower(), 'name'))
+                terms.update((y.lower(), 'name') for y in word_reg.findall(x.name))
+            if kind == 'metabolite':
+                formula = normalize_formula(x.formula)
+                compartments = [x.compartment] if x.compartment else []
+            else:
+                formula = None
+                compartments = sorted(set(m.compartment for m in x._metabolites if m.compartment))
+            if formula:
+                terms.add((formula, 'formula'))
+            terms.update((y.lower(), 'compartment') for y in compartments)
+            rows.append((kind, x.id, x.name, formula, ' '.join(compartments) or None, terms))
+    return rows
+
+class SearchIndex(object):
+    """The inverted index in the SQLite database at path.
+
+    Each call opens its own connection, so an index can be used from any
+    thread or process. Updates are run one at a time.
+
+    """
+
+    def __init__(self, path=index_path, catalog=catalog):
+        self.path = path
+        self.catalog = catalog
+        self._update_lock = threading.Lock()
+        self._has_schema = False
+
+    def _connect(self):
+        """Open a connection for writing, creating the database and its tables
+        the first time"""
+        create = not self._has_schema or not exists(self.path)
+        if create and not exists(dirname(self.path)):
+            os.makedirs(dirname(self.path))
+        connection = sqlite3.connect(self.path, timeout=60)
+        if create:
+            connection.executescript(schema)
+            self._has_schema = True
+        return connection
+
+    def _connect_read_only(self):
+        """Open a read-only connection, or return None if there is no index
+        yet"""
+        if not exists(self.path):
+            return None
+        try:
+            return sqlite3.connect('file:%s?mode=ro' % pathname2url(self.path),
+                                   timeout=60, uri=True)
+        except TypeError:
+            # Python 2 has no uri connections
+            connection = sqlite3.connect(self.path, timeout=60)
+            connection.execute('PRAGMA query_only = ON')
+            return connection
+
+    def fingerprints(self):
+        """Get {model name: fingerprint} for the indexed models"""
+        connection = self._connect()
+        try:
+            return dict(connection.execute('SELECT name, fingerprint FROM models'))
+        finally:
+            connection.close()
+
+    def stale(self):
+        """Get the names of the models that are not indexed or changed, and
+        the indexed models that are no longer in the catalog."""
+        indexed = self.fingerprints()
+        names = self.catalog.names()
+        changed = [x for x in names if indexed.get(x) != fingerprint(x, self.catalog)]
+        removed = sorted(set(indexed) - set(names))
+        return changed, removed
+
+    def update(self, names=None, workers=1, force=False):
+        """Index the models that changed since they were indexed.
+
+        names: Models to check. Defaults to every model in the catalog, and
+        then models that were removed from the catalog are dropped.
+
+        workers: Number of processes that load the models.
+
+        force: If True, index the models even if they did not change.
+
+        Returns a dictionary with the lists of models that were 'indexed',
+        'removed' and 'failed' (with errors).
+
+        """
+        # a concurrent update has already indexed the models when this one
+        # gets the lock, so it finds nothing stale
+        with self._update_lock:
+            return self._update(names, workers, force)
+
+    def _model_files(self, name):
+        # models in another catalog cannot be loaded with load_model
+        return None if self.catalog is catalog else self.catalog.preferred_files(name)
+
+    def _update(self, names, workers, force):
+        changed, removed = self.stale()
+        if names is not None:
+            names = [self.catalog.find(x) or x for x in names]
+            changed = names if force else [x for x in changed if x in names]
+            removed = []
+        elif force:
+            changed = self.catalog.names()
+
+        results = {}
+        if workers > 1 and len(changed) > 1:
+            with ProcessPoolExecutor(min(workers, len(changed))) as executor:
+                futures = {x: executor.submit(index_rows, x, self._model_files(x))
+                           for x in changed}
+                for name, future in futures.items():
+                    try:
+                        results[name] = future.result()
+                    except Exception as err:
+                        results[name] = err
+        else:
+            for name in changed:
+                try:
+                    results[name] = index_rows(name, self._model_files(name))
+                except Exception as err:
+                    results[name] = err
+
+        indexed, failed = [], []
+        connection = self._connect()
+        try:
+            with connection:
+                for name in removed:
+                    self._delete(connection, name)
+                for name in changed:
+                    rows = results[name]
+                    self._delete(connection, name)
+                    if isinstance(rows, Exception):
+                        failed.append((name, str(rows)))
+                        connection.execute('INSERT INTO models VALUES (?, ?, ?)',
+                                           (name, fingerprint(name, self.catalog), str(rows)))
+                        continue
+                    for kind, id, display_name, formula, compartment, terms in rows:
+                        entry = connection.execute(
+                            'INSERT INTO entries (model, kind, id, name, formula, compartment) '
+                            'VALUES (?, ?, ?, ?, ?, ?)',
+                            (name, kind, id, display_name, formula, compartment)).lastrowid
+                        connection.executemany('INSERT INTO terms VALUES (?, ?, ?)',
+                                               [(term, field, entry) for term, field in terms])
+                    connection.execute('INSERT INTO models VALUES (?, ?, NULL)',
+                                       (name, fingerprint(name, self.catalog)))
+                    indexed.append(name)
+        finally:
+            connection.close()
+        return {'indexed': indexed, 'removed': removed, 'failed': failed}
+
+    def _delete(self, connection, name):
+        connection.execute('DELETE FROM terms WHERE entry IN '
+                           '(SELECT entry FROM entries WHERE model = ?)', (name,))
+        connection.execute('DELETE FROM entries WHERE model = ?', (name,))
+        connection.execute('DELETE FROM models WHERE name = ?', (name,))
+
+    def search(self, query, field=None, kind=None, models=None, prefix=False, limit=1000,
+               update=False):
+        """Find reactions and metabolites.
+
+        field: 'id', 'name', 'formula' or 'compartment'. By default, ids,
+        names and formulas are searched.
+
+        kind: 'reaction' or 'metabolite'. By default, both.
+
+        models: A list of model names to search. By default, all.
+
+        prefix: If True, match terms that start with query.
+
+        update: If True, first index the models that changed. Leave this off
+        where searches must be fast, and update the index ahead of time.
+
+        Returns a list of Hits, ordered by model, kind and id.
+
+        """
+        if field is not None and field not in fields:
+            raise Exception('Invalid field %s' % field)
+        if kind is not None and kind not in kinds:
+            raise Exception('Invalid kind %s' % kind)
+        if update:
+            self.update()
+
+        terms = []
+        for term_field in ([field] if field else ['id', 'name', 'formula']):
+            term = (normalize_formula(query) if term_field == 'formula'
+                    else query.strip().lower())
+            if term:
+                terms.append((term_field, term))
+        if not terms:
+            return []
+
+        conditions, args = [], []
+        for term_field, term in terms:
+            if prefix:
+                conditions.append('(t.field = ? AND t.term >= ? AND t.term < ?)')
+                args += [term_field, term, term + u'\uffff']
+            else:
+                conditions.append('(t.field = ? AND t.term = ?)')
+                args += [term_field, term]
+        sql = ('SELECT e.model, e.kind, e.id, e.name, e.formula, e.compartment, MIN(t.field) '
+               'FROM terms t JOIN entries e ON e.entry = t.entry WHERE (%s)' %
+               ' OR '.join(conditions))
+        if kind is not None:
+            sql += ' AND e.kind = ?'
+            args.append(kind)
+        if models is not None:
+            models = [self.catalog.find(x) or x for x in models]
+            sql += ' AND e.model IN (%s)' % ', '.join('?' for _ in models)
+            args += models
+        sql += ' GROUP BY e.entry ORDER BY e.model, e.kind, e.id LIMIT ?'
+        args.append(limit)
+
+        connection = self._connect_read_only()
+        if connection is None:
+            return []
+        try:
+            return [Hit(*row) for row in connection.execute(sql, args)]
+        finally:
+            connection.close()
+
+# the index of the bundled models
+search_index = SearchIndex()
+
+def search(query, **kwargs):
+    """Search the index of the bundled models. See SearchIndex.search."""
+    return search_index.search(query, **kwargs)
+
+def update_index(**kwargs):
+    """Index the bundled models that changed. See SearchIndex.update."""
+    return search_index.update(**kwargs)
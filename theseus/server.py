@@ -1,48 +1,470 @@
+from __future__ import print_function
+
+import tornado.autoreload
 import tornado.ioloop
 import tornado.web
 import tornado.escape
+from tornado import gen
+from tornado.httpserver import HTTPServer
+from tornado.netutil import bind_sockets
+from tornado.process import fork_processes
 from tornado.options import define, options, parse_command_line
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from datetime import datetime, timedelta
+from email.utils import parsedate
+from functools import partial
+import calendar
+import hashlib
 import json
-import cPickle as pickle
+import zlib
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
-from theseus import models
+from theseus import models, metrics, search
+from theseus.cache import BodyCache, SharedBodyCache, body_path
 
 # define port
 define("port", default=9091, type=int)
+define("executor", default="thread", help="Worker pool for model loading: thread or process")
+define("workers", default=4, type=int, help="Number of workers")
+define("max_queue", default=16, type=int,
+       help="Maximum number of model loads running or waiting. Beyond this, return 503")
+define("timeout", default=300, type=float, help="Per-request timeout in seconds")
+define("chunk_size", default=64 * 1024, type=int, help="Size of the chunks of streamed responses")
+define("response_cache_mb", default=1024, type=int, help="Memory budget for encoded responses")
+define("spill_dir", default='', help="Directory to spill encoded responses to. Off by default")
+define("processes", default=1, type=int,
+       help="Number of server processes, sharing the port. 0 for one per core. With more "
+       "than one, encoded responses are kept once, in memory-mapped files in --spill_dir "
+       "(default data/model_pickles/bodies), and processed models only on disk")
+define("metrics", default=True, help="Keep stage times and counters for /metrics")
+define("metrics_log", default=False, help="Also log stage times and counters")
+define("profile_dir", default='', help="Directory for a cProfile dump of each model load")
+define("warm", default=[], multiple=True,
+       help="Models to encode on startup, as name or name:id_style, comma separated")
+define("update_search", default=True, help="Update the search index on startup")
+define("debug", default=False, help="Reload the server when the code changes. Only with "
+       "--processes=1")
 
 def main():
     parse_command_line()
-    application.listen(options.port)
+    if options.metrics:
+        metrics.enable(metrics.HistogramSink())
+    if options.metrics_log:
+        metrics.enable(metrics.LoggingSink())
+    if options.profile_dir:
+        metrics.enable(profile_directory=options.profile_dir)
+    # the first (or only) process warms the caches and updates the search
+    # index, which the others share through the disk
+    task_id = None
+    if options.processes != 1:
+        if options.debug:
+            print('Ignoring --debug with more than one server process')
+        if options.executor != 'thread':
+            print('Using a thread executor in each of the server processes')
+            options.executor = 'thread'
+        # keep processed models on disk, where the processes share the page
+        # cache, instead of a copy in each process
+        models.model_cache.memory.max_bytes = 0
+        sockets = bind_sockets(options.port)
+        task_id = fork_processes(options.processes)
+        server = HTTPServer(application)
+        server.add_sockets(sockets)
+    else:
+        if options.debug:
+            # autoreload makes an IOLoop, so it must not start before a fork
+            tornado.autoreload.start()
+            application.settings['serve_traceback'] = True
+        application.listen(options.port)
+    if task_id in (None, 0):
+        tornado.ioloop.IOLoop.current().spawn_callback(warm_cache, application, options.warm)
+        if options.update_search:
+            tornado.ioloop.IOLoop.current().spawn_callback(update_search_index, application)
     try:
         tornado.ioloop.IOLoop.instance().start()
     except KeyboardInterrupt:
-        print "bye!"
+        print("bye!")
+
+content_types = {'pickle': 'application/x-python-pickle',
+                 'json': 'application/json'}
+
+def encode_model(model, format='pickle', protocol=2):
+    """Serialize a model as a pickle at the given protocol or as COBRA JSON"""
+    if format == 'pickle':
+        return pickle.dumps(model, protocol)
+    elif format == 'json':
+        from cobra.io.json import to_json
+        return to_json(model).encode('utf-8')
+    raise Exception('Invalid format %s' % format)
+
+def compress(data, encoding):
+    """Compress data with gzip or zstd. If encoding is None, return data."""
+    if encoding is None:
+        return data
+    elif encoding == 'gzip':
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        return compressor.compress(data) + compressor.flush()
+    elif encoding == 'zstd':
+        return zstandard.ZstdCompressor().compress(data)
+    raise Exception('Invalid encoding %s' % encoding)
+
+def load_model_body(model_name, id_style, format='pickle', protocol=2, encoding=None):
+    """Load a model, serialize it and compress it. This runs in the worker
+    pool."""
+    with metrics.profile('%s-%s-%s' % (model_name, id_style, format)):
+        with metrics.stage('load_model', model_name):
+            model = models.load_model(model_name, id_style=id_style)
+        with metrics.stage('encode_' + format, model_name):
+            data = encode_model(model, format, protocol)
+        if encoding is not None:
+            with metrics.stage('compress_' + encoding, model_name):
+                data = compress(data, encoding)
+    return data
+
+def load_shared_body(cache, model_name, id_style, format='pickle', protocol=2, encoding=None,
+                     etag=None):
+    """Map the body from a SharedBodyCache, or load it with load_model_body if
+    no server process has it. This runs in the worker pool."""
+    key = (model_name, id_style, format, protocol, encoding, etag)
+    return cache.build(key, lambda: load_model_body(model_name, id_style, format, protocol,
+                                                    encoding))
+
+def model_validators(model_name, id_style, *args):
+    """Get the ETag and Last-Modified time for a response, from the source
+    files of the model in data/models. The ETag also covers the format and
+    encoding (args). The files that the first load writes to
+    data/model_pickles are left out, so loading does not change the
+    validators.
+
+    """
+    stats = models.model_source_stats(model_name)
+    if len(stats) == 0:
+        return None, None
+    key = (model_name, id_style.lower(), models.CACHE_VERSION, stats) + args
+    etag = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+    last_modified = datetime.utcfromtimestamp(int(max(x[2] for x in stats)))
+    return '"%s"' % etag, last_modified
+
+def make_executor(kind, workers):
+    if kind == 'thread':
+        return ThreadPoolExecutor(workers)
+    elif kind == 'process':
+        return ProcessPoolExecutor(workers)
+    raise Exception('Invalid executor %s' % kind)
+
+class Overloaded(Exception):
+    pass
+
+class ModelLoader(object):
+    """Run model loads in a worker pool.
+
+    Concurrent requests for the same arguments (model, id_style, format, ...)
+    share one load. If max_queue loads are already running or waiting, load raises Overloaded.
+
+    """
+
+    def __init__(self, executor, max_queue=16, load=load_model_body):
+        self.executor = executor
+        self.max_queue = max_queue
+        self._load = load
+        self._pending = {}
+
+    def load(self, *args):
+        """Get a future for the response body. The arguments are passed on to
+        the load function. Call from the IOLoop thread."""
+        key = args
+        future = self._pending.get(key)
+        if future is None:
+            if len(self._pending) >= self.max_queue:
+                raise Overloaded()
+            future = self.executor.submit(self._load, *args)
+            self._pending[key] = future
+            tornado.ioloop.IOLoop.current().add_future(
+                future, lambda f: self._pending.pop(key, None))
+        return future
+
+def get_loader(application):
+    """Get the ModelLoader for the application, set up from the options the
+    first time."""
+    if application.settings.get('loader') is None:
+        cache = get_body_cache(application)
+        load = (partial(load_shared_body, cache) if isinstance(cache, SharedBodyCache)
+                else load_model_body)
+        application.settings['loader'] = ModelLoader(make_executor(options.executor, options.workers),
+                                                     options.max_queue, load)
+    return application.settings['loader']
+
+def get_body_cache(application):
+    """Get the BodyCache for the application, set up from the options the
+    first time."""
+    if application.settings.get('body_cache') is None:
+        if options.processes != 1:
+            application.settings['body_cache'] = SharedBodyCache(options.spill_dir or body_path)
+        else:
+            application.settings['body_cache'] = BodyCache(options.response_cache_mb * 1024 * 1024,
+                                                           options.spill_dir or None)
+    return application.settings['body_cache']
+
+def get_search_index(application):
+    """Get the SearchIndex for the application. Defaults to the index of the
+    bundled models."""
+    if application.settings.get('search_index') is None:
+        application.settings['search_index'] = search.search_index
+    return application.settings['search_index']
+
+def get_search_executor(application):
+    """Get the thread pool for searches and updates of the search index"""
+    if application.settings.get('search_executor') is None:
+        application.settings['search_executor'] = ThreadPoolExecutor(options.workers)
+    return application.settings['search_executor']
+
+@gen.coroutine
+def get_body(application, model_name, id_style, format, protocol, encoding, etag):
+    """Get an encoded model from the BodyCache, or load it in the worker pool"""
+    cache = get_body_cache(application)
+    key = (model_name, id_style, format, protocol, encoding, etag)
+    data = cache.get(key)
+    if data is None:
+        metrics.count('response_cache_misses', model=model_name)
+        # a SharedBodyCache is filled by the load (see load_shared_body), which
+        # needs the whole key
+        shared = isinstance(cache, SharedBodyCache)
+        future = get_loader(application).load(*(key if shared else key[:-1]))
+        data = yield gen.with_timeout(timedelta(seconds=options.timeout), future)
+        if not shared:
+            cache.put(key, data)
+    else:
+        metrics.count('response_cache_hits', model=model_name)
+    raise gen.Return(data)
+
+@gen.coroutine
+def warm_cache(application, specs):
+    """Encode models ahead of the first request, as pickles (protocol 2), plain
+    and gzipped.
+
+    specs: A list of model names, optionally with an id style (name:id_style).
+
+    """
+    for spec in specs:
+        model_name, _, id_style = spec.partition(':')
+        id_style = id_style or 'cobrapy'
+        model_name = models.check_for_model(model_name)
+        if model_name is None:
+            continue
+        for encoding in None, 'gzip':
+            etag, _ = model_validators(model_name, id_style, 'pickle', 2, encoding)
+            try:
+                yield get_body(application, model_name, id_style, 'pickle', 2, encoding, etag)
+            except Exception as err:
+                print('Could not warm %s: %s' % (spec, err))
+
+@gen.coroutine
+def update_search_index(application):
+    """Index the models that changed since the search index was built, in the
+    search thread pool. /search does not wait for this, and finds the models
+    indexed so far."""
+    try:
+        result = yield get_search_executor(application).submit(
+            get_search_index(application).update)
+    except Exception as err:
+        print('Could not update the search index: %s' % err)
+        return
+    for name, error in result['failed']:
+        print('Could not index %s: %s' % (name, error))
 
 class ModelHandler(tornado.web.RequestHandler):
+    """Serve a model.
+
+    The format is chosen with the format and protocol arguments (e.g.
+    ?format=pickle&protocol=4), or else with the Accept header (e.g.
+    application/json, or application/x-python-pickle; protocol=4). Pickles
+    default to protocol 2. The body is compressed with zstd or gzip if the
+    client accepts it, and streamed in chunks. Encoded bodies are kept in the
+    application's BodyCache.
+
+    """
+
+    def compute_etag(self):
+        # validators come from the model source files, in get
+        return None
+
+    def on_finish(self):
+        metrics.record('request', self.request.request_time(),
+                       getattr(self, 'model_name', None))
+
+    def negotiate_format(self):
+        """Get the (format, protocol) for the request"""
+        format = self.get_argument('format', None)
+        protocol = self.get_argument('protocol', None)
+        if format is None:
+            format = 'pickle'
+            for media_range in self.request.headers.get('Accept', '').split(','):
+                parts = [x.strip() for x in media_range.split(';')]
+                if parts[0] in ('application/json', 'application/x-python-pickle'):
+                    format = 'json' if parts[0] == 'application/json' else 'pickle'
+                    for param in parts[1:]:
+                        if param.startswith('protocol='):
+                            protocol = protocol or param[len('protocol='):]
+                    break
+        if format not in content_types:
+            raise tornado.web.HTTPError(400, 'Invalid format %s' % format)
+        if format == 'json':
+            return format, None
+        try:
+            protocol = 2 if protocol is None else int(protocol)
+        except ValueError:
+            protocol = -1
+        if not 0 <= protocol <= pickle.HIGHEST_PROTOCOL:
+            raise tornado.web.HTTPError(400, 'Invalid pickle protocol')
+        return format, protocol
+
+    def negotiate_encoding(self):
+        accept_encoding = self.request.headers.get('Accept-Encoding', '')
+        encodings = [x.split(';')[0].strip() for x in accept_encoding.split(',')]
+        if 'zstd' in encodings and zstandard is not None:
+            return 'zstd'
+        elif 'gzip' in encodings:
+            return 'gzip'
+        return None
+
+    def not_modified(self, last_modified):
+        if self.request.headers.get('If-None-Match'):
+            return self.check_etag_header()
+        if_modified_since = self.request.headers.get('If-Modified-Since')
+        if if_modified_since and last_modified:
+            since = parsedate(if_modified_since)
+            if since is not None:
+                return calendar.timegm(last_modified.utctimetuple()) <= calendar.timegm(since)
+        return False
+
+    @gen.coroutine
     def get(self, model_name):
+        id_style = self.get_argument('id_style', 'cobrapy')
+        if model_name != 'ME':
+            model_name = models.check_for_model(model_name)
+            if model_name is None:
+                raise tornado.web.HTTPError(404, 'Could not find model')
+        self.model_name = model_name
+        format, protocol = self.negotiate_format()
+        encoding = self.negotiate_encoding()
+
+        self.set_header('Vary', 'Accept, Accept-Encoding')
+        etag = None
+        if model_name != 'ME':
+            etag, last_modified = model_validators(model_name, id_style, format, protocol, encoding)
+            if etag is not None:
+                self.set_header('Etag', etag)
+                self.set_header('Last-Modified', last_modified)
+                if self.not_modified(last_modified):
+                    self.set_status(304)
+                    self.finish()
+                    return
+
         try:
-            id_style = self.get_arguments("id_style")[0]
-            model = models.load_model(model_name, id_style=id_style)
-        except IndexError:
-            model = models.load_model(model_name)
-        # self.set_header ('Content-Type', 'text/csv')
-        self.set_header('Content-Disposition', 'attachment; filename=%s.pickle' % model_name)
-        self.write(pickle.dumps(model))
+            data = yield get_body(self.application, model_name, id_style, format, protocol,
+                                  encoding, etag)
+        except Overloaded:
+            raise tornado.web.HTTPError(503, 'Too many models loading')
+        except gen.TimeoutError:
+            raise tornado.web.HTTPError(504, 'Timed out loading %s' % model_name)
+
+        self.set_header('Content-Type', content_types[format])
+        self.set_header('Content-Disposition', 'attachment; filename=%s.%s' % (model_name, format))
+        if encoding is not None:
+            self.set_header('Content-Encoding', encoding)
+        self.set_header('Content-Length', len(data))
+        metrics.count('bytes_served', len(data), model=model_name)
+        # stream the body. Slicing copies one chunk at a time, from bytes or
+        # from an mmap
+        for start in range(0, len(data), options.chunk_size):
+            self.write(data[start:start + options.chunk_size])
+            yield self.flush()
         self.finish()
 
 class GetModelsHandler(tornado.web.RequestHandler):
     def get(self, path):
-        data = json.dumps({'models': models.get_model_list()})
+        """List the models. With ?details=true, also list the available formats
+        of each model, with their sizes and mtimes."""
+        model_list = models.get_model_list()
+        result = {'models': model_list}
+        if self.get_argument('details', 'false').lower() in ('true', '1'):
+            result['formats'] = {name: {extension.lstrip('.'): {'size': x.size, 'mtime': x.mtime}
+                                        for extension, x in models.catalog.files(name).items()}
+                                 for name in model_list}
+        data = json.dumps(result)
+        self.write(data)
+        self.finish()
+
+class StatsHandler(tornado.web.RequestHandler):
+    def get(self):
+        memory = models.model_cache.memory
+        data = json.dumps({'response_cache': get_body_cache(self.application).stats(),
+                           'model_cache': {'hits': memory.hits,
+                                           'misses': memory.misses,
+                                           'evictions': memory.evictions,
+                                           'entries': len(memory),
+                                           'bytes': memory.size}})
         self.write(data)
         self.finish()
-                
-settings = {
-        "debug": "True",
-        }
+
+class SearchHandler(tornado.web.RequestHandler):
+    @gen.coroutine
+    def get(self):
+        """Search the reactions and metabolites of the models, e.g.
+        /search?q=glc__D_e&field=id&kind=metabolite&model=iJO1366&prefix=true&limit=100.
+        See theseus.search."""
+        query = self.get_argument('q')
+        field = self.get_argument('field', None)
+        kind = self.get_argument('kind', None)
+        if field is not None and field not in search.fields:
+            raise tornado.web.HTTPError(400, 'Invalid field %s' % field)
+        if kind is not None and kind not in search.kinds:
+            raise tornado.web.HTTPError(400, 'Invalid kind %s' % kind)
+        try:
+            limit = int(self.get_argument('limit', 1000))
+        except ValueError:
+            raise tornado.web.HTTPError(400, 'Invalid limit')
+        prefix = self.get_argument('prefix', 'false').lower() in ('true', '1')
+        model_names = self.get_arguments('model') or None
+        with metrics.stage('search'):
+            hits = yield get_search_executor(self.application).submit(
+                get_search_index(self.application).search, query, field=field, kind=kind,
+                models=model_names, prefix=prefix, limit=limit, update=False)
+        self.write(json.dumps({'query': query, 'results': [x._asdict() for x in hits]}))
+        self.finish()
+
+class MetricsHandler(tornado.web.RequestHandler):
+    def get(self):
+        """Report the metrics of the HistogramSink, and the sizes of the caches,
+        in the Prometheus text format"""
+        histograms = [x for x in metrics.sinks() if isinstance(x, metrics.HistogramSink)]
+        lines = [histograms[0].prometheus()] if histograms else []
+        memory = models.model_cache.memory
+        stats = get_body_cache(self.application).stats()
+        gauges = [('model_cache_entries', len(memory)), ('model_cache_bytes', memory.size),
+                  ('response_cache_entries', stats['entries']),
+                  ('response_cache_bytes', stats['bytes'])]
+        for name, value in gauges:
+            lines.append('# TYPE theseus_%s gauge\ntheseus_%s %d\n' % (name, name, value))
+        self.set_header('Content-Type', 'text/plain; version=0.0.4')
+        self.write(''.join(lines))
+        self.finish()
+
+settings = {}
 
 application = tornado.web.Application([
     (r"/models/(.*)", ModelHandler),
-    (r"/models()", GetModelsHandler)
+    (r"/models()", GetModelsHandler),
+    (r"/stats", StatsHandler),
+    (r"/metrics", MetricsHandler),
+    (r"/search", SearchHandler),
 ], **settings)
 
 if __name__=="__main__":
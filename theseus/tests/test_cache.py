@@ -0,0 +1,92 @@
+from theseus.cache import *
+
+def test_lru_cache():
+    cache = LRUCache(max_bytes=10)
+    cache.put('a', b'12345')
+    cache.put('b', b'12345')
+    assert cache.get('a') == b'12345'
+    # b is the least recently used
+    cache.put('c', b'123')
+    assert cache.get('b') is None
+    assert cache.size == 8
+    assert cache.evictions == 1
+    # too large for the budget
+    cache.put('d', b'12345678901')
+    assert 'd' not in cache
+
+def test_model_cache(tmpdir):
+    cache = ModelCache(directory=str(tmpdir))
+    key = ('iJO1366', 'cobrapy', 1, ())
+    model = {'reactions': ['PGI']}
+    cache.put(key, model)
+    model['reactions'].append('PFK')
+    # checkouts are copies
+    copy = cache.get(key)
+    assert copy == {'reactions': ['PGI']}
+    copy['reactions'].append('PFK')
+    assert cache.get(key) == {'reactions': ['PGI']}
+    # read from disk
+    cache.clear(memory_only=True)
+    assert cache.get(key) == {'reactions': ['PGI']}
+    # a new key for the same model replaces the old file
+    cache.put(('iJO1366', 'cobrapy', 1, (('iJO1366.xml', 1, 1),)), model)
+    assert len(tmpdir.listdir()) == 1
+    assert cache.get(('iJO1366', 'simpheny', 1, ())) is None
+    # clear removes the other files in the directory too
+    tmpdir.join(key_filename(key, extension='ids')).write('{}')
+    cache.clear()
+    assert tmpdir.listdir() == []
+    assert cache.get(key) is None
+
+def test_model_cache_bad_entry(tmpdir):
+    cache = ModelCache(directory=str(tmpdir))
+    key = ('iJO1366', 'cobrapy', 1, ())
+    cache.put(key, {'reactions': ['PGI']})
+    # e.g. written with a newer pickle protocol
+    path = tmpdir.listdir()[0]
+    path.write_binary(b'\x80\x09bad')
+    cache.clear(memory_only=True)
+    assert cache.get(key) is None
+    assert tmpdir.listdir() == []
+    # another protocol, Python or cobra version uses another file
+    other = ModelCache(directory=str(tmpdir), protocol=2)
+    assert other._filename(key) != cache._filename(key)
+
+def test_body_cache_spill(tmpdir):
+    cache = BodyCache(max_bytes=10, spill_directory=str(tmpdir))
+    key_1 = ('iJO1366', 'cobrapy', 'pickle', 2, None, '"1"')
+    key_2 = ('iJO1366', 'cobrapy', 'pickle', 2, 'gzip', '"1"')
+    cache.put(key_1, b'123456')
+    cache.put(key_2, b'123456')
+    # key_1 was spilled to a memory-mapped file
+    assert cache.stats()['spills'] == 1
+    assert cache.get(key_1)[:] == b'123456'
+    assert cache.get(key_1)[2:4] == b'34'
+    assert cache.stats()['disk_hits'] == 2
+    # larger than the budget, so straight to disk
+    cache.put(('iJO1366', 'simpheny', 'json', None, None, '"1"'), b'12345678901')
+    assert len(tmpdir.listdir()) == 2
+    assert cache.get(('iJO1366', 'cobrapy', 'json', None, None, '"1"')) is None
+
+def test_shared_body_cache(tmpdir):
+    from concurrent.futures import ThreadPoolExecutor
+    import time
+
+    # two processes, or two caches on one directory
+    cache_1 = SharedBodyCache(str(tmpdir))
+    cache_2 = SharedBodyCache(str(tmpdir))
+    key = ('iJO1366', 'cobrapy', 'pickle', 2, None, '"1"')
+    builds = []
+    def build():
+        builds.append(1)
+        time.sleep(0.05)
+        return b'123456'
+    with ThreadPoolExecutor(4) as executor:
+        results = list(executor.map(lambda cache: cache.build(key, build),
+                                    [cache_1, cache_2, cache_1, cache_2]))
+    assert len(builds) == 1
+    assert all(x[:] == b'123456' for x in results)
+    assert cache_2.get(key)[2:4] == b'34'
+    assert cache_1.get(key[:5] + ('"2"',)) is None
+    stats = cache_1.stats()
+    assert stats['entries'] == 1 and stats['bytes'] == 6
@@ -0,0 +1,44 @@
+from theseus.catalog import *
+
+import os
+
+def test_model_catalog(tmpdir):
+    models_directory = tmpdir.mkdir('models')
+    pickle_directory = tmpdir.mkdir('model_pickles')
+    models_directory.join('E coli core.xml').write('<sbml/>')
+    models_directory.join('iAF1260b.mat').write('mat')
+    models_directory.join('iAF1260b.xml').write('<sbml/>')
+    models_directory.join('sources.md').write('sources')
+    pickle_directory.join('iAF1260b.pickle').write('pickle')
+    pickle_directory.join('removed.pickle').write('pickle')
+    catalog = ModelCatalog(str(models_directory), str(pickle_directory), check_interval=0)
+
+    assert catalog.names() == ['E coli core', 'iAF1260b']
+    assert catalog.find('e_coli_core') == 'E coli core'
+    assert catalog.find('E. coli core') == 'E coli core'
+    assert catalog.find('iJO1366') is None
+    files = catalog.files('iAF1260b')
+    assert sorted(files) == ['.mat', '.pickle', '.xml']
+    assert files['.mat'].size == 3
+    assert [os.path.basename(x.path) for x in catalog.preferred_files('iAF1260b')] == \
+        ['iAF1260b.pickle', 'iAF1260b.mat', 'iAF1260b.xml']
+    # a pickle older than a source is stale
+    source_mtime = files['.xml'].mtime
+    os.utime(str(pickle_directory.join('iAF1260b.pickle')), (source_mtime - 10, source_mtime - 10))
+    catalog.refresh(force=True)
+    assert [os.path.basename(x.path) for x in catalog.preferred_files('iAF1260b')] == \
+        ['iAF1260b.mat', 'iAF1260b.xml']
+    # a source changed in place, which does not change the directory mtime
+    pickle_directory.join('iAF1260b.theseus').write('compact')
+    catalog.refresh(force=True)
+    assert '.theseus' in catalog.files('iAF1260b')
+    compact_mtime = catalog.files('iAF1260b')['.theseus'].mtime
+    models_directory.join('iAF1260b.xml').write('<sbml></sbml>')
+    os.utime(str(models_directory.join('iAF1260b.xml')), (compact_mtime + 10, compact_mtime + 10))
+    assert catalog.files('iAF1260b')['.xml'].size == 13
+    assert [os.path.basename(x.path) for x in catalog.preferred_files('iAF1260b')] == \
+        ['iAF1260b.mat', 'iAF1260b.xml']
+
+    # new files are found
+    models_directory.join('iJO1366.json').write('{}')
+    assert catalog.find('ijo1366') == 'iJO1366'
@@ -0,0 +1,45 @@
+from theseus.cli import *
+
+import theseus.cli
+import os
+import time
+
+def test_export(tmpdir, monkeypatch):
+    monkeypatch.setattr(theseus.cli, 'export_path', str(tmpdir.join('exports')))
+    output_dir = str(tmpdir.mkdir('output'))
+    assert main(['export', 'E coli core', 'iAF692', '--format', 'json', '--format', 'compact',
+                 '--output-dir', output_dir, '--workers', '2']) == 0
+    paths = [os.path.join(output_dir, x) for x in
+             ['E coli core.json', 'E coli core.theseus', 'iAF692.json', 'iAF692.theseus']]
+    assert all(os.path.exists(x) for x in paths)
+    # only the outputs are written to the output directory
+    assert len(os.listdir(output_dir)) == 4
+
+    # up to date, so skipped
+    mtime = os.path.getmtime(paths[0])
+    time.sleep(0.01)
+    result, = export(['E coli core'], ['json'], output_dir=output_dir)
+    assert result['outputs'][0][2] == 'up to date'
+    assert os.path.getmtime(paths[0]) == mtime
+    result, = export(['E coli core'], ['json'], output_dir=output_dir, force=True)
+    assert result['outputs'][0][2] == 'exported'
+    # another id style is exported again
+    result, = export(['E coli core'], ['json'], id_style='simpheny', output_dir=output_dir)
+    assert result['outputs'][0][2] == 'exported'
+    assert exported_id_style(paths[0]) == 'simpheny'
+    assert len(os.listdir(output_dir)) == 4
+    # an output that was replaced is exported again
+    with open(paths[0], 'w') as f:
+        f.write('{}')
+    os.utime(paths[0], (mtime + 10, mtime + 10))
+    assert exported_id_style(paths[0]) is None
+
+def test_export_name(tmpdir, monkeypatch):
+    monkeypatch.setattr(theseus.cli, 'export_path', str(tmpdir.join('exports')))
+    # the output is named after the name that was given
+    result, = export(['e_coli_core'], ['json'], output_dir=str(tmpdir), workers=1)
+    assert result['outputs'][0][1] == os.path.join(str(tmpdir), 'e_coli_core.json')
+    assert os.path.exists(os.path.join(str(tmpdir), 'e_coli_core.json'))
+
+def test_export_not_found(tmpdir):
+    assert main(['export', 'not_a_model', '--output-dir', str(tmpdir)]) == 1
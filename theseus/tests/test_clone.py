@@ -0,0 +1,126 @@
+from theseus.clone import *
+from theseus.exchanges import exchange_index
+from theseus.models import (load_model, add_pathway, setup_model, iter_pathway_models,
+                            turn_off_carbon_sources, remove_pathway)
+
+import pickle
+import pytest
+
+pathway = [{'1poh_c': {'formula': 'C3H8O', 'name': '1-propanol'}},
+           {'2OBUTDC': {'2obut_c': -1, 'h_c': -1, 'ppal_c': 1, 'co2_c': 1},
+            '1PDH': {'ppal_c': -1, 'nadh_c': -1, 'h_c': -1, '1poh_c': 1, 'nad_c': 1},
+            'EX_1poh_e': {'1poh_c': -1}},
+           {'EX_1poh_e': '1-propanol production'},
+           {'EX_1poh_e': (0, 1000)}]
+
+@pytest.fixture(scope='module')
+def base():
+    return load_model('iJO1366')
+
+def copied(clone):
+    return sorted(x for x in clone.reactions._dict if clone.reactions.is_copied(x))
+
+def test_clone_bounds(base):
+    clone = clone_model(base)
+    assert copied(clone) == []
+    reaction = clone.reactions.get_by_id('PGI')
+    assert reaction is not base.reactions.get_by_id('PGI')
+    assert reaction is clone.reactions.get_by_id('PGI')
+    assert next(iter(reaction._metabolites)) in base.metabolites
+    reaction.lower_bound = 0
+    assert base.reactions.get_by_id('PGI').lower_bound == -1000
+    assert copied(clone) == ['PGI']
+    # read without copying
+    assert clone.reactions.list_attr('lower_bound').count(0) > 0
+    assert len(clone.reactions.query('^EX_glc_e$')) == 1
+    assert copied(clone) == ['EX_glc_e', 'PGI']
+
+def test_clone_setup_model(base):
+    clone = setup_model(clone_model(base), 'EX_glc_e', aerobic=False)
+    assert base.reactions.get_by_id('EX_glc_e').lower_bound == 0
+    assert clone.reactions.get_by_id('EX_glc_e').lower_bound == -10
+    assert len(copied(clone)) < 10
+    changes = clone.diff().changed_reactions
+    assert changes['EX_glc_e'] == {'lower_bound': (0, -10)}
+    assert changes['EX_o2_e'] == {'lower_bound': (-1000, 0)}
+
+    clone.objective = 'PGI'
+    assert [r.id for r in clone.objective] == ['PGI']
+    assert len(base.objective) == 1 and list(base.objective)[0].id != 'PGI'
+
+    turn_off_carbon_sources(clone)
+    assert len(copied(clone)) < len(exchange_index(base).reactions) + 10
+    assert base.reactions.get_by_id('EX_ac_e').lower_bound == 0
+
+def test_clone_optimize(base):
+    clone = setup_model(clone_model(base), 'EX_glc_e', aerobic=True)
+    n_copied = len(copied(clone))
+    solution = clone.optimize()
+    assert len(copied(clone)) == n_copied
+    assert clone.solution is solution
+    assert solution.f > 0.1
+    # the base is not changed
+    clone.reactions.get_by_id('EX_glc_e').lower_bound = 0
+    # no carbon source
+    assert not clone.optimize().f
+    assert base.reactions.get_by_id('EX_glc_e').lower_bound == 0
+
+def test_clone_add_pathway(base):
+    h_c = base.metabolites.get_by_id('h_c')
+    n_reactions, n_links = len(base.reactions), len(h_c._reaction)
+    clone = add_pathway(clone_model(base), *pathway, check_mass_balance=True)
+    assert len(clone.reactions) == n_reactions + 3
+    assert len(base.reactions) == n_reactions
+    assert '1poh_c' not in base.metabolites
+    # the shared metabolites are not linked to the new reactions
+    assert len(h_c._reaction) == n_links
+    assert len(clone.metabolites.get_by_id('1poh_c')._reaction) == 2
+    assert clone.reactions.get_by_id('1PDH')._metabolites[h_c] == -1
+    assert copied(clone) == ['1PDH', '2OBUTDC', 'EX_1poh_e']
+    with pytest.raises(Exception):
+        add_pathway(clone, *pathway)
+
+    for model in iter_pathway_models(base, [pathway, pathway], copy=True):
+        assert isinstance(model, ModelClone)
+        assert '1PDH' in model.reactions
+    assert len(base.reactions) == n_reactions
+
+def test_clone_remove_pathway(base):
+    clone = add_pathway(clone_model(base), *pathway)
+    # removing reactions that are not at the end only copies the ones removed
+    remove_pathway(clone, [clone.reactions.get_by_id('2OBUTDC'),
+                           clone.reactions.get_by_id('PGI')], [])
+    assert copied(clone) == ['1PDH', 'EX_1poh_e']
+    assert clone.diff().removed_reactions == ['PGI']
+    assert len(clone.reactions) == len(base.reactions) + 1
+    assert all(clone.reactions._dict[r.id] == i
+               for i, r in enumerate(clone.reactions.iter_shared()))
+    assert 'PGI' in base.reactions
+
+def test_clone_diff_reset(base):
+    clone = add_pathway(clone_model(base), *pathway)
+    clone.remove_reactions(['PGI'])
+    clone.remove_metabolites(['ppal_c'])
+    clone.reactions.get_by_id('PFK').upper_bound = 10
+    diff = clone.diff()
+    assert diff.added_reactions == ['1PDH', '2OBUTDC', 'EX_1poh_e']
+    assert diff.removed_reactions == ['PGI']
+    assert diff.added_metabolites == ['1poh_c']
+    assert diff.removed_metabolites == ['ppal_c']
+    assert diff.changed_reactions['PFK'] == {'upper_bound': (1000, 10)}
+    # ppal_c is removed from the reactions of the base that use it
+    old, new = diff.changed_reactions['ALDD3y']['metabolites']
+    assert 'ppal_c' in old and 'ppal_c' not in new
+    assert 'ppal_c' not in [m.id for m in clone.reactions.get_by_id('1PDH')._metabolites]
+    assert 'PGI' in base.reactions and 'ppal_c' in base.metabolites
+
+    # a clone pickles as a plain model
+    model = pickle.loads(pickle.dumps(clone))
+    assert not isinstance(model, ModelClone)
+    assert len(model.reactions) == len(clone.reactions)
+    assert model.reactions.get_by_id('PFK').upper_bound == 10
+
+    clone.reset()
+    assert clone.diff() == CloneDiff([], [], [], [], {})
+    assert copied(clone) == []
+    assert len(clone.reactions) == len(base.reactions)
@@ -0,0 +1,60 @@
+from theseus.compact import *
+from theseus.models import load_raw_model, catalog, data_path
+
+import cobra
+from os.path import join, exists
+
+def assert_same_model(model, model_2):
+    assert model.id == model_2.id
+    assert [x.id for x in model.reactions] == [x.id for x in model_2.reactions]
+    assert [x.id for x in model.metabolites] == [x.id for x in model_2.metabolites]
+    assert sorted(x.id for x in model.genes) == sorted(x.id for x in model_2.genes)
+    for reaction in model.reactions:
+        reaction_2 = model_2.reactions.get_by_id(reaction.id)
+        assert reaction.bounds == reaction_2.bounds
+        assert reaction.objective_coefficient == reaction_2.objective_coefficient
+        assert reaction.gene_reaction_rule == reaction_2.gene_reaction_rule
+        assert reaction.subsystem == reaction_2.subsystem
+        assert ({m.id: v for m, v in reaction.metabolites.items()} ==
+                {m.id: v for m, v in reaction_2.metabolites.items()})
+    for metabolite in model.metabolites:
+        metabolite_2 = model_2.metabolites.get_by_id(metabolite.id)
+        for attribute in 'name', 'charge', 'compartment', 'notes':
+            assert getattr(metabolite, attribute) == getattr(metabolite_2, attribute)
+        assert str(metabolite.formula) == str(metabolite_2.formula)
+
+def test_round_trip(tmpdir):
+    model = cobra.Model('test')
+    a = cobra.Metabolite('a_c', formula='C6H12O6', name='A', compartment='c')
+    a.charge = -1
+    b = cobra.Metabolite('b_c', compartment='c')
+    reaction = cobra.Reaction('R1', name='R one', subsystem='S')
+    reaction.add_metabolites({a: -1, b: 2.5})
+    reaction.lower_bound, reaction.upper_bound = -10, 100
+    reaction.objective_coefficient = 1
+    reaction.gene_reaction_rule = 'b0001 or b0002'
+    model.add_reactions([reaction, cobra.Reaction('R2')])
+    model.genes.get_by_id('b0001').name = 'thrL'
+
+    path = str(tmpdir.join('test.theseus'))
+    save_compact(model, path)
+    compact = CompactModel(path)
+    assert list(compact.arrays['lower_bound']) == [-10, 0]
+    assert list(compact.arrays['indptr']) == [0, 2, 2]
+    assert compact.strings['reactions']['id'] == ['R1', 'R2']
+    model_2 = compact.to_model()
+    assert_same_model(model, model_2)
+    assert model_2.genes.get_by_id('b0001').name == 'thrL'
+    assert model_2.reactions.R1 in model_2.metabolites.a_c.reactions
+
+def test_convert_bundled_model(tmpdir):
+    model_file = catalog.files('E coli core')['.xml']
+    path = convert_file(model_file.path, str(tmpdir.join('E coli core.theseus')))
+    assert_same_model(cobra.io.read_sbml_model(model_file.path), load_compact(path))
+
+def test_load_raw_model_prefers_compact():
+    load_raw_model('E coli core')
+    assert exists(join(data_path, 'model_pickles', 'E coli core.theseus'))
+    catalog.refresh(force=True)
+    assert catalog.preferred_files('E coli core')[0].path.endswith('.theseus')
+    assert len(load_raw_model('E coli core').reactions) > 90
@@ -0,0 +1,42 @@
+from theseus.exchanges import *
+from theseus.models import load_model
+import theseus.exchanges
+
+import gc
+import pickle
+import weakref
+
+def test_exchange_index():
+    model = load_model('iJO1366')
+    index = exchange_index(model)
+    assert exchange_index(model) is index
+    # not pickled with the model
+    assert b'ExchangeIndex' not in pickle.dumps(model)
+    glc = index.reactions.index(model.reactions.get_by_id('EX_glc_e'))
+    assert index.counts('C')[glc] == 6
+    assert index.counts('Xx').sum() == 0
+    assert model.reactions.get_by_id('EX_glc_e') in index.reactions_containing('C')
+
+    model.reactions.get_by_id('EX_nh4_e').lower_bound = -10
+    uptake = index.uptake_reactions('N')
+    assert model.reactions.get_by_id('EX_nh4_e') in uptake
+    assert all(r.lower_bound < 0 for r in uptake)
+
+def test_exchange_index_out_of_date():
+    model = load_model('E coli core')
+    index = exchange_index(model)
+    copy = model.copy()
+    assert exchange_index(copy) is not index
+    assert exchange_index(copy).reactions[0] is copy.reactions.get_by_id(index.reactions[0].id)
+    copy.remove_reactions([copy.reactions.get_by_id('EX_glc_e')])
+    assert 'EX_glc_e' not in [x.id for x in exchange_index(copy).reactions]
+
+def test_exchange_index_collected():
+    model = load_model('E coli core', use_cache=False)
+    exchange_index(model)
+    ref = weakref.ref(model)
+    n_indexes = len(theseus.exchanges._indexes)
+    del model
+    gc.collect()
+    assert ref() is None
+    assert len(theseus.exchanges._indexes) < n_indexes
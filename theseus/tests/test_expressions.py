@@ -0,0 +1,96 @@
+from theseus.expressions import *
+
+import pytest
+cobrame = pytest.importorskip('cobrame')
+
+from cobrame.util import mu
+from cobrame.solve.symbolic import compile_expressions
+import cobra
+import os
+
+def symbolic_model():
+    model = cobra.Model('ME')
+    a, b = cobra.Metabolite('a'), cobra.Metabolite('b')
+    b._bound = mu * 2
+    r1, r2 = cobra.Reaction('r1'), cobra.Reaction('r2')
+    r1.add_metabolites({a: -1, b: mu})
+    r2.add_metabolites({b: -1})
+    r2.upper_bound = mu * 10
+    model.add_reactions([r1, r2])
+    return model
+
+def evaluate(expressions):
+    result = {}
+    for key, value in expressions.items():
+        if isinstance(value, tuple):
+            value = tuple(x(0.5) if callable(x) else x for x in value)
+        else:
+            value = value(0.5)
+        result[key] = value
+    return result
+
+def test_update_expressions():
+    model = symbolic_model()
+    update_expressions(model)
+    assert evaluate(model.expressions) == evaluate(compile_expressions(model))
+
+    # add a reaction and a metabolite
+    c = cobra.Metabolite('c')
+    c._bound = mu
+    r3 = cobra.Reaction('r3')
+    r3.add_metabolites({c: mu * 3, model.metabolites.a: 1})
+    model.add_reactions([r3])
+    compiled = model.expressions[(None, 1)]
+    update_expressions(model)
+    # the old expressions were kept
+    assert model.expressions[(None, 1)] is compiled
+    assert evaluate(model.expressions) == evaluate(compile_expressions(model))
+
+    # change a reaction
+    model.reactions.r2.upper_bound = 1000
+    update_expressions(model, reactions=['r2'])
+    assert (None, 1) not in model.expressions
+    assert evaluate(model.expressions) == evaluate(compile_expressions(model))
+
+    # remove a reaction, and compile everything
+    model.remove_reactions([model.reactions.r1])
+    update_expressions(model)
+    assert evaluate(model.expressions) == evaluate(compile_expressions(model))
+
+def test_remove_expressions():
+    model = symbolic_model()
+    c = cobra.Metabolite('c')
+    c._bound = mu
+    r3, r4 = cobra.Reaction('r3'), cobra.Reaction('r4')
+    r3.add_metabolites({c: mu * 3})
+    r4.add_metabolites({model.metabolites.b: mu * 4})
+    model.add_reactions([r3, r4])
+    update_expressions(model)
+    compiled = model.expressions[(None, 1)]
+
+    # remove a reaction from the middle and a metabolite from the end
+    remove_expressions(model, [model.reactions.r3], [model.metabolites.c])
+    model.remove_reactions([model.reactions.r3])
+    model.metabolites.remove(c)
+    assert model._compiled_ids == (['r1', 'r2', 'r4'], ['a', 'b'])
+    assert evaluate(model.expressions) == evaluate(compile_expressions(model))
+    # the next update is incremental
+    update_expressions(model)
+    assert model.expressions[(None, 1)] is compiled
+
+def test_expressions_cache(tmpdir):
+    model = symbolic_model()
+    path = str(tmpdir.join('me.pickle'))
+    with open(path, 'wb') as f:
+        f.write(b'model')
+    assert not load_expressions(model, path)
+    update_expressions(model)
+    save_expressions(model, path)
+    assert os.path.exists(expressions_path(path))
+
+    model_2 = symbolic_model()
+    assert load_expressions(model_2, path)
+    assert evaluate(model_2.expressions) == evaluate(model.expressions)
+    # other models do not match
+    model_2.add_reactions([cobra.Reaction('r3')])
+    assert not load_expressions(model_2, path)
@@ -0,0 +1,58 @@
+from theseus.ids import *
+from theseus.ids import _fix_legacy_id_sequential
+from theseus.models import data_path
+
+from os.path import join
+import os
+import re
+
+def bundled_ids():
+    """Get (id, is_metabolite) for every species and reaction in the bundled
+    SBML models."""
+    ids = set()
+    id_re = re.compile(r'<(species|reaction) [^>]*?id="([^"]+)"')
+    for filename in os.listdir(join(data_path, 'models')):
+        if not filename.endswith('.xml'):
+            continue
+        with open(join(data_path, 'models', filename), 'rb') as f:
+            text = f.read().decode('utf-8')
+        for kind, the_id in id_re.findall(text):
+            if the_id[:2] in ('M_', 'R_'):
+                the_id = the_id[2:]
+            ids.add((the_id, kind == 'species'))
+    return sorted(ids)
+
+def test_fix_legacy_id():
+    assert fix_legacy_id('glc_DASH_D_LPAREN_e_RPAREN_') == 'glc__D(e)'
+    assert fix_legacy_id('glc_DASH_D_LPAREN_e_RPAREN_', use_hyphens=True) == 'glc-D(e)'
+    assert fix_legacy_id('lac-D') == 'lac__D'
+    # escapes that share an underscore
+    for the_id in ['_LPAREN_DASH_', '_RPAREN_LPAREN_', '&amp;lt;', 'a_DASH_FSLASH_b']:
+        for use_hyphens in True, False:
+            assert (fix_legacy_id(the_id, use_hyphens) ==
+                    _fix_legacy_id_sequential(the_id, use_hyphens))
+
+def test_id_translator():
+    translator = IdTranslator(max_size=2)
+    assert translator.id_for_new_id_style('lac_D_e', True, 'simpheny') == 'lac-D[e]'
+    assert translator.id_for_new_id_style('EX_lac_D_e', False, 'simpheny') == 'EX_lac-D(e)'
+    assert len(translator) == 2
+    # the memo is bounded
+    translator.fix_legacy_id('glc_DASH_D_e')
+    assert len(translator) == 1
+    assert (translator.ids_for_new_id_style(['atp_c', 'EX_glc(e)'], False, 'cobrapy') ==
+            ['atp_c', 'EX_glc_e'])
+
+def test_round_trip():
+    ids = bundled_ids()
+    assert len(ids) > 1000
+    for is_metabolite in True, False:
+        old_ids = [x for x, m in ids if m == is_metabolite]
+        fixed_ids = fix_legacy_ids(old_ids)
+        assert fixed_ids == [_fix_legacy_id_sequential(x) for x in old_ids]
+        cobrapy_ids = ids_for_new_id_style(fixed_ids, is_metabolite, 'cobrapy')
+        assert cobrapy_ids == [id_for_new_id_style(x, is_metabolite, 'cobrapy')
+                               for x in fixed_ids]
+        simpheny_ids = ids_for_new_id_style(cobrapy_ids, is_metabolite, 'simpheny')
+        assert ids_for_new_id_style(simpheny_ids, is_metabolite, 'cobrapy') == cobrapy_ids
+        assert ids_for_new_id_style(cobrapy_ids, is_metabolite, 'simpheny') == simpheny_ids
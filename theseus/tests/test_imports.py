@@ -0,0 +1,32 @@
+import json
+import subprocess
+import sys
+
+# seconds for import theseus, get_model_list and check_for_model, in a new
+# interpreter. About 0.15 s when this was recorded, and 0.8 s when cobra was
+# imported with theseus.models.
+IMPORT_BUDGET = 0.5
+
+script = """
+import json, sys, time
+start = time.time()
+import theseus
+theseus.get_model_list()
+theseus.check_for_model('e coli core')
+seconds = time.time() - start
+print(json.dumps({'seconds': seconds,
+                  'modules': [x for x in ('cobra', 'cobrame', 'sympy', 'scipy', 'tornado')
+                              if x in sys.modules]}))
+"""
+
+def _run():
+    output = subprocess.check_output([sys.executable, '-c', script])
+    return json.loads(output.decode('utf-8').strip().splitlines()[-1])
+
+def test_import_without_cobra():
+    assert _run()['modules'] == []
+
+def test_import_time():
+    # best of 3, for noisy machines
+    seconds = min(_run()['seconds'] for _ in range(3))
+    assert seconds < IMPORT_BUDGET, 'import theseus took %.2f s' % seconds
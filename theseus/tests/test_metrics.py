@@ -0,0 +1,61 @@
+from theseus.metrics import *
+from theseus import metrics
+from theseus.models import load_model
+
+import os
+import pytest
+
+@pytest.fixture
+def histogram():
+    sink = HistogramSink()
+    enable(sink)
+    yield sink
+    disable()
+
+def test_disabled():
+    assert not enabled()
+    assert stage('convert_ids') is stage('load_json')
+    with stage('convert_ids'):
+        pass
+    count('bytes_served', 10)
+
+def test_load_model_stages(histogram):
+    load_model('E coli core', use_cache=False)
+    stages = set(x[0] for x in histogram.stages())
+    assert {'convert_ids', 'get_formulas_from_names', 'turn_off_carbon_sources'} <= stages
+    assert any(x.startswith('load_') for x in stages)
+    load_model('E coli core')
+    load_model('E coli core')
+    assert histogram.counts()[('model_cache_hits', 'E coli core')] >= 1
+
+def test_histogram():
+    sink = HistogramSink(max_samples=100)
+    for i in range(200):
+        sink.record(StageRecord('request', 'iJO1366', i / 1000.0, 0, None))
+    sink.record(StageRecord('request', 'iJO1366', 0.0, 0, 'KeyError'))
+    sink.count('bytes_served', 5, 'iJO1366')
+    sink.count('bytes_served', 5, 'iJO1366')
+    # the last 100 samples
+    assert sink.percentiles('request', 'iJO1366', [0.5]) == [0.15]
+    assert sink.stages()[('request', 'iJO1366')][0] == 201
+    assert sink.stages()[('request', 'iJO1366')][3] == 1
+    text = sink.prometheus()
+    assert 'theseus_stage_seconds{stage="request",model="iJO1366",quantile="0.5"} 0.15' in text
+    assert 'theseus_stage_seconds_count{stage="request",model="iJO1366"} 201' in text
+    assert 'theseus_bytes_served_total{model="iJO1366"} 10' in text
+
+def test_stage_error(histogram):
+    with pytest.raises(KeyError):
+        with stage('convert_ids', 'iJO1366'):
+            raise KeyError('x')
+    assert histogram.stages()[('convert_ids', 'iJO1366')][3] == 1
+
+def test_profile(tmpdir):
+    enable(profile_directory=str(tmpdir))
+    try:
+        with profile('iJO1366-cobrapy'):
+            sum(range(1000))
+    finally:
+        disable()
+    assert len(os.listdir(str(tmpdir))) == 1
+    assert metrics._profile_directory is None
@@ -1,5 +1,9 @@
+from __future__ import print_function
+
 from theseus.models import *
 
+import theseus.models
+from collections import OrderedDict
 import cobra
 import os
 import pytest
@@ -33,27 +37,27 @@ def test_id_for_new_id_style():
 
 def test_convert_ids():
     for model_name in 'iJO1366', 'iAF1260', 'E coli core':
-        print "\n"
-        print model_name
+        print("\n")
+        print(model_name)
         model = load_model(model_name)
 
         # cobrapy style
         model = convert_ids(model, new_id_style='cobrapy')
-        print 'cobrapy ids'
-        print [str(x) for x in model.reactions if 'lac' in str(x)]
+        print('cobrapy ids')
+        print([str(x) for x in model.reactions if 'lac' in str(x)])
         assert 'EX_lac__D_e' in [str(x) for x in model.reactions]
         assert ['-' not in str(x) for x in model.reactions]
-        print [str(x) for x in model.metabolites if 'lac' in str(x)]
+        print([str(x) for x in model.metabolites if 'lac' in str(x)])
         assert 'lac__D_e' in [str(x) for x in model.metabolites]
         assert ['-' not in str(x) for x in model.metabolites]
 
         # simpheny style
         model = convert_ids(model, new_id_style='simpheny')
-        print 'simpheny ids'
-        print [str(x) for x in model.reactions if 'lac' in str(x)]
+        print('simpheny ids')
+        print([str(x) for x in model.reactions if 'lac' in str(x)])
         assert 'EX_lac-D(e)' in [str(x) for x in model.reactions]
         assert ['__' not in str(x) for x in model.reactions]
-        print [str(x) for x in model.metabolites if 'lac' in str(x)]
+        print([str(x) for x in model.metabolites if 'lac' in str(x)])
         assert 'lac-D[e]' in [str(x) for x in model.metabolites]
         assert ['__' not in str(x) for x in model.metabolites]
 
@@ -65,7 +69,7 @@ def test_get_formulas_from_names():
 
 def test_turn_off_carbon_sources():
     for model_name in 'iJO1366', 'iAF1260', 'E coli core':
-        print model_name
+        print(model_name)
         model = load_model(model_name)
         model.reactions.get_by_id('EX_glc_e').lower_bound = -100
         model.reactions.get_by_id('EX_ac_e').lower_bound = -100
@@ -109,9 +113,9 @@ def test_add_pathway():
 
     m = load_model('iJO1366')
     model = add_pathway(m.copy(), *new, check_mass_balance=True)
-    assert isinstance(model.metabolites.get_by_id(new[0].keys()[0]), cobra.Metabolite)
+    assert isinstance(model.metabolites.get_by_id(list(new[0].keys())[0]), cobra.Metabolite)
     reaction = model.reactions.get_by_id('EX_1poh_e')
-    assert isinstance(model.reactions.get_by_id(new[1].keys()[0]), cobra.Reaction)
+    assert isinstance(model.reactions.get_by_id(list(new[1].keys())[0]), cobra.Reaction)
     assert reaction.reversibility == False
     assert reaction.upper_bound == 1000
     assert reaction.lower_bound == 0
@@ -126,3 +130,147 @@ def test_add_pathway():
     with pytest.raises(Exception):
         model = add_pathway(model, *new)
     model = add_pathway(model, *new, ignore_repeats=True)
+
+def test_add_pathway_rollback():
+    model = load_model('E coli core')
+    n_reactions, n_metabolites = len(model.reactions), len(model.metabolites)
+    pathway = [{'1poh_c': {'formula': 'C3H8O'}},
+               {'1PDH': {'ppal_c': -1, 'nadh_c': -1, 'h_c': -1, '1poh_c': 1, 'nad_c': 1},
+                'EX_1poh_e': {'1poh_c': -1}},
+               {}, {}]
+    # ppal_c is not in the core model
+    with pytest.raises(Exception):
+        add_pathway(model, *pathway)
+    # unbalanced
+    pathway[1] = {'BAD': {'nadh_c': -1, '1poh_c': 1}}
+    with pytest.raises(Exception):
+        add_pathway(model, *pathway, check_mass_balance=True)
+    assert len(model.reactions) == n_reactions
+    assert len(model.metabolites) == n_metabolites
+    assert '1poh_c' not in model.metabolites
+    assert all(r.id != 'BAD' for r in model.metabolites.get_by_id('nadh_c')._reaction)
+
+def test_pathway_balance():
+    model = load_model('E coli core')
+    reactions = [model.reactions.get_by_id('PGI'), model.reactions.get_by_id('EX_glc_e')]
+    balance = pathway_balance(reactions)
+    assert 'PGI' not in balance
+    assert balance['EX_glc_e'] == {'C': -6, 'H': -12, 'O': -6}
+
+def test_add_pathways():
+    new = [{'1poh_c': {'formula': 'C3H8O'}},
+           {'1PDH': {'ppal_c': -1, 'nadh_c': -1, 'h_c': -1, '1poh_c': 1, 'nad_c': 1}},
+           {}, {}]
+    other = [{'ppal_c': {'formula': 'C3H6O'}}, {'EX_ppal_c': {'ppal_c': -1}}, {}, {}]
+    model = load_model('E coli core')
+    n_reactions = len(model.reactions)
+    # 1PDH needs ppal_c from the other pathway
+    add_pathways(model, [new, other], check_mass_balance=True)
+    assert len(model.reactions) == n_reactions + 2
+
+    model = load_model('E coli core')
+    seen = []
+    for m in iter_pathway_models(model, [other, other]):
+        assert 'EX_ppal_c' in m.reactions
+        seen.append(m.metabolites.get_by_id('ppal_c'))
+    assert len(seen) == 2 and seen[0] is not seen[1]
+    assert len(model.reactions) == n_reactions
+    assert 'ppal_c' not in model.metabolites
+    assert model.reactions.get_by_id('PGI') is model.reactions[model.reactions.index('PGI')]
+
+def test_load_model_cache():
+    model_cache.clear()
+    hits = model_cache.memory.hits
+    model = load_model('E coli core')
+    # change the first copy, and check out another one
+    model.reactions.get_by_id('EX_glc_e').lower_bound = -1
+    model_2 = load_model('E coli core')
+    assert model_2 is not model
+    assert model_2.reactions.get_by_id('EX_glc_e').lower_bound == 0
+    assert model_cache.memory.hits == hits + 1
+
+    # the disk tier survives a restart
+    model_cache.clear(memory_only=True)
+    model_3 = load_model('E coli core')
+    assert len(model_3.reactions) == len(model.reactions)
+
+    # the key changes with the id style and the source files
+    assert (model_cache_key('E coli core', 'cobrapy') !=
+            model_cache_key('E coli core', 'simpheny'))
+
+def test_load_model_me(tmpdir, monkeypatch):
+    model = load_model('E coli core')
+    glucose = model.reactions.get_by_id('EX_glc_e')
+    glucose.id = 'EX_glc__D_e'
+    glucose.lower_bound = -10
+    model.reactions._generate_index()
+    path = str(tmpdir.join('prototype_67.pickle'))
+    with open(path, 'wb') as f:
+        pickle.dump(model, f)
+    cache = ModelCache(directory=str(tmpdir.join('processed')))
+    monkeypatch.setattr(theseus.models, 'me_path', path)
+    monkeypatch.setattr(theseus.models, 'model_cache', cache)
+
+    me = load_model_me(expressions=False)
+    assert me.reactions.get_by_id('EX_glc__D_e').lower_bound == 0
+    me.reactions.get_by_id('EX_glc__D_e').lower_bound = -5
+    me_2 = load_model_me(expressions=False)
+    assert me_2 is not me
+    assert me_2.reactions.get_by_id('EX_glc__D_e').lower_bound == 0
+    assert cache.memory.hits == 1
+    # the variants are cached separately
+    me_3 = load_model_me(unmodified_me=True, expressions=False)
+    assert me_3.reactions.get_by_id('EX_glc__D_e').lower_bound == -10
+    assert len(cache.memory) == 2
+
+def test_get_id_mapping():
+    model = load_raw_model('E coli core')
+    n_reactions = len(model.reactions)
+    reaction_ids, metabolite_ids, boundary = get_id_mapping(model, 'simpheny')
+    assert reaction_ids['EX_lac_D_e'] == 'EX_lac-D(e)'
+    assert metabolite_ids['lac_D_e'] == 'lac-D[e]'
+    assert 'ac_b' in boundary
+    assert 'ac_b' not in metabolite_ids
+    # the model is not changed
+    assert 'EX_lac_D_e' in model.reactions
+    model = convert_ids(model, 'simpheny')
+    assert 'ac_b' not in model.metabolites
+    assert len(model.reactions) == n_reactions
+    assert all(not x.id.endswith('_b') for r in model.reactions for x in r.metabolites)
+
+def test_load_model_derived_id_style(tmpdir, monkeypatch):
+    cache = ModelCache(directory=str(tmpdir))
+    monkeypatch.setattr(theseus.models, 'model_cache', cache)
+    monkeypatch.setattr(theseus.models, '_id_maps', OrderedDict())
+    canonical = load_model('E coli core')
+    # made from the canonical model, by renaming
+    model = load_model('E coli core', id_style='simpheny')
+    direct = load_model('E coli core', id_style='simpheny', use_cache=False)
+    assert [x.id for x in model.reactions] == [x.id for x in direct.reactions]
+    assert [x.id for x in model.metabolites] == [x.id for x in direct.metabolites]
+    assert ([x.lower_bound for x in model.reactions] ==
+            [x.lower_bound for x in direct.reactions])
+    assert 'EX_lac-D(e)' in model.reactions
+    assert 'EX_lac__D_e' in canonical.reactions
+    assert len([x for x in tmpdir.listdir() if x.ext == '.ids']) == 1
+
+def test_id_maps_bounded(monkeypatch):
+    monkeypatch.setattr(theseus.models, '_id_maps', OrderedDict())
+    monkeypatch.setattr(theseus.models, 'max_id_maps', 1)
+    get_id_maps('E coli core')
+    get_id_maps('iJO1366')
+    assert [x[0] for x in theseus.models._id_maps] == ['iJO1366']
+    # a newer key for a model replaces the old one
+    theseus.models._put_cached_id_maps(('iJO1366', 'ids', 0, ()), None)
+    assert list(theseus.models._id_maps) == [('iJO1366', 'ids', 0, ())]
+
+def test_translate_ids():
+    assert translate_ids('E coli core', ['EX_lac__D_e', 'lac__D_e'],
+                         'cobrapy', 'simpheny') == ['EX_lac-D(e)', 'lac-D[e]']
+    assert translate_ids('e_coli_core', ['lac-D[e]'], 'simpheny', 'cobrapy',
+                         kind='metabolite') == ['lac__D_e']
+    with pytest.raises(Exception):
+        translate_ids('E coli core', ['EX_lac__D_e'], 'cobrapy', 'simpheny',
+                      kind='metabolite')
+    with pytest.raises(Exception):
+        translate_ids('E coli core', ['not_an_id'], 'cobrapy', 'simpheny')
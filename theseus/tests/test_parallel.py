@@ -0,0 +1,37 @@
+from theseus.parallel import *
+from theseus.models import load_model, setup_model
+
+def test_parallel_runner():
+    model = setup_model(load_model('E coli core'), 'EX_glc_e')
+    progress = []
+    with ParallelRunner(model, workers=2, chunksize=2,
+                        progress=lambda done, total: progress.append((done, total))) as runner:
+        conditions = [('EX_glc_e', True, sur) for sur in range(1, 6)]
+        results = sorted(runner.scenarios(conditions), key=lambda x: x['index'])
+        assert [r['sur'] for r in results] == list(range(1, 6))
+        assert all(r['status'] == 'optimal' for r in results)
+        assert results[0]['f'] < results[-1]['f']
+        assert all(r['time'] >= 0 for r in results)
+        assert progress[-1] == (5, 5)
+
+        knockouts = sorted(runner.reaction_knockouts(['PGI', 'ENO', ['PGI', 'G6PDH2r']]),
+                           key=lambda x: x['index'])
+        f = model.optimize().f
+        assert knockouts[0]['f'] < f
+        assert knockouts[1]['status'] != 'optimal' or knockouts[1]['f'] < knockouts[0]['f']
+
+        gene = model.reactions.get_by_id('PGI').genes
+        result, = runner.gene_knockouts([[g.id for g in gene]])
+        assert 'PGI' in result['reactions']
+        assert abs(result['f'] - knockouts[0]['f']) < 1e-6
+
+    # the shared model is unchanged
+    assert model.reactions.get_by_id('PGI').upper_bound == 1000
+
+def test_parallel_pathways():
+    model = load_model('E coli core')
+    pathway = [{'ppal_c': {'formula': 'C3H6O'}}, {'EX_ppal_c': {'ppal_c': -1}}, {}, {}]
+    with ParallelRunner(model, workers=2) as runner:
+        result, = runner.pathways([pathway], condition='EX_glc_e', objective='EX_ppal_c')
+    assert result['status'] == 'optimal'
+    assert 'ppal_c' not in model.metabolites
@@ -0,0 +1,48 @@
+from theseus.scenarios import *
+from theseus.models import load_model, setup_model, condition_changes
+
+import pytest
+
+def test_condition_changes():
+    bounds, objective = condition_changes('iJO1366', ['EX_glc_e', 'EX_xyl__D_e'],
+                                          aerobic=False, sur=-18)
+    assert bounds['EX_glc_e'] == (-18, None)
+    assert bounds['EX_xyl__D_e'] == (-18, None)
+    assert bounds['EX_o2_e'] == (0, None)
+    assert bounds['CAT'] == (0, 0)
+    assert objective is None
+
+    bounds, objective = condition_changes('iJO1366', 'EX_glc_e')
+    assert 'CAT' not in bounds
+    assert bounds['EX_o2_e'] == (-10, None)
+
+    bounds, objective = condition_changes('iJR904', {'EX_glc_e': 5})
+    assert bounds['EX_glc_e'] == (-5, None)
+    assert objective == {'BIOMASS_Ecoli': 1}
+
+    with pytest.raises(Exception):
+        condition_changes('iJO1366', None)
+
+def test_iter_scenarios():
+    scenarios = list(iter_scenarios(['EX_glc_e',
+                                     ('EX_glc_e', False),
+                                     {'substrate_reactions': 'EX_glc_e', 'sur': 5}]))
+    assert scenarios[0] == Scenario('EX_glc_e', True, 10, 10)
+    assert scenarios[1].aerobic is False
+    assert scenarios[2].sur == 5
+
+def test_run_scenarios():
+    model = load_model('E coli core')
+    conditions = [('EX_glc_e', True, 10), ('EX_glc_e', False, 10), ('EX_glc_e', True, 5)]
+    results = list(run_scenarios(model, conditions))
+    assert [r['status'] for r in results] == ['optimal'] * 3
+    assert results[1]['f'] < results[0]['f']
+    assert results[2]['f'] < results[0]['f']
+
+    # same answers as setup_model on a copy
+    for condition, result in zip(conditions, results):
+        copy = setup_model(model.copy(), *condition)
+        assert abs(copy.optimize().f - result['f']) < 1e-6
+
+    # the model is unchanged
+    assert model.reactions.get_by_id('EX_glc_e').lower_bound == 0
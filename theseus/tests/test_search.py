@@ -0,0 +1,80 @@
+from theseus.search import *
+from theseus.catalog import ModelCatalog
+
+import os
+import shutil
+import pytest
+
+@pytest.fixture
+def index(tmpdir):
+    # a catalog with one model
+    models_directory = tmpdir.mkdir('models')
+    source = os.path.join(data_path, 'models', 'E coli core.xml')
+    shutil.copy2(source, str(models_directory))
+    catalog = ModelCatalog(str(models_directory), str(tmpdir.mkdir('model_pickles')),
+                           check_interval=0)
+    return SearchIndex(str(tmpdir.join('search.sqlite')), catalog)
+
+def test_normalize_formula():
+    assert normalize_formula('OH2') == 'H2O'
+    assert normalize_formula('H12O6C6') == 'C6H12O6'
+    assert normalize_formula('ClNa') == 'ClNa'
+    assert normalize_formula('not a formula') is None
+    assert normalize_formula(None) is None
+
+def test_search(index):
+    # nothing is indexed yet, and searching does not create the index
+    assert index.search('glc__D_e') == []
+    assert not os.path.exists(index.path)
+    assert index.update() == {'indexed': ['E coli core'], 'removed': [], 'failed': []}
+    hits = index.search('glc__D_e')
+    assert [(x.model, x.kind, x.id) for x in hits] == [('E coli core', 'metabolite', 'glc__D_e')]
+    # any id style, any case
+    assert index.search('EX_GLC(E)', field='id')[0].id == 'EX_glc_e'
+    hits = index.search('OH2', field='formula')
+    assert set(x.id for x in hits) == {'h2o_c', 'h2o_e'}
+    hits = index.search('glucose', field='name', kind='metabolite')
+    assert 'glc__D_e' in [x.id for x in hits]
+    assert len(index.search('gluc', field='name', prefix=True, limit=2)) == 2
+    assert all(x.kind == 'reaction' for x in index.search('e', field='compartment',
+                                                          kind='reaction'))
+    assert index.search('glc__D_e', models=['iJO1366']) == []
+    with pytest.raises(Exception):
+        index.search('glc__D_e', field='charge')
+
+def test_update(index):
+    index.update()
+    assert index.update() == {'indexed': [], 'removed': [], 'failed': []}
+    # a new source file
+    path = os.path.join(index.catalog.models_directory, 'E coli core.xml')
+    st = os.stat(path)
+    os.utime(path, (st.st_atime, st.st_mtime + 10))
+    index.catalog.refresh(force=True)
+    assert index.update()['indexed'] == ['E coli core']
+    # removed from the catalog
+    os.remove(path)
+    index.catalog.refresh(force=True)
+    assert index.update()['removed'] == ['E coli core']
+    assert index.search('glc__D_e') == []
+
+def test_update_catalog(index):
+    # a model that is only in the catalog of the index
+    shutil.copy2(os.path.join(index.catalog.models_directory, 'E coli core.xml'),
+                 os.path.join(index.catalog.models_directory, 'my core.xml'))
+    index.catalog.refresh(force=True)
+    assert index.update() == {'indexed': ['E coli core', 'my core'], 'removed': [],
+                              'failed': []}
+    assert [x.model for x in index.search('glc__D_e')] == ['E coli core', 'my core']
+
+def test_concurrent_update(index):
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(2) as executor:
+        results = list(executor.map(lambda _: index.update(), range(2)))
+    assert sorted(x['indexed'] for x in results) == [[], ['E coli core']]
+
+def test_search_read_only(index):
+    index.update()
+    connection = index._connect_read_only()
+    with pytest.raises(Exception):
+        connection.execute('DELETE FROM models')
+    connection.close()
@@ -0,0 +1,219 @@
+from theseus.server import *
+from theseus.catalog import ModelCatalog
+
+from concurrent.futures import ThreadPoolExecutor
+from tornado.testing import AsyncHTTPTestCase, gen_test, bind_unused_port
+import tornado.httpclient
+import threading
+import os
+import pickle
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+class ServerTestCase(AsyncHTTPTestCase):
+    def get_app(self):
+        application.settings['loader'] = ModelLoader(ThreadPoolExecutor(2), max_queue=2)
+        return application
+
+    def test_get_model(self):
+        response = self.fetch('/models/e_coli_core?id_style=simpheny')
+        assert response.code == 200
+        model = pickle.loads(response.body)
+        assert 'EX_glc(e)' in model.reactions
+
+    def test_get_model_not_found(self):
+        assert self.fetch('/models/not_a_model').code == 404
+
+    def test_get_models(self):
+        response = self.fetch('/models')
+        assert 'iJO1366' in json.loads(response.body.decode('utf-8'))['models']
+        response = self.fetch('/models?details=true')
+        assert 'xml' in json.loads(response.body.decode('utf-8'))['formats']['iJO1366']
+
+    def test_overloaded(self):
+        application.settings['loader'].max_queue = 0
+        assert self.fetch('/models/e_coli_core').code == 503
+
+    @gen_test
+    def test_coalesce(self):
+        calls = []
+        event = threading.Event()
+        def load(model_name, id_style):
+            calls.append(model_name)
+            event.wait()
+            return b'model'
+        loader = ModelLoader(ThreadPoolExecutor(2), max_queue=1, load=load)
+        future = loader.load('iJO1366', 'cobrapy')
+        assert loader.load('iJO1366', 'cobrapy') is future
+        with self.assertRaises(Overloaded):
+            loader.load('iJO1366', 'simpheny')
+        event.set()
+        assert (yield future) == b'model'
+        assert calls == ['iJO1366']
+
+class ResponseTestCase(AsyncHTTPTestCase):
+    def get_app(self):
+        application.settings['loader'] = ModelLoader(ThreadPoolExecutor(2), max_queue=4)
+        application.settings['body_cache'] = BodyCache()
+        return application
+
+    def test_body_cache(self):
+        self.fetch('/models/e_coli_core')
+        self.fetch('/models/e_coli_core')
+        self.fetch('/models/e_coli_core?format=json')
+        stats = json.loads(self.fetch('/stats').body.decode('utf-8'))['response_cache']
+        assert stats['hits'] == 1
+        assert stats['misses'] == 2
+        assert stats['entries'] == 2
+
+    @gen_test
+    def test_warm_cache(self):
+        yield warm_cache(application, ['e_coli_core:simpheny', 'not_a_model'])
+        assert application.settings['body_cache'].stats()['entries'] == 2
+
+    def test_json(self):
+        response = self.fetch('/models/e_coli_core', headers={'Accept': 'application/json'})
+        assert response.headers['Content-Type'] == 'application/json'
+        assert 'reactions' in json.loads(response.body.decode('utf-8'))
+        response = self.fetch('/models/e_coli_core?format=json')
+        assert response.headers['Content-Type'] == 'application/json'
+
+    def test_pickle_protocol(self):
+        response = self.fetch('/models/e_coli_core?protocol=%d' % pickle.HIGHEST_PROTOCOL)
+        assert pickle.loads(response.body) is not None
+        response = self.fetch('/models/e_coli_core',
+                              headers={'Accept': 'application/x-python-pickle; protocol=0'})
+        assert not response.body.startswith(b'\x80')
+        assert self.fetch('/models/e_coli_core').body.startswith(b'\x80\x02')
+        assert self.fetch('/models/e_coli_core?protocol=99').code == 400
+        assert self.fetch('/models/e_coli_core?format=xls').code == 400
+
+    def test_gzip(self):
+        response = self.fetch('/models/e_coli_core', decompress_response=False,
+                              headers={'Accept-Encoding': 'gzip'})
+        assert response.headers['Content-Encoding'] == 'gzip'
+        assert pickle.loads(zlib.decompress(response.body, 16 + zlib.MAX_WBITS)) is not None
+
+    def test_not_modified(self):
+        response = self.fetch('/models/e_coli_core')
+        etag = response.headers['Etag']
+        last_modified = response.headers['Last-Modified']
+        response = self.fetch('/models/e_coli_core', headers={'If-None-Match': etag})
+        assert response.code == 304
+        response = self.fetch('/models/e_coli_core', headers={'If-Modified-Since': last_modified})
+        assert response.code == 304
+        # a different format has a different etag
+        response = self.fetch('/models/e_coli_core?format=json', headers={'If-None-Match': etag})
+        assert response.code == 200
+
+    def test_metrics(self):
+        sink = metrics.HistogramSink()
+        metrics.enable(sink)
+        try:
+            self.fetch('/models/e_coli_core')
+            self.fetch('/models/e_coli_core')
+            text = self.fetch('/metrics').body.decode('utf-8')
+        finally:
+            metrics.disable()
+        # labelled with the name from check_for_model
+        assert 'theseus_stage_seconds_count{stage="request",model="E coli core"} 2' in text
+        assert 'theseus_response_cache_hits_total{model="E coli core"} 1' in text
+        assert 'theseus_bytes_served_total{model="E coli core"}' in text
+        assert 'theseus_response_cache_entries 1' in text
+
+class SharedResponseTestCase(AsyncHTTPTestCase):
+    def get_app(self):
+        self.directory = tempfile.mkdtemp()
+        cache = SharedBodyCache(self.directory)
+        application.settings['body_cache'] = cache
+        application.settings['loader'] = ModelLoader(ThreadPoolExecutor(2), max_queue=4,
+                                                     load=partial(load_shared_body, cache))
+        return application
+
+    def tearDown(self):
+        AsyncHTTPTestCase.tearDown(self)
+        application.settings['body_cache'] = None
+        application.settings['loader'] = None
+        shutil.rmtree(self.directory)
+
+    def test_shared_body_cache(self):
+        body = self.fetch('/models/e_coli_core').body
+        assert pickle.loads(body) is not None
+        # served from the memory-mapped file
+        assert self.fetch('/models/e_coli_core').body == body
+        stats = application.settings['body_cache'].stats()
+        assert stats['builds'] == 1
+        assert stats['entries'] == 1
+
+class SearchTestCase(AsyncHTTPTestCase):
+    def get_app(self):
+        # an index of a catalog with one model
+        self.directory = tempfile.mkdtemp()
+        for directory in 'models', 'model_pickles':
+            os.mkdir(os.path.join(self.directory, directory))
+        shutil.copy2(os.path.join(models.data_path, 'models', 'E coli core.xml'),
+                     os.path.join(self.directory, 'models'))
+        catalog = ModelCatalog(os.path.join(self.directory, 'models'),
+                               os.path.join(self.directory, 'model_pickles'))
+        application.settings['search_index'] = search.SearchIndex(
+            os.path.join(self.directory, 'search.sqlite'), catalog)
+        return application
+
+    def tearDown(self):
+        AsyncHTTPTestCase.tearDown(self)
+        application.settings['search_index'] = None
+        shutil.rmtree(self.directory)
+
+    def test_search(self):
+        # not indexed until the update
+        response = self.fetch('/search?q=EX_glc(e)')
+        assert json.loads(response.body.decode('utf-8'))['results'] == []
+        self.io_loop.run_sync(lambda: update_search_index(application))
+        response = self.fetch('/search?q=EX_glc(e)&field=id&kind=reaction')
+        results = json.loads(response.body.decode('utf-8'))['results']
+        assert [(x['model'], x['id']) for x in results] == [('E coli core', 'EX_glc_e')]
+        assert self.fetch('/search?q=glc&field=charge').code == 400
+
+def test_model_validators(tmpdir, monkeypatch):
+    monkeypatch.setattr(models, 'data_path', str(tmpdir))
+    tmpdir.mkdir('models').join('x.xml').write('<sbml/>')
+    etag, last_modified = model_validators('x', 'cobrapy', 'pickle')
+    assert etag is not None
+    # the files derived by the first load do not change the validators
+    tmpdir.mkdir('model_pickles').join('x.theseus').write('derived')
+    assert model_validators('x', 'cobrapy', 'pickle') == (etag, last_modified)
+    assert model_validators('x', 'cobrapy', 'json')[0] != etag
+    assert model_validators('y', 'cobrapy', 'pickle') == (None, None)
+
+def test_processes(tmpdir):
+    sock, port = bind_unused_port()
+    sock.close()
+    server = subprocess.Popen([sys.executable, '-m', 'theseus.server', '--port=%d' % port,
+                               '--processes=2', '--update_search=false',
+                               '--spill_dir=%s' % tmpdir],
+                              stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                              preexec_fn=os.setsid)
+    try:
+        client = tornado.httpclient.HTTPClient()
+        url = 'http://127.0.0.1:%d/models/e_coli_core' % port
+        for _ in range(300):
+            try:
+                response = client.fetch(url)
+                break
+            except Exception:
+                assert server.poll() is None, server.stdout.read()
+                time.sleep(0.1)
+        bodies = [response.body] + [client.fetch(url).body for _ in range(4)]
+        assert len(set(bodies)) == 1
+        assert 'EX_glc_e' in pickle.loads(bodies[0]).reactions
+        assert server.poll() is None
+        client.close()
+    finally:
+        os.killpg(server.pid, signal.SIGTERM)
+        server.wait()
+    # no process crashed
+    assert b'Traceback' not in server.stdout.read()
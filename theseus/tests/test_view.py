@@ -0,0 +1,26 @@
+from theseus.view import *
+from theseus.models import load_model, load_model_view
+
+import cobra
+
+def test_load_model_view():
+    model = load_model('E coli core', id_style='simpheny')
+    view = load_model_view('E coli core', id_style='simpheny')
+    assert view.reaction_ids == [x.id for x in model.reactions]
+    assert view.metabolite_ids == [x.id for x in model.metabolites]
+    assert list(view.lower_bounds) == [x.lower_bound for x in model.reactions]
+    assert view.bounds.shape == (len(model.reactions), 2)
+    assert view.S.shape == (len(model.metabolites), len(model.reactions))
+
+    # reactions are created on access
+    reaction = view.reactions.get_by_id('EX_glc(e)')
+    assert reaction is view.reactions.get_by_id('EX_glc(e)')
+    assert reaction.lower_bound == model.reactions.get_by_id('EX_glc(e)').lower_bound
+    assert [x.id for x in reaction.metabolites] == ['glc-D[e]']
+    assert 'EX_glc(e)' in view.reactions
+    assert len(view.metabolites) == len(model.metabolites)
+
+    # promote to a full model
+    model_2 = view.to_model()
+    assert isinstance(model_2, cobra.Model)
+    assert len(model_2.reactions) == len(model.reactions)
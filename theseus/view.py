@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+
+"""Array-backed, read-only views of processed models."""
+
+from theseus.compact import CompactModel
+
+import numpy as np
+
+class LazyList(object):
+    """A read-only list of cobra objects that are created on first access.
+
+    Supports len, iteration, indexing, `in` with ids, and get_by_id.
+
+    """
+
+    def __init__(self, ids, make):
+        self._ids = ids
+        self._make = make
+        self._index = None
+        self._objects = {}
+
+    def _get_index(self):
+        if self._index is None:
+            self._index = {x: i for i, x in enumerate(self._ids)}
+        return self._index
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self._ids)
+        if not 0 <= i < len(self._ids):
+            raise IndexError(i)
+        try:
+            return self._objects[i]
+        except KeyError:
+            obj = self._objects[i] = self._make(i)
+            return obj
+
+    def __iter__(self):
+        for i in range(len(self._ids)):
+            yield self[i]
+
+    def __contains__(self, id):
+        return getattr(id, 'id', id) in self._get_index()
+
+    def index(self, id):
+        try:
+            return self._get_index()[getattr(id, 'id', id)]
+        except KeyError:
+            raise ValueError('%s not found' % id)
+
+    def get_by_id(self, id):
+        return self[self._get_index()[id]]
+
+    def list_attr(self, attribute):
+        return [getattr(x, attribute) for x in self]
+
+class ModelView(object):
+    """A read-only view of a model in a compact model file.
+
+    Ids, bounds, objective coefficients and the stoichiometric matrix are
+    available as lists and arrays, straight from the memory-mapped file.
+    Reaction and Metabolite objects are only created when they are accessed,
+    and are not connected to a cobra.Model, so changing them does not change
+    the view. Use to_model to get a full cobra.Model.
+
+    """
+
+    def __init__(self, path):
+        self._compact = CompactModel(path)
+        strings = self._compact.strings
+        arrays = self._compact.arrays
+        self.id = strings['model']['id']
+        self.reaction_ids = strings['reactions']['id']
+        self.metabolite_ids = strings['metabolites']['id']
+        self.lower_bounds = arrays['lower_bound']
+        self.upper_bounds = arrays['upper_bound']
+        self.objective_coefficients = arrays['objective_coefficient']
+        self.reactions = LazyList(self.reaction_ids, self._make_reaction)
+        self.metabolites = LazyList(self.metabolite_ids, self._make_metabolite)
+
+    def __str__(self):
+        return str(self.id)
+
+    @property
+    def bounds(self):
+        """An (n_reactions, 2) array of lower and upper bounds"""
+        return np.column_stack((self.lower_bounds, self.upper_bounds))
+
+    @property
+    def S(self):
+        """The stoichiometric matrix, as a scipy.sparse.csc_matrix (metabolites
+        by reactions)"""
+        from scipy.sparse import csc_matrix
+        arrays = self._compact.arrays
+        return csc_matrix((arrays['data'], arrays['indices'], arrays['indptr']),
+                          shape=(len(self.metabolite_ids), len(self.reaction_ids)))
+
+    def reaction_metabolites(self, i):
+        """Get (metabolite indices, coefficients) arrays for reaction i"""
+        arrays = self._compact.arrays
+        start, stop = arrays['indptr'][i], arrays['indptr'][i + 1]
+        return arrays['indices'][start:stop], arrays['data'][start:stop]
+
+    def _make_metabolite(self, i):
+        import cobra
+        columns = self._compact.strings['metabolites']
+        metabolite = cobra.Metabolite(columns['id'][i])
+        for attribute, values in columns.items():
+            if attribute != 'id':
+                setattr(metabolite, attribute, values[i])
+        return metabolite
+
+    def _make_reaction(self, i):
+        import cobra
+        columns = self._compact.strings['reactions']
+        reaction = cobra.Reaction(columns['id'][i])
+        for attribute, values in columns.items():
+            if attribute != 'id':
+                setattr(reaction, attribute, values[i])
+        reaction.lower_bound = float(self.lower_bounds[i])
+        reaction.upper_bound = float(self.upper_bounds[i])
+        reaction.objective_coefficient = float(self.objective_coefficients[i])
+        indices, coefficients = self.reaction_metabolites(i)
+        for j, coefficient in zip(indices.tolist(), coefficients.tolist()):
+            metabolite = self.metabolites[j]
+            reaction._metabolites[metabolite] = coefficient
+            metabolite._reaction.add(reaction)
+        return reaction
+
+    def to_model(self):
+        """Build a full cobra.Model"""
+        return self._compact.to_model()